@@ -0,0 +1,131 @@
+import os
+import json
+import time
+import tempfile
+import platform
+
+import numpy as np
+import torch
+from torch_geometric.data import Data, Batch
+from transformers import BertConfig, BertModel
+
+## Same as `utils.MAX_LEN` and `MAX_LEN_SEQ` in `utils.preprocessing_for_bert_seq`
+MAX_LEN = 40
+MAX_LEN_SEQ = 384
+
+SPECIAL_TOKENS = ["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]"]
+
+def make_tiny_bert(path=None, hidden_size=64, num_hidden_layers=2, num_attention_heads=4, intermediate_size=128, n_words=2000, seed=0):
+	"""
+	Write a randomly initialised BERT (weights, config and `vocab.txt`) to `path`,
+	usable as `--bertVersion path` without network access. Returns the path.
+	"""
+	if path is None:
+		path = tempfile.mkdtemp(prefix="tiny_bert_")
+	if os.path.isfile(os.path.join(path, "config.json")):
+		return path
+	os.makedirs(path, exist_ok=True)
+
+	vocab = SPECIAL_TOKENS + [chr(c) for c in range(ord("a"), ord("z") + 1)] + ["w{}".format(i) for i in range(n_words)]
+	with open(os.path.join(path, "vocab.txt"), "w") as fw:
+		fw.write("\n".join(vocab) + "\n")
+
+	torch.manual_seed(seed)
+	config = BertConfig(
+		vocab_size=len(vocab),
+		hidden_size=hidden_size,
+		num_hidden_layers=num_hidden_layers,
+		num_attention_heads=num_attention_heads,
+		intermediate_size=intermediate_size,
+		max_position_embeddings=max(512, MAX_LEN_SEQ)
+	)
+	BertModel(config).save_pretrained(path)
+	return path
+
+def random_tree(n_nodes, rng):
+	"""Edge index of a random tree rooted at node 0, same layout as `preprocess.constructMat_txt`."""
+	if n_nodes <= 1:
+		return np.array([[0], [0]])
+	parents = [rng.randint(0, child) for child in range(1, n_nodes)]
+	return np.array([parents, list(range(1, n_nodes))])
+
+def make_graph(n_nodes, vocab_size, n_classes=4, rng=None):
+	"""A `Data` object shaped like the output of `CommentTreeDataset.__getitem__`."""
+	rng = np.random.RandomState(0) if rng is None else rng
+	cls_id, sep_id = SPECIAL_TOKENS.index("[CLS]"), SPECIAL_TOKENS.index("[SEP]")
+
+	input_ids = rng.randint(len(SPECIAL_TOKENS), vocab_size, size=(n_nodes, MAX_LEN))
+	input_ids[:, 0] = cls_id
+	input_ids[:, -1] = sep_id
+	input_ids_seq = rng.randint(len(SPECIAL_TOKENS), vocab_size, size=(1, MAX_LEN_SEQ))
+	input_ids_seq[:, 0] = cls_id
+
+	return Data(
+		edge_index=torch.LongTensor(random_tree(n_nodes, rng)),
+		y=torch.LongTensor([rng.randint(n_classes)]),
+		rootindex=torch.LongTensor([0]),
+		input_ids=torch.LongTensor(input_ids),
+		attention_mask=torch.ones(n_nodes, MAX_LEN, dtype=torch.long),
+		input_ids_seq=torch.LongTensor(input_ids_seq),
+		attention_mask_seq=torch.ones(1, MAX_LEN_SEQ, dtype=torch.long),
+		num_nodes=n_nodes
+	)
+
+def make_batch(tree_size, batch_size, vocab_size, n_classes=4, seed=0):
+	rng = np.random.RandomState(seed)
+	return Batch.from_data_list([make_graph(tree_size, vocab_size, n_classes, rng) for _ in range(batch_size)])
+
+def build_model(model_name, bert_path, n_classes=4, dropout_gat=0.5):
+	"""Build the same models as `DUCK.init_model` on top of a (tiny) local encoder."""
+	from model.duck import CCCTNet
+	from model.bert_gat import SimpleGATBERTNet
+
+	hidden_size = BertConfig.from_pretrained(bert_path).hidden_size
+	if model_name == "CCCTNet":
+		return CCCTNet(
+			in_feats=hidden_size, hid_feats=hidden_size, out_feats=hidden_size,
+			D_in=hidden_size, D_H=64, D_out=n_classes, bert_version=bert_path
+		)
+	elif model_name == "Simple_GAT_BERT":
+		return SimpleGATBERTNet(
+			D_in=hidden_size, hid_feats=hidden_size, out_feats=hidden_size,
+			H=32, D_out=n_classes, gat_dropout=dropout_gat, bert_version=bert_path
+		)
+	raise ValueError("Unknown model {}".format(model_name))
+
+def time_fn(fn, warmup=2, repeat=10):
+	"""Run `fn` `warmup` + `repeat` times, return timing statistics (seconds) of the timed runs."""
+	for _ in range(warmup):
+		fn()
+	times = []
+	for _ in range(repeat):
+		start = time.perf_counter()
+		fn()
+		times.append(time.perf_counter() - start)
+	times = np.array(times)
+	return {
+		"repeat": repeat,
+		"mean": float(times.mean()),
+		"std": float(times.std()),
+		"min": float(times.min()),
+		"p50": float(np.percentile(times, 50)),
+		"p95": float(np.percentile(times, 95)),
+	}
+
+def environment():
+	return {
+		"python": platform.python_version(),
+		"torch": torch.__version__,
+		"machine": platform.machine(),
+		"processor": platform.processor(),
+		"cpu_count": os.cpu_count(),
+		"torch_threads": torch.get_num_threads(),
+	}
+
+def write_json(results, path):
+	if path is None:
+		return
+	os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+	with open(path, "w") as fw:
+		json.dump(results, fw, indent=2)
+	print("Results written to {}".format(path))
@@ -0,0 +1,134 @@
+"""
+Compile overhead vs steady-state speedup of `--compile` on CPU, with a tiny random BERT.
+
+	python -m benchmarks.compile --step train --tree_sizes 10,30,60 --batch_size 4 --output result/bench/compile.json
+
+Each run is a fresh process sharing `--cache_dir`: the first one compiles
+from scratch, the next ones (`--runs`) start from the cache. For each run
+the eager and compiled step times are measured over batches of every tree
+size, along with the time of the first compiled call of each shape
+(compilation included), the number of steps needed to amortise it and
+the graphs / graph breaks counted by Dynamo.
+"""
+import os
+import sys
+import json
+import argparse
+import tempfile
+import subprocess
+
+import torch
+import torch.nn.functional as F
+
+from compiler import compile_model, compile_stats
+from benchmarks.common import make_tiny_bert, make_batch, build_model, time_fn, environment, write_json
+
+def parse_args():
+	parser = argparse.ArgumentParser(description="torch.compile overhead & speedup of DUCK models")
+	parser.add_argument("--model", type=str, default="CCCTNet", choices=["CCCTNet", "Simple_GAT_BERT"])
+	parser.add_argument("--step", type=str, default="train", choices=["train", "eval"], help="train: forward + backward + Adam step, eval: forward under inference_mode")
+	parser.add_argument("--tree_sizes", type=str, default="10,30,60", help="comma separated number of nodes per tree, one batch shape each")
+	parser.add_argument("--batch_size", type=int, default=4)
+	parser.add_argument("--compile_mode", type=str, default="default", choices=["default", "reduce-overhead", "max-autotune"])
+	parser.add_argument("--runs", type=int, default=2, help="fresh processes, the first one with a cold cache")
+	parser.add_argument("--cache_dir", type=str, default=None, help="compile cache shared by the runs, a temporary directory when omitted")
+	parser.add_argument("--bert_path", type=str, default=None, help="local encoder, a tiny random BERT is created when omitted")
+	parser.add_argument("--threads", type=int, default=0, help="torch intra-op threads, 0 to keep the default")
+	parser.add_argument("--repeat", type=int, default=10)
+	parser.add_argument("--output", type=str, default=None, help="JSON file for the results")
+	parser.add_argument("--child", type=str, default=None, help=argparse.SUPPRESS) ## result file of a single run
+	return parser.parse_args()
+
+def make_step(model, step):
+	if step == "eval":
+		model.eval()
+		def run(batch):
+			with torch.inference_mode():
+				model(batch)
+		return run
+
+	model.train()
+	optimizer = torch.optim.Adam(model.parameters(), lr=1e-5)
+	def run(batch):
+		out = model(batch)
+		loss = F.nll_loss(out, batch.y)
+		optimizer.zero_grad()
+		loss.backward()
+		optimizer.step()
+	return run
+
+def run_once(args):
+	"""Measure eager, then compiled steps in this process."""
+	if args.threads > 0:
+		torch.set_num_threads(args.threads)
+	torch.manual_seed(0)
+	model = build_model(args.model, args.bert_path)
+	vocab_size = model.gnn.bert.config.vocab_size
+	tree_sizes = [int(n) for n in args.tree_sizes.split(",")]
+	batches = [make_batch(tree_size, args.batch_size, vocab_size, seed=tree_size) for tree_size in tree_sizes]
+
+	step = make_step(model, args.step)
+	eager = [time_fn(lambda: step(batch), warmup=1, repeat=args.repeat)["mean"] for batch in batches]
+
+	compiled = compile_model(model, mode=args.compile_mode, cache_dir=args.cache_dir)
+	step = make_step(model, args.step)
+	first_calls = []
+	for batch in batches:
+		stats = time_fn(lambda: step(batch), warmup=0, repeat=1) ## compilation (or cache lookup) + one step
+		first_calls.append(stats["mean"])
+	steady = [time_fn(lambda: step(batch), warmup=1, repeat=args.repeat)["mean"] for batch in batches]
+
+	overhead = sum(first - compiled_time for first, compiled_time in zip(first_calls, steady))
+	saving = sum(eager) - sum(steady) ## per pass over all shapes
+	return {
+		"compiled": compiled,
+		"tree_sizes": tree_sizes,
+		"eager_ms": [t * 1000 for t in eager],
+		"compiled_ms": [t * 1000 for t in steady],
+		"first_call_s": first_calls,
+		"speedup": sum(eager) / sum(steady),
+		"compile_overhead_s": overhead,
+		"break_even_steps": overhead / (saving / len(batches)) if saving > 0 else None,
+		**compile_stats(),
+	}
+
+def main():
+	args = parse_args()
+	if args.child is not None:
+		with open(args.child, "w") as fw:
+			json.dump(run_once(args), fw)
+		return
+
+	args.bert_path = args.bert_path or make_tiny_bert()
+	args.cache_dir = args.cache_dir or tempfile.mkdtemp(prefix="duck_compile_cache_")
+	runs = []
+	for k in range(args.runs):
+		result_path = os.path.join(tempfile.mkdtemp(prefix="duck_compile_run_"), "result.json")
+		cmd = [sys.executable, "-m", "benchmarks.compile", "--child", result_path, "--bert_path", args.bert_path, "--cache_dir", args.cache_dir]
+		for name in ["model", "step", "tree_sizes", "batch_size", "compile_mode", "threads", "repeat"]:
+			cmd += ["--{}".format(name), str(getattr(args, name))]
+		subprocess.check_call(cmd)
+		with open(result_path) as f:
+			result = json.load(f)
+		result["cache"] = "cold" if k == 0 else "warm"
+		runs.append(result)
+
+		print("\n*** Run {} ({} cache) ***".format(k + 1, result["cache"]))
+		print("{:>6s} {:>11s} {:>13s} {:>15s}".format("nodes", "eager (ms)", "compiled (ms)", "first call (s)"))
+		for tree_size, eager, compiled, first in zip(result["tree_sizes"], result["eager_ms"], result["compiled_ms"], result["first_call_s"]):
+			print("{:6d} {:11.2f} {:13.2f} {:15.2f}".format(tree_size, eager, compiled, first))
+		print("speedup {:.2f}x, compile overhead {:.1f}s, break-even after {} steps, {} graphs, {} graph breaks".format(
+			result["speedup"], result["compile_overhead_s"],
+			"{:.0f}".format(result["break_even_steps"]) if result["break_even_steps"] is not None else "never",
+			result.get("unique_graphs", "?"), result.get("graph_breaks", "?")
+		))
+
+	write_json({
+		"benchmark": "compile",
+		"config": vars(args),
+		"environment": environment(),
+		"runs": runs,
+	}, args.output)
+
+if __name__ == "__main__":
+	main()
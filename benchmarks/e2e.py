@@ -0,0 +1,199 @@
+"""
+End-to-end throughput benchmark with a regression gate.
+
+	python -m benchmarks.e2e --baseline benchmarks/baselines/e2e.json
+	python -m benchmarks.e2e --baseline benchmarks/baselines/e2e.json --update_baseline
+
+Generates a fixed synthetic dataset (`synthetic.py`), runs `preprocess.py`
+on it, trains `--epochs` epochs of a `DUCK` model on top of a tiny random
+encoder and evaluates it. Reports events/sec of building the graphs, trees/sec
+and tokens/sec of training and evaluation, and peak memory of each phase.
+Throughputs are measured in this process (no interpreter start-up or imports
+in the timings), after one untimed warm-up pass, as the median over
+`--repeats` passes (one per epoch for training).
+With `--baseline`, exits with status 1 when a throughput drops (or a peak
+memory grows) by more than `--tolerance` relative to the baseline, and with
+status 2 when the baseline file does not exist.
+Baselines are machine specific: record them on the machine that runs the gate.
+"""
+import os
+import sys
+import time
+import json
+import argparse
+import resource
+import statistics
+import tempfile
+import subprocess
+
+import torch
+
+from memory import read_proc_status, reset_peak_rss
+from benchmarks.common import make_tiny_bert, environment, write_json
+
+## Direction of each metric: +1 higher is better, -1 lower is better
+METRICS = {
+	"preprocess_events_per_sec": 1,
+	"train_trees_per_sec": 1,
+	"train_tokens_per_sec": 1,
+	"eval_trees_per_sec": 1,
+	"eval_tokens_per_sec": 1,
+	"preprocess_peak_rss_mb": -1,
+	"train_peak_rss_mb": -1,
+	"eval_peak_rss_mb": -1,
+}
+
+def parse_args():
+	parser = argparse.ArgumentParser(description="End-to-end DUCK benchmark on synthetic data")
+	parser.add_argument("--workdir", type=str, default=None, help="data, encoder & results of the run, a temporary directory when omitted")
+	parser.add_argument("--model", type=str, default="CCCTNet", choices=["CCCTNet", "Simple_GAT_BERT"])
+	parser.add_argument("--n_events", type=int, default=200)
+	parser.add_argument("--max_size", type=int, default=60, help="largest synthetic tree")
+	parser.add_argument("--seed", type=int, default=0)
+	parser.add_argument("--epochs", type=int, default=3, help="timed training epochs, after an untimed warm-up epoch")
+	parser.add_argument("--repeats", type=int, default=5, help="timed passes of graph building & evaluation, after an untimed warm-up pass")
+	parser.add_argument("--batchsize", type=int, default=4)
+	parser.add_argument("--threads", type=int, default=0, help="intra-op threads, 0 for auto")
+	parser.add_argument("--num_workers", type=int, default=0, help="DataLoader workers")
+	parser.add_argument("--baseline", type=str, default=None, help="baseline JSON to compare with")
+	parser.add_argument("--tolerance", type=float, default=0.1, help="allowed relative regression of each metric")
+	parser.add_argument("--update_baseline", action="store_true", help="write this run's metrics to --baseline instead of comparing")
+	parser.add_argument("--output", type=str, default=None, help="JSON file for the results")
+	return parser.parse_args()
+
+def peak_rss_mb():
+	_, peak = read_proc_status()
+	if peak is None: ## not Linux, peak of the whole process
+		peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+	return peak / 2 ** 20
+
+def run(cmd):
+	"""Run `cmd`, returns the resource usage of that process alone (and the children it waited for)."""
+	print("$ {}".format(" ".join(cmd)))
+	process = subprocess.Popen(cmd, stdout=subprocess.DEVNULL)
+	_, status, usage = os.wait4(process.pid, 0)
+	returncode = os.waitstatus_to_exitcode(status)
+	process.returncode = returncode ## reaped by `wait4` already
+	if returncode != 0:
+		raise subprocess.CalledProcessError(returncode, cmd)
+	return usage
+
+def time_build_graph(source, data_root, dataset, bench_dir):
+	"""Seconds of one sequential `preprocess.build_graph` pass (parse, construct & save every tree), in this process."""
+	import preprocess
+	args = argparse.Namespace(data_source=source, data_root=data_root, dataset=dataset)
+	start = time.perf_counter()
+	treeDic = preprocess.read_trees(args)
+	event, labelDic = preprocess.read_labels(args)
+	for eid in event:
+		if eid in treeDic:
+			preprocess.save_tree(bench_dir, eid, *preprocess.construct_tree(treeDic[eid]), labelDic[eid])
+	return time.perf_counter() - start
+
+def timed(fn, repeats):
+	"""Median seconds of `repeats` calls of `fn`, after an untimed warm-up call."""
+	fn()
+	return statistics.median(fn() for _ in range(repeats))
+
+def compare(metrics, baseline, tolerance):
+	"""Return the list of regressions of `metrics` against `baseline`."""
+	regressions = []
+	print("\n{:28s} {:>12s} {:>12s} {:>8s}".format("metric", "baseline", "current", "change"))
+	for name, direction in METRICS.items():
+		if name not in baseline or baseline[name] in (None, 0) or metrics.get(name) is None:
+			continue
+		change = metrics[name] / baseline[name] - 1
+		regressed = direction * change < -tolerance
+		print("{:28s} {:12.2f} {:12.2f} {:+7.1f}%{}".format(name, baseline[name], metrics[name], change * 100, "  REGRESSION" if regressed else ""))
+		if regressed:
+			regressions.append(name)
+	return regressions
+
+def main():
+	args = parse_args()
+	workdir = args.workdir or tempfile.mkdtemp(prefix="duck_e2e_")
+	dataset, source = "E2E", os.path.join(workdir, "source")
+	data_root, result_path = os.path.join(workdir, "data"), os.path.join(workdir, "result")
+	metrics = {}
+
+	## Data: synthetic threads -> preprocess.py
+	run([sys.executable, "synthetic.py", "--dataset", dataset, "--output", source, "--seed", str(args.seed),
+		"--n_events", str(args.n_events), "--max_size", str(args.max_size), "--shape", "mixed"])
+	preprocess = [sys.executable, "preprocess.py", "--data_source", source, "--data_root", data_root, "--dataset", dataset]
+	run(preprocess + ["--split_5_fold"])
+	run(preprocess + ["--make_label"])
+	usage = run(preprocess + ["--build_graph"])
+	metrics["preprocess_peak_rss_mb"] = usage.ru_maxrss / 1024 ## KiB on Linux
+	bench_dir = tempfile.mkdtemp(prefix="graph_", dir=workdir)
+	elapsed = timed(lambda: time_build_graph(source, data_root, dataset, bench_dir), args.repeats)
+	metrics["preprocess_events_per_sec"] = args.n_events / elapsed
+
+	## Training & evaluation, in this process
+	from train import DUCK, get_parser
+
+	bert_path = make_tiny_bert(os.path.join(workdir, "tiny_bert"))
+	train_args = get_parser().parse_args([
+		"--datasetName", dataset, "--baseDirectory", data_root, "--result_path", result_path,
+		"--mode", "CommentTree", "--modelName", args.model, "--bertVersion", bert_path,
+		"--n_epochs", str(args.epochs + 1), "--batchsize", str(args.batchsize), "--seed", str(args.seed),
+		"--intra_op_threads", str(args.threads), "--num_workers", str(args.num_workers), "--ckpt_every_min", "0",
+	])
+	duck = DUCK(train_args)
+	duck.setup()
+	train_set, test_set = duck.train_loader.dataset, duck.test_loader.dataset
+	train_tokens = sum(train_set.num_tokens(i) for i in range(len(train_set)))
+	test_tokens  = sum(test_set.num_tokens(i) for i in range(len(test_set)))
+
+	duck.train_epoch(0) ## warm-up
+	reset_peak_rss()
+	epoch_times = []
+	for epoch in range(1, args.epochs + 1):
+		start = time.perf_counter()
+		duck.train_epoch(epoch)
+		epoch_times.append(time.perf_counter() - start)
+	elapsed = statistics.median(epoch_times)
+	metrics["train_trees_per_sec"] = len(train_set) / elapsed
+	metrics["train_tokens_per_sec"] = train_tokens / elapsed
+	metrics["train_peak_rss_mb"] = peak_rss_mb()
+
+	def evaluate():
+		start = time.perf_counter()
+		duck.evaluate(args.epochs)
+		return time.perf_counter() - start
+	reset_peak_rss()
+	elapsed = timed(evaluate, args.repeats)
+	metrics["eval_trees_per_sec"] = len(test_set) / elapsed
+	metrics["eval_tokens_per_sec"] = test_tokens / elapsed
+	metrics["eval_peak_rss_mb"] = peak_rss_mb()
+	if torch.cuda.is_available():
+		metrics["device_peak_mb"] = torch.cuda.max_memory_allocated() / 2 ** 20
+
+	print("\n*** End-to-end ({} events, {} train / {} test trees) ***".format(args.n_events, len(train_set), len(test_set)))
+	for name, value in metrics.items():
+		print("{:28s} {:12.2f}".format(name, value))
+
+	write_json({
+		"benchmark": "e2e",
+		"config": vars(args),
+		"environment": environment(),
+		"metrics": metrics,
+	}, args.output)
+
+	if args.baseline is None:
+		return
+	if args.update_baseline:
+		write_json(metrics, args.baseline)
+		return
+	if not os.path.isfile(args.baseline):
+		print("No baseline at {}, record one with --update_baseline".format(args.baseline))
+		sys.exit(2)
+	with open(args.baseline) as f:
+		baseline = json.load(f)
+	regressions = compare(metrics, baseline, args.tolerance)
+	if regressions:
+		print("\n{} metric(s) regressed by more than {:.0f}%: {}".format(len(regressions), args.tolerance * 100, ", ".join(regressions)))
+		sys.exit(1)
+	print("\nNo regression beyond {:.0f}%".format(args.tolerance * 100))
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,158 @@
+"""
+Microbenchmarks of the training pipeline on CPU, with a tiny random BERT (no download needed).
+
+	python -m benchmarks.micro --tree_sizes 10,50,200 --batch_sizes 1,4,16 --output result/bench/micro.json
+
+Cases (`--cases`, all by default):
+	getitem      `CommentTreeDataset.__getitem__` (np.load + tokenization) of one tree
+	collate      PyG collation of `batch_size` trees
+	tokenize     `utils.preprocessing_for_bert_latest` of one tree
+	pad_reshape  `CCCTNet.pad_and_reshape_batch`
+	gat          the GAT layers & pooling of `SimpleGAT_BERT` (forward + backward)
+	ttransformer `TTransformerModel` on the padded batch (forward + backward)
+	train_step   a full `CCCTNet` train step (forward, backward, Adam step)
+"""
+import os
+import argparse
+import tempfile
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+from torch_geometric.data import Batch
+from torch_scatter import scatter_mean
+
+from benchmarks.common import make_tiny_bert, make_batch, random_tree, build_model, time_fn, environment, write_json
+
+CASES = ["getitem", "collate", "tokenize", "pad_reshape", "gat", "ttransformer", "train_step"]
+## Cases that do not depend on the batch size
+PER_TREE = {"getitem", "tokenize"}
+
+def parse_args():
+	parser = argparse.ArgumentParser(description="Microbenchmarks of DUCK data loading and model components")
+	parser.add_argument("--cases", type=str, default=",".join(CASES), help="comma separated, from: {}".format(", ".join(CASES)))
+	parser.add_argument("--tree_sizes", type=str, default="10,50,200", help="comma separated number of nodes per tree")
+	parser.add_argument("--batch_sizes", type=str, default="1,4,16", help="comma separated number of trees per batch")
+	parser.add_argument("--words", type=int, default=20, help="words per post of the generated trees")
+	parser.add_argument("--bert_path", type=str, default=None, help="local encoder, a tiny random BERT is created when omitted")
+	parser.add_argument("--threads", type=int, default=0, help="torch intra-op threads, 0 to keep the default")
+	parser.add_argument("--warmup", type=int, default=2)
+	parser.add_argument("--repeat", type=int, default=10)
+	parser.add_argument("--output", type=str, default=None, help="JSON file for the results")
+	return parser.parse_args()
+
+def write_trees(graph_path, n_trees, tree_size, words, rng):
+	"""Write trees in the `.npz` layout of `preprocess.build_graph`, returns their ids."""
+	os.makedirs(graph_path, exist_ok=True)
+	def post():
+		return " ".join("w{}".format(i) for i in rng.randint(0, 2000, size=words))
+	ids = []
+	for tree_id in range(n_trees):
+		np.savez(
+			"{}/{}.npz".format(graph_path, tree_id),
+			nodecontent=np.array([post() for _ in range(tree_size - 1)]), root=[post()],
+			edgematrix=random_tree(tree_size, rng), rootindex=0, y=rng.randint(4)
+		)
+		ids.append(tree_id)
+	return ids
+
+def main():
+	args = parse_args()
+	cases = [case for case in args.cases.split(",") if case]
+	unknown = set(cases) - set(CASES)
+	if unknown:
+		raise ValueError("Unknown cases {}".format(sorted(unknown)))
+	tree_sizes = [int(n) for n in args.tree_sizes.split(",")]
+	batch_sizes = [int(n) for n in args.batch_sizes.split(",")]
+	if args.threads > 0:
+		torch.set_num_threads(args.threads)
+	torch.manual_seed(0)
+
+	bert_path = args.bert_path or make_tiny_bert()
+	model = build_model("CCCTNet", bert_path)
+	model.train()
+	optimizer = torch.optim.Adam(model.parameters(), lr=1e-5)
+	vocab_size = model.gnn.bert.config.vocab_size
+	hidden_size = model.gnn.bert.config.hidden_size
+
+	data_dir = tempfile.mkdtemp(prefix="duck_bench_")
+	results = []
+	def record(case, tree_size, batch_size, fn, n_trees):
+		stats = time_fn(fn, warmup=args.warmup, repeat=args.repeat)
+		stats.update({"case": case, "tree_size": tree_size, "batch_size": batch_size})
+		stats["trees_per_sec"] = n_trees / stats["mean"]
+		stats["nodes_per_sec"] = n_trees * tree_size / stats["mean"]
+		results.append(stats)
+		print("{:12s} {:6d} {:6s} {:10.3f} {:10.3f} {:12.1f}".format(
+			case, tree_size, str(batch_size) if batch_size is not None else "-", stats["mean"] * 1000, stats["p95"] * 1000, stats["trees_per_sec"]
+		))
+
+	print("{:12s} {:>6s} {:>6s} {:>10s} {:>10s} {:>12s}".format("case", "nodes", "batch", "mean (ms)", "p95 (ms)", "trees/sec"))
+	for tree_size in tree_sizes:
+		## On-disk trees for the data loading cases
+		if {"getitem", "collate", "tokenize"} & set(cases):
+			from dataset import CommentTreeDataset
+			from utils import preprocessing_for_bert_latest
+
+			rng = np.random.RandomState(tree_size)
+			dataset_name = "bench{}".format(tree_size)
+			ids = write_trees("{}/{}graph".format(data_dir, dataset_name), max(batch_sizes), tree_size, args.words, rng)
+			dataset = CommentTreeDataset(
+				argparse.Namespace(datasetName=dataset_name, max_tree_len=tree_size, bertVersion=bert_path, timing=False),
+				ids, data_dir
+			)
+			trees = [dataset[i] for i in range(len(dataset))]
+
+		if "getitem" in cases:
+			record("getitem", tree_size, None, lambda: dataset[0], 1)
+		if "tokenize" in cases:
+			npz = np.load("{}/{}.npz".format(dataset.graph_path, ids[0]), allow_pickle=True)
+			root, nodecontent = npz["root"], npz["nodecontent"]
+			record("tokenize", tree_size, None, lambda: preprocessing_for_bert_latest(root, nodecontent, bert_path), 1)
+
+		for batch_size in batch_sizes:
+			if "collate" in cases:
+				record("collate", tree_size, batch_size, lambda: Batch.from_data_list(trees[:batch_size]), batch_size)
+
+			batch = make_batch(tree_size, batch_size, vocab_size)
+			bert_x = torch.randn(batch.num_nodes, hidden_size)
+			if "pad_reshape" in cases:
+				record("pad_reshape", tree_size, batch_size, lambda: model.pad_and_reshape_batch(batch, bert_x), batch_size)
+
+			if "gat" in cases:
+				gnn = model.gnn
+				x_in = torch.randn(batch.num_nodes, hidden_size, requires_grad=True)
+				def gat_step():
+					x = F.dropout(x_in, p=0.6, training=True)
+					x = F.elu(gnn.conv1(x, batch.edge_index))
+					x = F.dropout(x, p=0.6, training=True)
+					x = gnn.conv2(x, batch.edge_index)
+					scatter_mean(x, batch.batch, dim=0).sum().backward()
+				record("gat", tree_size, batch_size, gat_step, batch_size)
+
+			if "ttransformer" in cases:
+				padded, mask = model.pad_and_reshape_batch(batch, bert_x)
+				padded.requires_grad_(True)
+				def ttransformer_step():
+					model.bert_tt(batch, padded, mask)[:, 0, :].sum().backward()
+				record("ttransformer", tree_size, batch_size, ttransformer_step, batch_size)
+
+			if "train_step" in cases:
+				def train_step():
+					out = model(batch)
+					loss = F.nll_loss(out, batch.y)
+					optimizer.zero_grad()
+					loss.backward()
+					optimizer.step()
+				record("train_step", tree_size, batch_size, train_step, batch_size)
+
+	write_json({
+		"benchmark": "micro",
+		"bert_path": args.bert_path or "tiny",
+		"hidden_size": hidden_size,
+		"environment": environment(),
+		"results": results,
+	}, args.output)
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,81 @@
+"""
+Sweep torch intra-op thread counts and report train steps/sec of `CCCTNet` on this machine.
+
+	python -m benchmarks.thread_sweep --threads 1,2,4,8 --tree_size 20 --batch_size 2
+"""
+import argparse
+
+import torch
+import torch.nn.functional as F
+
+from cpu_utils import available_cores
+from benchmarks.common import make_tiny_bert, make_batch, build_model, time_fn, environment, write_json
+
+def parse_args():
+	parser = argparse.ArgumentParser(description="Thread-count sweep for CCCTNet train steps on CPU")
+	parser.add_argument("--threads", type=str, default=None, help="comma separated intra-op thread counts, default: powers of 2 up to the available cores")
+	parser.add_argument("--inter_op_threads", type=int, default=1)
+	parser.add_argument("--model", type=str, default="CCCTNet", choices=["CCCTNet", "Simple_GAT_BERT"])
+	parser.add_argument("--bert_path", type=str, default=None, help="local encoder, a tiny random BERT is created when omitted")
+	parser.add_argument("--tree_size", type=int, default=20)
+	parser.add_argument("--batch_size", type=int, default=2)
+	parser.add_argument("--warmup", type=int, default=2)
+	parser.add_argument("--repeat", type=int, default=10)
+	parser.add_argument("--output", type=str, default=None, help="JSON file for the results")
+	return parser.parse_args()
+
+def main():
+	args = parse_args()
+
+	n_cores = len(available_cores())
+	if args.threads is None:
+		thread_counts, n = [], 1
+		while n < n_cores:
+			thread_counts.append(n)
+			n *= 2
+		thread_counts.append(n_cores)
+	else:
+		thread_counts = [int(n) for n in args.threads.split(",")]
+
+	torch.set_num_interop_threads(args.inter_op_threads)
+	torch.manual_seed(0)
+
+	bert_path = args.bert_path or make_tiny_bert()
+	model = build_model(args.model, bert_path)
+	model.train()
+	optimizer = torch.optim.Adam(model.parameters(), lr=1e-5)
+	batch = make_batch(args.tree_size, args.batch_size, model.gnn.bert.config.vocab_size)
+
+	def step():
+		out = model(batch)
+		loss = F.nll_loss(out, batch.y)
+		optimizer.zero_grad()
+		loss.backward()
+		optimizer.step()
+
+	results = []
+	print("{:>8s}  {:>10s}  {:>10s}".format("threads", "step (ms)", "steps/sec"))
+	for n_threads in thread_counts:
+		torch.set_num_threads(n_threads)
+		stats = time_fn(step, warmup=args.warmup, repeat=args.repeat)
+		stats["threads"] = n_threads
+		stats["steps_per_sec"] = 1.0 / stats["mean"]
+		results.append(stats)
+		print("{:8d}  {:10.2f}  {:10.2f}".format(n_threads, stats["mean"] * 1000, stats["steps_per_sec"]))
+
+	best = max(results, key=lambda r: r["steps_per_sec"])
+	print("Best: {} intra-op threads, {:.2f} steps/sec".format(best["threads"], best["steps_per_sec"]))
+
+	write_json({
+		"benchmark": "thread_sweep",
+		"model": args.model,
+		"tree_size": args.tree_size,
+		"batch_size": args.batch_size,
+		"inter_op_threads": args.inter_op_threads,
+		"environment": environment(),
+		"results": results,
+		"best": best,
+	}, args.output)
+
+if __name__ == "__main__":
+	main()
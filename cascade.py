@@ -0,0 +1,187 @@
+"""
+Confidence-gated cascade: a cheap model first, the full model only for the threads it is unsure about.
+
+	python cascade.py --cheap ./result/ckpt/twitter15_fold0_Simple_GAT_BERT/best.pt --full ./result/ckpt/twitter15_fold0_CCCTNet/best.pt --max_acc_drop 0.01 --output cascade.json
+
+The cheap stage is any checkpoint trained with a small encoder (`--bertVersion`
+of a 4/6-layer BERT) and a short `--max_tree_len` (0 for the source tweet
+only), typically `Simple_GAT_BERT`: it only tokenizes and encodes the source
+and the first few replies. A thread is answered by the cheap stage when its
+largest class probability reaches `threshold`, by the full model otherwise.
+
+The threshold is tuned on a calibration part (`--calib_frac`) of the test
+split of the full model's fold: the lowest threshold whose cascade accuracy
+reaches `--target_acc` (or the full model's accuracy minus `--max_acc_drop`).
+The cascade is then run on the rest of the split and compared with the full
+model alone: accuracy, macro F1, fraction of threads served by the cheap
+stage and throughput (tokenization included).
+"""
+import sys
+import json
+import time
+import argparse
+
+import numpy as np
+import torch
+from tqdm import tqdm
+from torch_geometric.data import Batch
+
+from utils import evaluationRumour4
+from dataset import make_comment_tree
+from evaluate import load_checkpoint, format_metrics
+
+def parse_args():
+	parser = argparse.ArgumentParser(description="Cheap-first cascade of two DUCK checkpoints")
+	parser.add_argument("--cheap", type=str, required=True, help="checkpoint of the cheap stage (small encoder, short --max_tree_len)")
+	parser.add_argument("--full", type=str, required=True, help="checkpoint of the full model, e.g. CCCTNet")
+	parser.add_argument("--cheap_replies", type=int, default=None, help="replies seen by the cheap stage, default: its training --max_tree_len")
+	parser.add_argument("--threshold", type=float, default=None, help="confidence threshold, tuned on the calibration part when omitted")
+	parser.add_argument("--target_acc", type=float, default=None, help="accuracy the cascade must reach on the calibration part")
+	parser.add_argument("--max_acc_drop", type=float, default=0.01, help="without --target_acc, accuracy lost at most w.r.t. the full model")
+	parser.add_argument("--calib_frac", type=float, default=0.5, help="part of the test split used to tune the threshold")
+	parser.add_argument("--seed", type=int, default=0, help="seed of the calibration / evaluation split")
+	parser.add_argument("--baseDirectory", type=str, default=None, help="the data directory, default: the one used for training")
+	parser.add_argument("--batch_trees", type=int, default=32, help="threads per batch")
+	parser.add_argument("--quantize", type=str, default=None, choices=["int8"], help="dynamic quantization of the encoders for CPU inference")
+	parser.add_argument("--output", type=str, default=None, help="JSON file for the threshold and the report")
+	return parser.parse_args()
+
+class Cascade:
+	"""
+	Score raw threads `(event_id, root, nodecontent, edgematrix, y, rootindex)` with `cheap`,
+	then with `full` for the threads whose largest cheap probability is below `threshold`.
+	`cheap` and `full` are `(args, model)` pairs: each stage builds its trees with its own
+	`max_tree_len` and tokenizer. `n_cheap` / `n_total` count the threads seen so far.
+	"""
+	def __init__(self, cheap, full, threshold, device):
+		self.cheap = cheap
+		self.full = full
+		self.threshold = threshold
+		self.device = device
+		self.n_cheap = 0
+		self.n_total = 0
+
+	def batch(self, stage, threads):
+		args, _ = stage
+		return Batch.from_data_list([
+			make_comment_tree(root, nodecontent, edgematrix, y, rootindex, args.max_tree_len, args.bertVersion, event_id=event_id)
+			for event_id, root, nodecontent, edgematrix, y, rootindex in threads
+		]).to(self.device)
+
+	def probs(self, stage, threads):
+		"""Class probabilities of one stage alone."""
+		return stage[1](self.batch(stage, threads)).exp()
+
+	@torch.inference_mode()
+	def __call__(self, threads):
+		"""Class probabilities of `threads` and a mask of the ones answered by the cheap stage."""
+		probs = self.probs(self.cheap, threads)
+		accepted = probs.max(dim=-1).values >= self.threshold
+		uncertain = (~accepted).nonzero().view(-1)
+		if len(uncertain) > 0:
+			probs[uncertain] = self.probs(self.full, [threads[k] for k in uncertain.tolist()])
+		self.n_cheap += int(accepted.sum())
+		self.n_total += len(threads)
+		return probs, accepted
+
+def load_threads(args, event_ids):
+	"""Raw threads of a fold, read once so that the timings below leave out the disk."""
+	graph_path = "{}/{}graph".format(args.baseDirectory, args.datasetName)
+	threads = []
+	for event_id in event_ids:
+		data = np.load("{}/{}.npz".format(graph_path, event_id), allow_pickle=True)
+		threads.append((str(event_id), data["root"], data["nodecontent"], data["edgematrix"], int(data["y"]), int(data["rootindex"])))
+	return threads
+
+def batches(threads, batch_trees):
+	for k in range(0, len(threads), batch_trees):
+		yield threads[k:k + batch_trees]
+
+def calibrate(confidence, cheap_pred, full_pred, y, target_acc):
+	"""
+	Lowest threshold (most traffic on the cheap stage) whose cascade accuracy reaches `target_acc`,
+	None when even the full model alone does not reach it.
+	"""
+	order = np.argsort(-confidence)
+	confidence, cheap_correct, full_correct = confidence[order], (cheap_pred == y)[order], (full_pred == y)[order]
+	## Accepting the k most confident threads: cheap answers for the first k, full ones for the rest
+	correct = np.concatenate([[0], np.cumsum(cheap_correct)]) + np.concatenate([np.cumsum(full_correct[::-1])[::-1], [0]])
+	accuracy = correct / max(len(y), 1)
+	for k in range(len(y), -1, -1):
+		## Only cut between distinct confidences, ties are accepted together
+		if 0 < k < len(y) and confidence[k - 1] == confidence[k]:
+			continue
+		if accuracy[k] >= target_acc:
+			return float(confidence[k - 1]) if k > 0 else float("inf")
+	return None
+
+def summary(pred, y, n_classes):
+	metrics = evaluationRumour4(torch.as_tensor(pred), torch.as_tensor(y))
+	return {"acc": float(metrics[0]), "macroF": float(sum(metrics[4::4]) / n_classes), "metrics": [float(value) for value in metrics]}
+
+def main():
+	cli = parse_args()
+	device = torch.device("cuda:0" if torch.cuda.is_available() else "cpu")
+	cheap_duck, cheap_model = load_checkpoint(cli.cheap, device, cli.quantize, baseDirectory=cli.baseDirectory, max_tree_len=cli.cheap_replies)
+	full_duck , full_model  = load_checkpoint(cli.full , device, cli.quantize, baseDirectory=cli.baseDirectory)
+	args, device = full_duck.args, full_duck.device
+	if (cheap_duck.args.datasetName, cheap_duck.args.foldnum) != (args.datasetName, args.foldnum):
+		print("Warning: the cheap stage was trained on {} fold {}, evaluating on {} fold {}".format(
+			cheap_duck.args.datasetName, cheap_duck.args.foldnum, args.datasetName, args.foldnum), file=sys.stderr)
+	cascade = Cascade((cheap_duck.args, cheap_model), (args, full_model), cli.threshold, device)
+
+	## Calibration / evaluation parts of the test split
+	_, x_test = full_duck.loadfolddatawithKnownFold()
+	event_ids = np.random.RandomState(cli.seed).permutation(np.asarray(x_test))
+	n_calib = int(round(len(event_ids) * cli.calib_frac)) if cli.threshold is None else 0
+	calib_threads, eval_threads = load_threads(args, event_ids[:n_calib]), load_threads(args, event_ids[n_calib:])
+
+	report = {"cheap_checkpoint": cli.cheap, "full_checkpoint": cli.full, "cheap_replies": cheap_duck.args.max_tree_len, "datasetName": args.datasetName, "foldnum": args.foldnum}
+	if cli.threshold is None:
+		cheap_probs, full_pred = [], []
+		with torch.inference_mode():
+			for threads in tqdm(list(batches(calib_threads, cli.batch_trees)), desc="Calibrating", file=sys.stderr):
+				cheap_probs.append(cascade.probs(cascade.cheap, threads).cpu())
+				full_pred.append(cascade.probs(cascade.full, threads).argmax(dim=-1).cpu())
+		cheap_probs, full_pred = torch.cat(cheap_probs).numpy(), torch.cat(full_pred).numpy()
+		y = np.array([thread[4] for thread in calib_threads])
+
+		full_acc = float((full_pred == y).mean())
+		target_acc = cli.target_acc if cli.target_acc is not None else full_acc - cli.max_acc_drop
+		threshold = calibrate(cheap_probs.max(axis=-1), cheap_probs.argmax(axis=-1), full_pred, y, target_acc)
+		if threshold is None:
+			print("Warning: accuracy {:.4f} not reached on the calibration part (full model: {:.4f}), using the full model only".format(target_acc, full_acc), file=sys.stderr)
+			threshold = float("inf")
+		cascade.threshold = threshold
+		report["calibration"] = {"n_threads": len(y), "full_acc": full_acc, "cheap_acc": float((cheap_probs.argmax(axis=-1) == y).mean()), "target_acc": target_acc}
+		print("Threshold {:.4f} (target accuracy {:.4f} on {} calibration threads)".format(threshold, target_acc, len(y)))
+	report["threshold"] = cascade.threshold
+
+	## Full model alone vs cascade on the evaluation part
+	y = np.array([thread[4] for thread in eval_threads])
+	with torch.inference_mode():
+		start = time.perf_counter()
+		full_pred = [cascade.probs(cascade.full, threads).argmax(dim=-1).cpu() for threads in tqdm(list(batches(eval_threads, cli.batch_trees)), desc="Full model", file=sys.stderr)]
+		full_time = time.perf_counter() - start
+	start = time.perf_counter()
+	cascade_pred = [cascade(threads)[0].argmax(dim=-1).cpu() for threads in tqdm(list(batches(eval_threads, cli.batch_trees)), desc="Cascade", file=sys.stderr)]
+	cascade_time = time.perf_counter() - start
+	full_pred, cascade_pred = torch.cat(full_pred).numpy(), torch.cat(cascade_pred).numpy()
+
+	report["full"] = {**summary(full_pred, y, args.n_classes), "seconds": full_time, "threads_per_sec": len(y) / max(full_time, 1e-9)}
+	report["cascade"] = {**summary(cascade_pred, y, args.n_classes), "seconds": cascade_time, "threads_per_sec": len(y) / max(cascade_time, 1e-9)}
+	report["cheap_fraction"] = cascade.n_cheap / max(cascade.n_total, 1)
+	report["throughput_gain"] = full_time / max(cascade_time, 1e-9)
+
+	for name in ["full", "cascade"]:
+		print("\n*** {} ({:.1f} threads/sec) ***".format(name, report[name]["threads_per_sec"]))
+		for res_ in format_metrics(report[name]["metrics"], args.n_classes):
+			print(res_)
+	print("\n{:.1%} of {} threads served by the cheap stage, throughput x{:.2f}".format(report["cheap_fraction"], len(y), report["throughput_gain"]))
+
+	if cli.output is not None:
+		with open(cli.output, "w") as fw:
+			json.dump(report, fw, indent=2)
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,87 @@
+import os
+import queue
+import random
+import threading
+
+import numpy as np
+import torch
+
+def to_cpu(obj):
+	"""Copy every tensor in a (nested) state to CPU memory, so that training can go on modifying the originals."""
+	if torch.is_tensor(obj):
+		return obj.detach().to("cpu", copy=True)
+	if isinstance(obj, dict):
+		return {key: to_cpu(value) for key, value in obj.items()}
+	if isinstance(obj, (list, tuple)):
+		return type(obj)(to_cpu(value) for value in obj)
+	return obj
+
+def save_atomic(state, path):
+	"""`torch.save` to a temporary file then rename, a crash never leaves a truncated checkpoint behind."""
+	os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+	torch.save(state, path + ".tmp")
+	os.replace(path + ".tmp", path)
+
+def rng_state():
+	state = {
+		"python": random.getstate(),
+		"numpy": np.random.get_state(),
+		"torch": torch.get_rng_state(),
+	}
+	if torch.cuda.is_available():
+		state["cuda"] = torch.cuda.get_rng_state_all()
+	return state
+
+def set_rng_state(state):
+	random.setstate(state["python"])
+	np.random.set_state(state["numpy"])
+	torch.set_rng_state(state["torch"])
+	if "cuda" in state and torch.cuda.is_available():
+		torch.cuda.set_rng_state_all(state["cuda"])
+
+class AsyncCheckpointer:
+	"""
+	Write checkpoints from a background thread.
+	`save` only copies the state to CPU on the calling thread; serialization and
+	disk I/O happen in the writer thread. At most one write is pending, a new
+	`save` waits for it rather than piling up copies of the model in memory.
+	"""
+	def __init__(self):
+		self.queue = queue.Queue(maxsize=1)
+		self.error = None
+		self.thread = threading.Thread(target=self._write_loop, name="checkpoint-writer", daemon=True)
+		self.thread.start()
+
+	def _write_loop(self):
+		while True:
+			item = self.queue.get()
+			try:
+				if item is None:
+					return
+				state, path = item
+				save_atomic(state, path)
+			except Exception as e:
+				self.error = e
+				print("Failed to write checkpoint: {}".format(e))
+			finally:
+				self.queue.task_done()
+
+	def raise_error(self):
+		"""Re-raise, on the training thread, the failure of a previous write."""
+		if self.error is not None:
+			error, self.error = self.error, None
+			raise RuntimeError("Failed to write checkpoint") from error
+
+	def save(self, state, path):
+		self.raise_error()
+		self.queue.put((to_cpu(state), path))
+
+	def wait(self):
+		"""Block until every pending checkpoint is on disk."""
+		self.queue.join()
+		self.raise_error()
+
+	def close(self):
+		self.queue.put(None)
+		self.thread.join()
+		self.raise_error()
@@ -0,0 +1,53 @@
+"""
+`torch.compile` of the models (`--compile`), with a graceful fallback to eager mode.
+
+The model is compiled in place (`nn.Module.compile`), so parameters, state
+dict keys, checkpoints and `DistributedDataParallel` wrapping are unchanged.
+Shapes are marked dynamic from the start, so trees and batches of new sizes
+reuse the compiled graphs instead of recompiling. Frames that Dynamo cannot
+trace, or that the backend fails to compile, run eagerly (with a warning)
+instead of stopping the run. Compiled kernels are cached in `cache_dir`
+(Inductor's FX graph cache), which makes the next run's compilation cheap.
+"""
+import os
+import warnings
+
+import torch
+
+def configure_cache(cache_dir):
+	"""Persist Inductor's compiled artifacts in `cache_dir` across runs."""
+	os.makedirs(cache_dir, exist_ok=True)
+	os.environ["TORCHINDUCTOR_CACHE_DIR"] = os.path.abspath(cache_dir)
+	os.environ["TORCHINDUCTOR_FX_GRAPH_CACHE"] = "1"
+	try:
+		import torch._inductor.config as inductor_config
+		inductor_config.fx_graph_cache = True
+	except (ImportError, AttributeError):
+		pass
+
+def compile_model(model, mode="default", dynamic=True, cache_dir=None):
+	"""Compile `model` in place, returns False (the model stays eager) when `torch.compile` is unavailable."""
+	if not hasattr(torch, "compile"):
+		warnings.warn("torch.compile needs PyTorch >= 2.0, running eagerly")
+		return False
+	if cache_dir is not None:
+		configure_cache(cache_dir)
+
+	import torch._dynamo
+	torch._dynamo.config.suppress_errors = True ## fall back to eager for frames that fail to compile
+	if hasattr(model, "compile"):
+		model.compile(mode=mode, dynamic=dynamic)
+	else: ## PyTorch < 2.2
+		model.forward = torch.compile(model.forward, mode=mode, dynamic=dynamic)
+	return True
+
+def compile_stats():
+	"""Graphs compiled and graph breaks so far, as counted by Dynamo."""
+	try:
+		from torch._dynamo.utils import counters
+	except ImportError:
+		return {}
+	return {
+		"unique_graphs": int(counters["stats"]["unique_graphs"]),
+		"graph_breaks": int(sum(counters["graph_break"].values())),
+	}
@@ -0,0 +1,106 @@
+import os
+from functools import partial
+
+def available_cores():
+	"""Cores this process may run on (respects taskset / cgroup cpusets)."""
+	if hasattr(os, "sched_getaffinity"):
+		return sorted(os.sched_getaffinity(0))
+	return list(range(os.cpu_count() or 1))
+
+def parse_core_list(spec):
+	"""Parse `0-3,8,10-11` into [0, 1, 2, 3, 8, 10, 11]."""
+	cores = []
+	for part in spec.split(","):
+		part = part.strip()
+		if not part:
+			continue
+		if "-" in part:
+			start, end = part.split("-")
+			cores.extend(range(int(start), int(end) + 1))
+		else:
+			cores.append(int(part))
+	return cores
+
+def plan_cpu_layout(intra_op_threads=0, inter_op_threads=0, num_workers=0, pin_cores="none", local_rank=0, local_world_size=1):
+	"""
+	Split the cores of this host between the `local_world_size` training processes,
+	then, inside the share of `local_rank`, between torch intra-op threads and the
+	DataLoader workers so that they do not oversubscribe each other.
+	Thread counts of 0 are auto-detected from the share.
+	"""
+	if pin_cores not in ("none", "auto"):
+		cores = parse_core_list(pin_cores)
+	else:
+		cores = available_cores()
+
+	share = max(1, len(cores) // local_world_size)
+	block = cores[local_rank * share:(local_rank + 1) * share] or cores
+
+	## Leave one core per loader worker when there is room for it
+	n_worker_cores = min(num_workers, max(0, len(block) - 1))
+	main_cores   = block[:len(block) - n_worker_cores]
+	worker_cores = block[len(block) - n_worker_cores:]
+
+	intra = intra_op_threads if intra_op_threads > 0 else len(main_cores)
+	inter = inter_op_threads if inter_op_threads > 0 else (2 if intra >= 8 else 1)
+
+	return {
+		"intra_op_threads": intra,
+		"inter_op_threads": inter,
+		"num_workers": num_workers,
+		"pin": pin_cores != "none",
+		"main_cores": main_cores,
+		"worker_cores": worker_cores,
+	}
+
+def apply_cpu_layout(layout):
+	os.environ["OMP_NUM_THREADS"] = str(layout["intra_op_threads"])
+	os.environ["MKL_NUM_THREADS"] = str(layout["intra_op_threads"])
+	## Loader workers already run one tokenizer each
+	os.environ["TOKENIZERS_PARALLELISM"] = "false"
+
+	import torch ## not at module level: `options.py` (and `train.py --help`) import this module without torch
+	torch.set_num_threads(layout["intra_op_threads"])
+	try:
+		torch.set_num_interop_threads(layout["inter_op_threads"])
+	except RuntimeError:
+		## Can only be set once, before any inter-op parallel work has started
+		pass
+
+	if layout["pin"] and hasattr(os, "sched_setaffinity") and layout["main_cores"]:
+		os.sched_setaffinity(0, layout["main_cores"])
+
+def configure_threads(args, local_rank=None, local_world_size=None):
+	"""Plan and apply the CPU layout from the `--intra_op_threads`, `--inter_op_threads`, `--num_workers` and `--pin_cores` arguments."""
+	if local_rank is None:
+		local_rank = int(os.environ.get("LOCAL_RANK", 0))
+	if local_world_size is None:
+		local_world_size = int(os.environ.get("LOCAL_WORLD_SIZE", 1))
+
+	layout = plan_cpu_layout(
+		intra_op_threads=args.intra_op_threads,
+		inter_op_threads=args.inter_op_threads,
+		num_workers=args.num_workers,
+		pin_cores=args.pin_cores,
+		local_rank=local_rank,
+		local_world_size=local_world_size
+	)
+	apply_cpu_layout(layout)
+	return layout
+
+def _init_worker(worker_cores, pin, worker_id):
+	import torch
+	torch.set_num_threads(1)
+	if pin and worker_cores and hasattr(os, "sched_setaffinity"):
+		os.sched_setaffinity(0, [worker_cores[worker_id % len(worker_cores)]])
+
+def worker_init_fn(layout):
+	"""`worker_init_fn` for DataLoader: one thread per worker, pinned to its own core."""
+	return partial(_init_worker, layout["worker_cores"], layout["pin"])
+
+def add_cpu_args(parser):
+	parser.add_argument("--intra_op_threads", default=0, type=int, help="torch intra-op threads per process, 0 for auto")
+	parser.add_argument("--inter_op_threads", default=0, type=int, help="torch inter-op threads per process, 0 for auto")
+	parser.add_argument("--num_workers", default=0, type=int, help="DataLoader worker processes per training process")
+	parser.add_argument("--pin_cores", default="none", type=str, help="`none`, `auto` (pin to the cores available to this process) or a core list such as `0-15,32-47`")
+	return parser
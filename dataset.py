@@ -1,13 +1,13 @@
 import os
-import ipdb
+import time
 import numpy as np
 import pandas as pd
 
 import torch
-from torch.utils.data import Dataset
+from torch.utils.data import Dataset, Sampler
 from torch_geometric.data import Data
 
-from utils import preprocessing_for_bert_latest, preprocessing_for_bert_seq
+from utils import preprocessing_for_bert_latest, preprocessing_for_bert_seq, MAX_LEN, MAX_LEN_SEQ
 
 class TextUserData(Data):
 	def __init__(self, text_x, user_x, text_edge_index, user_edge_index,y,idx):
@@ -55,10 +55,22 @@ class CommentTreeDataset(Dataset):
 		self.fold_x = fold_x
 		self.data_path = data_path
 		self.graph_path = "{}/{}graph".format(self.data_path, self.args.datasetName)
+		self._num_nodes = {}
 
 	def __len__(self):
 		return len(self.fold_x)
 
+	def num_nodes(self, index):
+		"""Number of nodes of a tree after truncation to `max_tree_len`, read without tokenizing."""
+		if index not in self._num_nodes:
+			data = np.load("{}/{}.npz".format(self.graph_path, str(self.fold_x[index])), allow_pickle=True)
+			self._num_nodes[index] = data["root"].__len__() + min(data["nodecontent"].__len__(), self.args.max_tree_len)
+		return self._num_nodes[index]
+
+	def num_tokens(self, index):
+		"""Tokens fed to the encoders for a tree: one `MAX_LEN` sequence per node plus the `MAX_LEN_SEQ` comment chain."""
+		return self.num_nodes(index) * MAX_LEN + MAX_LEN_SEQ
+
 	def __getitem__(self, index):
 		id = str(self.fold_x[index])
 
@@ -69,34 +81,81 @@ class CommentTreeDataset(Dataset):
 		#input_ids    , attention_mask     = preprocessing_for_bert_latest(data["root"], data["nodecontent"]) #convert list of strings to list of input_ids and attention_mask for this idx
 		#input_ids_seq, attention_mask_seq = preprocessing_for_bert_seq(   data["root"], data["nodecontent"])
 
+		start = time.perf_counter()
 		data = np.load("{}/{}.npz".format(self.graph_path, id), allow_pickle=True)
+		root, nodecontent, edgematrix = data["root"], data["nodecontent"], data["edgematrix"]
+		y, rootindex = int(data["y"]), int(data["rootindex"])
+		loaded = time.perf_counter()
+
+		graph = make_comment_tree(root, nodecontent, edgematrix, y, rootindex, self.args.max_tree_len, self.args.bertVersion, event_id=id)
+		tokenized = time.perf_counter()
+
+		## Collated into the batch, read back by `timing.StageTimer.record_batch`
+		if self.args.timing:
+			graph.stage_times = {"np.load": loaded - start, "tokenize": tokenized - loaded}
+		return graph
+
+def make_comment_tree(root, nodecontent, edgematrix, y, rootindex, max_tree_len, bert_version, event_id=None):
+	"""
+	`Data` of one comment tree in the layout of `preprocess.build_graph` (`root`: [source text], 
+	`nodecontent`: responses, `edgematrix`: [parents, children]), as fed to the models.
+	`y` is -1 for unlabelled trees.
+	"""
+	## Truncate number of responses for less GPU memory during training
+	nodecontent = nodecontent[:max_tree_len]
+	edgematrix  = np.asarray(edgematrix)
+	edgematrix  = edgematrix[:, edgematrix[1] <= nodecontent.__len__()]
+
+	input_ids    , attention_mask     = preprocessing_for_bert_latest(root, nodecontent, bert_version) #convert list of strings to list of input_ids and attention_mask for this idx
+	input_ids_seq, attention_mask_seq = preprocessing_for_bert_seq(   root, nodecontent, bert_version)
+
+	return Data(
+		edge_index = torch.LongTensor(edgematrix), #torch.LongTensor(data["edgematrix"]),
+		#root = torch.LongTensor(data["root"]),
+		y = torch.LongTensor([y]),
+		rootindex = torch.LongTensor([rootindex]),
+		#idx = torch.LongTensor([int(idx)]),
+		input_ids = torch.LongTensor(input_ids),
+		attention_mask = torch.LongTensor(attention_mask),
+		#input_ids_seq = torch.LongTensor(input_ids_seq),
+		#attention_mask_seq = torch.LongTensor(attention_mask_seq),
+		input_ids_seq = torch.LongTensor(input_ids_seq.unsqueeze(dim=0)),
+		attention_mask_seq = torch.LongTensor(attention_mask_seq.unsqueeze(dim=0)),
+		#top_index = torch.LongTensor(data["topindex"]),
+		#tri_index = torch.LongTensor(data["triIndex"])
+		num_nodes = root.__len__() + nodecontent.__len__(), ## For ignoring torch_geometric warning
+		event_id = event_id ## source tweet id, a list of ids once batched
+	)
 
-		## Truncate number of responses for less GPU memory during training
-		nodecontent = data["nodecontent"][:self.args.max_tree_len]
-		edgematrix  = data["edgematrix"][:, data["edgematrix"][1] <= nodecontent.__len__()]
+def collate_fn(data):
+	return data
 
-		input_ids    , attention_mask     = preprocessing_for_bert_latest(data["root"], nodecontent) #convert list of strings to list of input_ids and attention_mask for this idx
-		input_ids_seq, attention_mask_seq = preprocessing_for_bert_seq(   data["root"], nodecontent)
 
-		return Data(
-			edge_index = torch.LongTensor(edgematrix), #torch.LongTensor(data["edgematrix"]),
-			#root = torch.LongTensor(data["root"]),
-			y = torch.LongTensor([int(data["y"])]),
-			rootindex = torch.LongTensor([int(data["rootindex"])]),
-			#idx = torch.LongTensor([int(idx)]),
-			input_ids = torch.LongTensor(input_ids),
-			attention_mask = torch.LongTensor(attention_mask),
-			#input_ids_seq = torch.LongTensor(input_ids_seq),
-			#attention_mask_seq = torch.LongTensor(attention_mask_seq),
-			input_ids_seq = torch.LongTensor(input_ids_seq.unsqueeze(dim=0)),
-			attention_mask_seq = torch.LongTensor(attention_mask_seq.unsqueeze(dim=0)),
-			#top_index = torch.LongTensor(data["topindex"]),
-			#tri_index = torch.LongTensor(data["triIndex"])
-			num_nodes = data["root"].__len__() + nodecontent.__len__() ## For ignoring torch_geometric warning
-		)
+class TokenBudgetBatchSampler(Sampler):
+	"""
+	Deterministic batches of at most `max_tokens` tokens (a tree larger than the 
+	budget gets a batch of its own). Trees are sorted by size so that trees of 
+	similar length share a batch, which keeps the padding of the comment chains small.
+	"""
+	def __init__(self, sizes, max_tokens, indices=None):
+		indices = list(range(len(sizes))) if indices is None else list(indices)
+		indices.sort(key=lambda index: sizes[index])
+		self.batches = []
+		batch, batch_tokens = [], 0
+		for index in indices:
+			if batch and batch_tokens + sizes[index] > max_tokens:
+				self.batches.append(batch)
+				batch, batch_tokens = [], 0
+			batch.append(index)
+			batch_tokens += sizes[index]
+		if batch:
+			self.batches.append(batch)
+
+	def __iter__(self):
+		return iter(self.batches)
 
-def collate_fn(data):
-	return data
+	def __len__(self):
+		return len(self.batches)
 
 
 class UserTreeDataset(Dataset):
@@ -0,0 +1,104 @@
+import os
+
+import torch.distributed as dist
+import torch.multiprocessing as mp
+from torch.utils.data import Sampler
+from torch.utils.data.distributed import DistributedSampler
+
+def launch(main_fn, args):
+	"""
+	Run `main_fn(args)` in `args.nproc_per_node` worker processes on this host.
+	Processes of all hosts (`args.nnodes`) meet at `args.master_addr:args.master_port`.
+	When started by `torchrun` (RANK / WORLD_SIZE already set) or with a single
+	process, `main_fn` is simply called in the current process.
+	"""
+	world_size = args.nnodes * args.nproc_per_node
+	if "RANK" in os.environ or world_size <= 1:
+		main_fn(args)
+		return
+
+	print("Launching {} worker(s) on node [{}/{}], rendezvous at {}:{}".format(
+		args.nproc_per_node, args.node_rank, args.nnodes, args.master_addr, args.master_port
+	))
+	mp.spawn(_worker, args=(main_fn, args), nprocs=args.nproc_per_node, join=True)
+
+def _worker(local_rank, main_fn, args):
+	os.environ["MASTER_ADDR"] = args.master_addr
+	os.environ["MASTER_PORT"] = str(args.master_port)
+	os.environ["WORLD_SIZE"]  = str(args.nnodes * args.nproc_per_node)
+	os.environ["RANK"]        = str(args.node_rank * args.nproc_per_node + local_rank)
+	os.environ["LOCAL_RANK"]  = str(local_rank)
+	os.environ["LOCAL_WORLD_SIZE"] = str(args.nproc_per_node)
+	main_fn(args)
+
+def init_distributed(backend="gloo"):
+	"""Join the process group set up by `launch` / `torchrun`, return (rank, world_size)."""
+	world_size = int(os.environ.get("WORLD_SIZE", 1))
+	if world_size <= 1:
+		return 0, 1
+	if not dist.is_initialized():
+		dist.init_process_group(backend=backend, init_method="env://")
+	return dist.get_rank(), dist.get_world_size()
+
+def cleanup():
+	if dist.is_available() and dist.is_initialized():
+		dist.destroy_process_group()
+
+def is_distributed():
+	return dist.is_available() and dist.is_initialized() and dist.get_world_size() > 1
+
+def get_rank():
+	return dist.get_rank() if is_distributed() else 0
+
+def get_world_size():
+	return dist.get_world_size() if is_distributed() else 1
+
+def is_main_process():
+	return get_rank() == 0
+
+def all_gather_list(obj):
+	"""Gather a picklable object from every rank, returns the list ordered by rank."""
+	if not is_distributed():
+		return [obj]
+	gathered = [None for _ in range(dist.get_world_size())]
+	dist.all_gather_object(gathered, obj)
+	return gathered
+
+class ShardSampler(Sampler):
+	"""
+	Deterministic, non-padded split of a dataset across ranks.
+	Unlike `DistributedSampler`, no sample is duplicated, so gathered
+	predictions cover the evaluation set exactly once.
+	"""
+	def __init__(self, dataset, num_replicas=None, rank=None):
+		self.num_samples_total = len(dataset)
+		self.num_replicas = get_world_size() if num_replicas is None else num_replicas
+		self.rank = get_rank() if rank is None else rank
+
+	def __iter__(self):
+		return iter(range(self.rank, self.num_samples_total, self.num_replicas))
+
+	def __len__(self):
+		return len(range(self.rank, self.num_samples_total, self.num_replicas))
+
+class ResumableSampler(DistributedSampler):
+	"""
+	Shuffled training order drawn from (seed, epoch) only, so that it can be
+	rebuilt after a restart; `set_start_index` skips the samples of an epoch
+	that were already trained on before the checkpoint.
+	"""
+	def __init__(self, dataset, num_replicas=None, rank=None, seed=0):
+		num_replicas = get_world_size() if num_replicas is None else num_replicas
+		rank = get_rank() if rank is None else rank
+		super(ResumableSampler, self).__init__(dataset, num_replicas=num_replicas, rank=rank, shuffle=True, seed=seed)
+		self.start_index = 0
+
+	def set_start_index(self, start_index):
+		self.start_index = start_index
+
+	def __iter__(self):
+		indices = list(super(ResumableSampler, self).__iter__())
+		return iter(indices[self.start_index:])
+
+	def __len__(self):
+		return max(0, self.num_samples - self.start_index)
@@ -0,0 +1,101 @@
+"""
+Export the pooled representation of every thread, for reuse by downstream models.
+
+	python embed.py --checkpoint ./result/ckpt/twitter15_fold0_CCCTNet/best.pt --output ./result/twitter15_fold0.f16
+	python embed.py --checkpoint ... --input new/data.csv --output new.f16
+
+The representation is the input of `fc1`: for `CCCTNet` the pooled BERT+GAT
+output (`bert_gat_x`) followed by the comment-chain `[CLS]` (`seq_x`), for
+`Simple_GAT_BERT` the pooled GAT output. Threads are read from `--input` (by
+default the `.npz` trees of the checkpoint's dataset) as in `predict.py`,
+batched and scored under inference mode, and each batch is written straight
+into a float16 `np.memmap` of shape (threads, dim). `{output}.index.json`
+holds the row of each event id, its label and the columns of each part;
+`load_representations` opens both.
+"""
+import sys
+import json
+import time
+import argparse
+
+import numpy as np
+import torch
+from tqdm import tqdm
+from torch.utils.data import DataLoader
+
+from evaluate import load_checkpoint
+from predict import ThreadStream
+from compiler import compile_model
+
+def parse_args():
+	parser = argparse.ArgumentParser(description="Export pooled thread representations of a DUCK checkpoint")
+	parser.add_argument("--checkpoint", type=str, required=True, help="best.pt or last.pt written by train.py")
+	parser.add_argument("--input", type=str, default=None, help="data.csv-style file or directory of .npz trees, default: the trees of the checkpoint's dataset")
+	parser.add_argument("--output", type=str, required=True, help="float16 matrix, the index is written to {output}.index.json")
+	parser.add_argument("--baseDirectory", type=str, default=None, help="the data directory, default: the one used for training")
+	parser.add_argument("--batch_tokens", type=int, default=16384, help="token budget of a batch")
+	parser.add_argument("--batch_trees", type=int, default=256, help="maximum trees per batch")
+	parser.add_argument("--max_tree_len", type=int, default=None, help="responses kept per tree, default: the training value")
+	parser.add_argument("--num_workers", type=int, default=2, help="loader processes reading & tokenizing threads")
+	parser.add_argument("--compile", action="store_true", help="torch.compile the model, see compiler.py")
+	parser.add_argument("--compile_cache", type=str, default="./result/compile_cache", help="directory of compiled artifacts reused across runs")
+	parser.add_argument("--quantize", type=str, default=None, choices=["int8"], help="dynamic quantization of the encoders for CPU inference")
+	return parser.parse_args()
+
+def load_representations(path):
+	"""(read-only float16 memmap, index) of a matrix written by this script."""
+	with open("{}.index.json".format(path)) as f:
+		index = json.load(f)
+	matrix = np.memmap(path, dtype=np.float16, mode="r", shape=tuple(index["shape"]))
+	return matrix, index
+
+def main():
+	cli = parse_args()
+	device = torch.device("cuda:0" if torch.cuda.is_available() else "cpu")
+	duck, model = load_checkpoint(cli.checkpoint, device, cli.quantize, baseDirectory=cli.baseDirectory, max_tree_len=cli.max_tree_len)
+	args, device = duck.args, duck.device
+	if not hasattr(model, "represent"):
+		raise ValueError("{} does not expose a pooled representation".format(args.modelName))
+	if cli.compile and compile_model(model, cache_dir=cli.compile_cache):
+		## `compile_model` compiles `forward`, this script calls `represent`
+		model.represent = torch.compile(model.represent, dynamic=True)
+
+	input_path = cli.input if cli.input is not None else "{}/{}graph".format(args.baseDirectory, args.datasetName)
+	stream = ThreadStream(input_path, args.max_tree_len, args.bertVersion, cli.batch_tokens, cli.batch_trees)
+	n_threads = sum(1 for _ in stream.threads()) ## thunks only, nothing is tokenized
+	loader = DataLoader(stream, batch_size=None, num_workers=cli.num_workers, pin_memory=device.type == "cuda")
+
+	matrix, columns = None, {}
+	event_ids, labels = [], []
+	start = time.time()
+	with torch.inference_mode():
+		for batch in tqdm(loader, desc="Embedding", unit="batch", file=sys.stderr):
+			batch_ids = batch.event_id
+			batch = batch.to(device, non_blocking=True)
+			parts = model.represent(batch)
+			if matrix is None: ## the width is known after the first batch
+				offset = 0
+				for name, part in zip(model.representation, parts):
+					columns[name] = [offset, offset + part.size(-1)]
+					offset += part.size(-1)
+				matrix = np.memmap(cli.output, dtype=np.float16, mode="w+", shape=(n_threads, offset))
+			row = len(event_ids)
+			matrix[row:row + len(batch_ids)] = torch.cat(parts, dim=1).half().cpu().numpy()
+			event_ids.extend(str(event_id) for event_id in batch_ids)
+			labels.extend(batch.y.tolist())
+	elapsed = time.time() - start
+	if matrix is None:
+		raise ValueError("No thread found in {}".format(input_path))
+	matrix.flush()
+
+	with open("{}.index.json".format(cli.output), "w") as fw:
+		json.dump({
+			"checkpoint": cli.checkpoint, "modelName": args.modelName, "input": input_path,
+			"dtype": "float16", "shape": [len(event_ids), matrix.shape[1]], "columns": columns,
+			"event_ids": event_ids, "labels": labels, ## row k: event_ids[k], -1 for unlabelled threads
+		}, fw)
+	print("{} threads x {} dims embedded in {:.1f}s ({:.1f} threads/sec), written to {}".format(
+		len(event_ids), matrix.shape[1], elapsed, len(event_ids) / max(elapsed, 1e-9), cli.output))
+
+if __name__ == "__main__":
+	main()
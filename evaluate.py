@@ -0,0 +1,170 @@
+"""
+Evaluation of DUCK models, used by `train.py` and on its own for saved checkpoints.
+
+	python evaluate.py --checkpoint ./result/ckpt/twitter15_fold0_CCCTNet/best.pt --baseDirectory ./data
+
+The model, dataset and fold are taken from the arguments stored in the
+checkpoint; any of them can be overridden on the command line.
+"""
+import json
+import argparse
+
+import torch
+import torch.nn.functional as F
+from tqdm import tqdm
+from torch_geometric.loader import DataLoader
+
+from utils import evaluationRumour4
+from dataset import TokenBudgetBatchSampler
+from distributed import all_gather_list, ShardSampler
+from compiler import compile_model
+
+def build_eval_loader(dataset, batchsize, eval_batch_tokens=0, rank=0, world_size=1, **loader_kwargs):
+	"""
+	Deterministic loader over this rank's shard of `dataset`; batches hold up to
+	`eval_batch_tokens` tokens when > 0 (and the dataset knows its tree sizes),
+	`batchsize` trees otherwise.
+	"""
+	if eval_batch_tokens > 0 and hasattr(dataset, "num_tokens"):
+		indices = range(rank, len(dataset), world_size)
+		sizes = {index: dataset.num_tokens(index) for index in indices}
+		return DataLoader(dataset, batch_sampler=TokenBudgetBatchSampler(sizes, eval_batch_tokens, indices), **loader_kwargs)
+	sampler = ShardSampler(dataset, num_replicas=world_size, rank=rank) if world_size > 1 else None
+	return DataLoader(dataset, batch_size=batchsize, sampler=sampler, shuffle=False, **loader_kwargs)
+
+def format_metrics(metrics, n_classes):
+	"""Lines printed for the metrics of `evaluationRumour4`."""
+	Acc_all, \
+	Acc1, Prec1, Recll1, F1, \
+	Acc2, Prec2, Recll2, F2, \
+	Acc3, Prec3, Recll3, F3, \
+	Acc4, Prec4, Recll4, F4 = metrics
+	return ["acc: {:.4f}, macroF: {:.4f}".format(Acc_all, (F1 + F2 + F3 + F4) / n_classes),
+			"C1 : {:.4f}, {:.4f}, {:.4f}, {:.4f}".format(Acc1, Prec1, Recll1, F1),
+			"C2 : {:.4f}, {:.4f}, {:.4f}, {:.4f}".format(Acc2, Prec2, Recll2, F2),
+			"C3 : {:.4f}, {:.4f}, {:.4f}, {:.4f}".format(Acc3, Prec3, Recll3, F3),
+			"C4 : {:.4f}, {:.4f}, {:.4f}, {:.4f}".format(Acc4, Prec4, Recll4, F4)]
+
+class Evaluator:
+	"""
+	Mean loss and `evaluationRumour4` metrics of a model over `loader`, run under
+	`torch.inference_mode`. With several processes each rank evaluates its own
+	shard and predictions are gathered, so every rank gets the same metrics.
+	"""
+	def __init__(self, loader, device, world_size=1, show_progress=True):
+		self.loader = loader
+		self.device = device
+		self.world_size = world_size
+		self.show_progress = show_progress
+
+	def __call__(self, model, desc="Eval"):
+		## Run the wrapped module: no DistributedDataParallel buffer syncs, ranks may have different numbers of batches
+		model = model.module if hasattr(model, "module") else model
+		was_training = model.training
+		model.eval()
+
+		loss_sum = torch.zeros((), device=self.device)
+		pred_all, y_all = [], []
+		with torch.inference_mode():
+			for Batch_data in tqdm(self.loader, desc=desc, disable=not self.show_progress):
+				Batch_data = Batch_data.to(self.device, non_blocking=True)
+				out = model(Batch_data)
+				loss_sum += F.nll_loss(out, Batch_data.y, reduction="sum")
+				pred_all.append(out.argmax(dim=-1))
+				y_all.append(Batch_data.y)
+		model.train(was_training)
+
+		pred_all = torch.cat(pred_all).cpu() if pred_all else torch.zeros(0, dtype=torch.long)
+		y_all    = torch.cat(y_all).cpu()    if y_all    else torch.zeros(0, dtype=torch.long)
+		loss_sum = loss_sum.item()
+		if self.world_size > 1:
+			pred_all = torch.cat(all_gather_list(pred_all))
+			y_all = torch.cat(all_gather_list(y_all))
+			loss_sum = sum(all_gather_list(loss_sum))
+
+		return loss_sum / max(len(y_all), 1), evaluationRumour4(pred_all, y_all)
+
+def load_checkpoint(checkpoint, device, quantize=None, quantize_head=False, **overrides):
+	"""
+	Rebuild the model of a `best.pt` / `last.pt` checkpoint, returns the `DUCK` 
+	instance holding its training arguments (updated with the non-None `overrides`)
+	and the model in eval mode on `device`. Checkpoints written by `quantize.py`,
+	or any checkpoint with `quantize="int8"`, give a quantized model on CPU;
+	`duck.device` is the device the model ended up on. Snapshots (`snapshot.py`)
+	are loaded memory-mapped.
+	"""
+	from train import DUCK
+	from options import get_parser
+	from snapshot import is_snapshot, load_snapshot
+
+	if is_snapshot(checkpoint):
+		return load_snapshot(checkpoint, device, quantize, quantize_head, **overrides)
+	state = torch.load(checkpoint, map_location="cpu")
+
+	## Arguments of the training run, on top of the current defaults
+	config = vars(get_parser().parse_args(["--datasetName", "", "--modelName", ""]))
+	config.update(state["args"])
+	for key, value in overrides.items():
+		if key in config and value is not None:
+			config[key] = value
+	config["snapshot"] = None ## the weights are the checkpoint's
+	duck = DUCK(argparse.Namespace(**config))
+
+	model = duck.init_model(pretrained=False) ## weights come from the checkpoint
+	if state.get("quantize") or quantize is not None:
+		from quantize import quantize_model ## only when needed, the quantization modules vary across PyTorch versions
+	if state.get("quantize"): ## quantized checkpoint
+		model = quantize_model(model, state["quantize"]["dtype"], state["quantize"]["head"])
+	model.load_state_dict(state["model"])
+	if quantize is not None and not getattr(model, "quantized", None):
+		model = quantize_model(model, quantize, quantize_head)
+	if getattr(model, "quantized", None):
+		device = torch.device("cpu") ## quantized kernels run on CPU only
+	model.to(device)
+	model.eval()
+	duck.device = device
+	return duck, model
+
+def parse_args():
+	parser = argparse.ArgumentParser(description="Evaluate a DUCK checkpoint on the test split of its fold")
+	parser.add_argument("--checkpoint", type=str, required=True, help="best.pt or last.pt written by train.py")
+	parser.add_argument("--baseDirectory", type=str, default=None, help="the data directory, default: the one used for training")
+	parser.add_argument("--datasetName", type=str, default=None)
+	parser.add_argument("--foldnum", type=int, default=None)
+	parser.add_argument("--eval_batch_tokens", type=int, default=None, help="token budget of an evaluation batch, 0 to use --batchsize")
+	parser.add_argument("--batchsize", type=int, default=None)
+	parser.add_argument("--num_workers", type=int, default=None)
+	parser.add_argument("--compile", action="store_true", help="torch.compile the model, see compiler.py")
+	parser.add_argument("--compile_cache", type=str, default="./result/compile_cache", help="directory of compiled artifacts reused across runs")
+	parser.add_argument("--quantize", type=str, default=None, choices=["int8"], help="dynamic quantization of the encoders for CPU inference")
+	parser.add_argument("--quantize_head", action="store_true", help="with --quantize, also quantize fc1 / fc2")
+	parser.add_argument("--output", type=str, default=None, help="JSON file for the loss and metrics")
+	return parser.parse_args()
+
+def main():
+	cli = parse_args()
+	device = torch.device("cuda:0" if torch.cuda.is_available() else "cpu")
+	overrides = {key: value for key, value in vars(cli).items() if key not in ("checkpoint", "output", "compile", "compile_cache", "quantize", "quantize_head")}
+	duck, model = load_checkpoint(cli.checkpoint, device, cli.quantize, cli.quantize_head, **overrides)
+	args, device = duck.args, duck.device
+	if cli.compile:
+		compile_model(model, cache_dir=cli.compile_cache)
+
+	duck.x_train, duck.x_test = duck.loadfolddatawithKnownFold()
+	_, testdata_list = duck.loadData()
+	loader = build_eval_loader(testdata_list, args.batchsize, args.eval_batch_tokens, num_workers=args.num_workers)
+	val_loss, metrics = Evaluator(loader, device)(model)
+
+	print("Val_Loss {:.4f}".format(val_loss))
+	for res_ in format_metrics(metrics, args.n_classes):
+		print(res_)
+
+	if cli.output is not None:
+		with open(cli.output, "w") as fw:
+			json.dump({
+				"checkpoint": cli.checkpoint, "datasetName": args.datasetName, "foldnum": args.foldnum,
+				"val_loss": val_loss, "metrics": [float(value) for value in metrics]
+			}, fw, indent=2)
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,174 @@
+"""
+Export the inference path of a checkpoint to TorchScript or ONNX.
+
+	python export.py --checkpoint ./result/ckpt/twitter15_fold0_CCCTNet/best.pt --output ccct.pt
+	python export.py --checkpoint ./result/ckpt/twitter15_fold0_CCCTNet/best.pt --output ccct.onnx --format onnx
+
+The exported graph takes plain tensors, as found in a PyG batch of
+`CommentTreeDataset` trees:
+
+	input_ids      (num_nodes, MAX_LEN)  int64   (source, post) pairs of every node
+	attention_mask (num_nodes, MAX_LEN)  int64
+	edge_index     (2, num_edges)        int64
+	batch          (num_nodes,)          int64   tree of every node, trees contiguous
+
+and returns the (num_trees, n_classes) log-probabilities. Shapes are dynamic;
+the export is checked against the eager model on batches of other shapes
+than the tracing example, and fails when they differ by more than `--atol`.
+Loading it (`load_exported`) needs neither `train.py` nor the tokenizer.
+"""
+import sys
+import time
+import argparse
+from types import SimpleNamespace
+
+import numpy as np
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+try:
+	import onnxruntime as ort
+except ImportError: ## only needed to check & run .onnx exports
+	ort = None
+
+INPUT_NAMES = ["input_ids", "attention_mask", "edge_index", "batch"]
+
+def parse_args():
+	parser = argparse.ArgumentParser(description="Export a DUCK checkpoint to TorchScript or ONNX")
+	parser.add_argument("--checkpoint", type=str, required=True, help="best.pt or last.pt written by train.py")
+	parser.add_argument("--output", type=str, required=True)
+	parser.add_argument("--format", type=str, default="torchscript", choices=["torchscript", "onnx"])
+	parser.add_argument("--opset", type=int, default=17, help="ONNX opset")
+	parser.add_argument("--quantize", type=str, default=None, choices=["int8"], help="dynamic quantization of the encoders for CPU inference")
+	parser.add_argument("--quantize_head", action="store_true", help="with --quantize, also quantize fc1 / fc2")
+	parser.add_argument("--atol", type=float, default=1e-4, help="largest allowed difference of log-probabilities with eager mode")
+	parser.add_argument("--check_shapes", type=str, default="5x1,20x3,50x4", help="comma separated `nodes x trees` of the check batches")
+	parser.add_argument("--repeat", type=int, default=20, help="timed runs of the latency comparison")
+	return parser.parse_args()
+
+def mean_by_batch(x, batch, num_graphs):
+	"""`scatter_mean(x, batch, dim=0)` with tensor ops only (traceable, ONNX exportable)."""
+	graph_ids = torch.arange(num_graphs, device=batch.device)
+	sums = torch.zeros_like(graph_ids, dtype=x.dtype).unsqueeze(1).repeat(1, x.size(-1)).index_add(0, batch, x)
+	counts = torch.zeros_like(graph_ids, dtype=x.dtype).index_add(0, batch, torch.ones_like(batch, dtype=x.dtype))
+	return sums / counts.clamp(min=1).unsqueeze(1)
+
+class TensorInference(nn.Module):
+	"""Eval-mode forward of `CCCTNet` / `SimpleGATBERTNet` on plain tensors."""
+	def __init__(self, model):
+		super(TensorInference, self).__init__()
+		if model.gnn.pooling != "scatter_mean":
+			raise ValueError("Only scatter_mean pooling can be exported, got {}".format(model.gnn.pooling))
+		self.model = model
+		self.chain = hasattr(model, "bert_tt") ## CCCTNet
+
+	def forward(self, input_ids, attention_mask, edge_index, batch):
+		from model.duck import pad_by_batch
+
+		model, gnn = self.model, self.model.gnn
+		num_graphs = batch[-1] + 1
+
+		## BERT+GAT, dropouts are no-ops in eval mode
+		x = gnn.encode(input_ids, attention_mask)
+		x = F.elu(gnn.conv1(x, edge_index))
+		x = gnn.conv2(x, edge_index)
+		bert_gat_x = mean_by_batch(x, batch, num_graphs)
+		if not self.chain:
+			return model.classify(bert_gat_x)
+
+		## 2-tier transformer
+		bert_x = model.bert_seq(SimpleNamespace(input_ids=input_ids, attention_mask=attention_mask))
+		bert_x, bert_x_mask = pad_by_batch(bert_x, batch, num_graphs)
+		seq_x = model.bert_tt(SimpleNamespace(input_ids=input_ids), bert_x, bert_x_mask)[:, 0, :]
+		return model.classify(bert_gat_x, seq_x)
+
+def batch_inputs(batch):
+	return tuple(getattr(batch, name) for name in INPUT_NAMES)
+
+def load_exported(path, threads=0):
+	"""A callable `(input_ids, attention_mask, edge_index, batch) -> log-probabilities` of an exported model."""
+	if path.endswith(".onnx"):
+		if ort is None:
+			raise ImportError("Running .onnx exports requires onnxruntime (pip install onnxruntime)")
+		options = ort.SessionOptions()
+		if threads > 0:
+			options.intra_op_num_threads = threads
+		session = ort.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+		def run(*inputs):
+			feed = {name: tensor.cpu().numpy() for name, tensor in zip(INPUT_NAMES, inputs)}
+			return torch.from_numpy(session.run(None, feed)[0])
+		return run
+
+	if threads > 0:
+		torch.set_num_threads(threads)
+	module = torch.jit.load(path, map_location="cpu")
+	def run(*inputs):
+		with torch.inference_mode():
+			return module(*inputs)
+	return run
+
+def export(wrapper, example, path, fmt, opset=17):
+	with torch.no_grad():
+		if fmt == "onnx":
+			torch.onnx.export(
+				wrapper, example, path,
+				input_names=INPUT_NAMES, output_names=["log_probs"],
+				dynamic_axes={
+					"input_ids": {0: "nodes"}, "attention_mask": {0: "nodes"},
+					"edge_index": {1: "edges"}, "batch": {0: "nodes"}, "log_probs": {0: "trees"},
+				},
+				opset_version=opset,
+			)
+		else:
+			traced = torch.jit.trace(wrapper, example, strict=False, check_trace=False)
+			traced = torch.jit.freeze(traced)
+			traced.save(path)
+
+def main():
+	cli = parse_args()
+	if cli.quantize is not None and cli.format == "onnx":
+		raise ValueError("Dynamically quantized models can only be exported to TorchScript")
+	from evaluate import load_checkpoint
+	from benchmarks.common import make_batch, time_fn
+
+	device = torch.device("cpu")
+	start = time.perf_counter()
+	duck, model = load_checkpoint(cli.checkpoint, device, cli.quantize, cli.quantize_head)
+	eager_load = time.perf_counter() - start
+	wrapper = TensorInference(model).eval()
+	vocab_size = model.gnn.bert.config.vocab_size
+
+	## Trace on a small batch, check on batches of other shapes
+	example = make_batch(8, 2, vocab_size, seed=0)
+	export(wrapper, batch_inputs(example), cli.output, cli.format, cli.opset)
+	print("Exported {} to {} ({})".format(duck.args.modelName, cli.output, cli.format))
+
+	start = time.perf_counter()
+	exported = load_exported(cli.output)
+	exported_load = time.perf_counter() - start
+	print("Load time: eager {:.2f}s, exported {:.2f}s".format(eager_load, exported_load))
+
+	print("\n{:>6s} {:>6s} {:>12s} {:>12s} {:>12s}".format("nodes", "trees", "max |diff|", "eager (ms)", "export (ms)"))
+	failed = False
+	for shape in cli.check_shapes.split(","):
+		tree_size, n_trees = (int(n) for n in shape.split("x"))
+		batch = make_batch(tree_size, n_trees, vocab_size, seed=tree_size)
+		inputs = batch_inputs(batch)
+		with torch.inference_mode():
+			reference = model(batch)
+			eager = time_fn(lambda: model(batch), warmup=2, repeat=cli.repeat)
+		output = exported(*inputs)
+		fast = time_fn(lambda: exported(*inputs), warmup=2, repeat=cli.repeat)
+
+		diff = float((output - reference).abs().max()) if output.shape == reference.shape else float("inf")
+		failed |= not np.isfinite(diff) or diff > cli.atol
+		print("{:6d} {:6d} {:12.2e} {:12.2f} {:12.2f}".format(tree_size, n_trees, diff, eager["mean"] * 1000, fast["mean"] * 1000))
+
+	if failed:
+		print("\nExported model differs from eager mode by more than {}".format(cli.atol))
+		sys.exit(1)
+	print("\nExported model matches eager mode (atol {})".format(cli.atol))
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,197 @@
+"""
+Successive halving over a `sweep.py` grid.
+
+	python halving.py --grid scripts/grid_run.json --rungs 2,6,20 --keep 0.33
+
+All (lr, glr, dropout) configurations start together; each one is trained on
+all folds of its grid up to the next epoch rung, configurations are ranked by
+their mean best macro-F1 over folds (per dataset) and only the top `--keep`
+fraction continues. Training state is saved between rungs, so promoted
+configurations pick up where they stopped. Every fold of every configuration
+still gets its line in `{result_path}/{datasetName}.txt`, with the best
+metrics reached before it was stopped.
+"""
+import os
+import sys
+import json
+import math
+import time
+import queue
+import argparse
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+from sweep import load_grid, plan_slots, config_name, to_argv
+
+def parse_args():
+	parser = argparse.ArgumentParser(description="Successive-halving hyper-parameter search for DUCK")
+	parser.add_argument("--grid", type=str, required=True, help="JSON grid definition, see scripts/grid_run.json")
+	parser.add_argument("--rungs", type=str, default="2,6,20", help="comma separated epochs at which configurations are compared, the last one is the full training length")
+	parser.add_argument("--keep", type=float, default=1 / 3, help="fraction of configurations promoted at each rung")
+	parser.add_argument("--state_dir", type=str, default=None, help="training states between rungs, default: {result_path}/halving")
+	parser.add_argument("--keep_states", action="store_true", help="do not delete the training states of finished configurations")
+	parser.add_argument("--jobs", type=int, default=0, help="concurrent runs, 0 for auto (from cores and memory)")
+	parser.add_argument("--threads_per_run", type=int, default=0, help="intra-op threads of each run, 0 for auto")
+	parser.add_argument("--mem_per_run_gb", type=float, default=6.0)
+	parser.add_argument("--no_pin", action="store_true")
+
+	## Internal: train one fold of one configuration up to a rung
+	parser.add_argument("--run_segment", type=str, default=None, help=argparse.SUPPRESS)
+	return parser.parse_args()
+
+def run_segment(spec_path):
+	"""Worker process: resume one (configuration, fold) from its state, train up to `end_epoch` and report back."""
+	from train import DUCK, get_parser
+
+	with open(spec_path) as f:
+		spec = json.load(f)
+
+	config = dict(spec["config"])
+	config["n_epochs"] = spec["end_epoch"]
+	config["ckpt_every_min"] = 0 ## states are kept between rungs instead
+	args = get_parser().parse_args(to_argv(config))
+
+	duck = DUCK(args)
+	duck.setup()
+	if os.path.isfile(spec["state_path"]):
+		duck.load_state(spec["state_path"])
+
+	first_epoch = duck.start_epoch
+	last_epoch = duck.start_epoch - 1
+	if not duck.early_stopping.early_stop:
+		for epoch in range(duck.start_epoch, spec["end_epoch"]):
+			duck.train_epoch(epoch)
+			val_loss, metrics = duck.evaluate(epoch)
+			last_epoch = epoch
+			if duck.update_best(epoch, val_loss, metrics):
+				break
+	duck.save_state(spec["state_path"], last_epoch + 1)
+
+	with open(spec["output_path"], "w") as fw:
+		json.dump({
+			"score": duck.early_stopping.best_score,
+			"early_stop": duck.early_stopping.early_stop,
+			"epochs": last_epoch + 1 - first_epoch,
+			"result_line": duck.format_result(duck.best_metrics) if duck.best_metrics is not None else None,
+			"result_header": duck.result_header(),
+		}, fw)
+
+def group_name(config):
+	"""Name of a configuration regardless of its fold."""
+	return config_name(dict(config, foldnum="*"))
+
+def main():
+	args = parse_args()
+	if args.run_segment is not None:
+		run_segment(args.run_segment)
+		return
+
+	from utils import append_result
+
+	rungs = [int(rung) for rung in args.rungs.split(",")]
+	configs = load_grid(args.grid)
+
+	## Configurations (all folds) per dataset
+	groups = {}
+	for config in configs:
+		groups.setdefault(group_name(config), []).append(config)
+	alive = set(groups.keys())
+	print("{} configurations x folds = {} runs, rungs at epochs {}".format(len(groups), len(configs), rungs))
+
+	slots = plan_slots(len(configs), args.jobs, args.threads_per_run, args.mem_per_run_gb)
+	free_slots = queue.Queue()
+	for slot in slots:
+		free_slots.put(slot)
+
+	def state_dir(config):
+		return args.state_dir or "{}/halving".format(config.get("result_path", "./result"))
+
+	def run(job):
+		config, end_epoch = job
+		name = config_name(config)
+		directory = state_dir(config)
+		os.makedirs(directory, exist_ok=True)
+		spec_path = "{}/{}.json".format(directory, name)
+		output_path = "{}/{}.out.json".format(directory, name)
+
+		slot = free_slots.get()
+		try:
+			config = dict(config)
+			config["intra_op_threads"] = len(slot)
+			if not args.no_pin:
+				config["pin_cores"] = ",".join(str(core) for core in slot)
+			with open(spec_path, "w") as fw:
+				json.dump({"config": config, "end_epoch": end_epoch, "state_path": "{}/{}.pt".format(directory, name), "output_path": output_path}, fw)
+			with open("{}/{}.log".format(directory, name), "a") as log:
+				returncode = subprocess.call([sys.executable, "halving.py", "--grid", args.grid, "--run_segment", spec_path], stdout=log, stderr=subprocess.STDOUT)
+		finally:
+			free_slots.put(slot)
+
+		if returncode != 0:
+			print("[FAILED] {} up to epoch {}".format(name, end_epoch))
+			return None
+		with open(output_path) as f:
+			return json.load(f)
+
+	def finish(group, outcomes):
+		"""Record the fold-level results of a configuration and drop its states."""
+		for config, outcome in zip(groups[group], outcomes[group]):
+			if outcome is not None and outcome["result_line"] is not None:
+				result_file = "{}/{}.txt".format(config.get("result_path", "./result"), config.get("datasetName"))
+				os.makedirs(os.path.dirname(result_file), exist_ok=True)
+				append_result(result_file, outcome["result_line"], header=outcome["result_header"])
+			if not args.keep_states:
+				state_path = "{}/{}.pt".format(state_dir(config), config_name(config))
+				if os.path.isfile(state_path):
+					os.remove(state_path)
+
+	start = time.time()
+	epochs_trained = 0
+	outcomes = {}
+	for rung_idx, rung in enumerate(rungs):
+		jobs = [(config, rung) for group in sorted(alive) for config in groups[group]]
+		print("\nRung {} (epoch {}): {} configurations, {} runs".format(rung_idx, rung, len(alive), len(jobs)))
+		with ThreadPoolExecutor(max_workers=len(slots)) as executor:
+			results = list(executor.map(run, jobs))
+
+		outcomes = {group: [] for group in alive}
+		for (config, _), result in zip(jobs, results):
+			outcomes[group_name(config)].append(result)
+			if result is not None:
+				epochs_trained += result["epochs"]
+
+		## Mean best macro-F1 over folds; failed runs count as 0
+		scores = {}
+		for group in alive:
+			fold_scores = [(result["score"] or 0.0) if result is not None else 0.0 for result in outcomes[group]]
+			scores[group] = sum(fold_scores) / len(fold_scores)
+
+		if rung_idx == len(rungs) - 1:
+			break
+
+		## Promote the top fraction within each dataset
+		promoted = set()
+		by_dataset = {}
+		for group in alive:
+			by_dataset.setdefault(groups[group][0].get("datasetName"), []).append(group)
+		for dataset, dataset_groups in by_dataset.items():
+			dataset_groups.sort(key=lambda group: scores[group], reverse=True)
+			n_keep = max(1, int(math.ceil(len(dataset_groups) * args.keep)))
+			promoted.update(dataset_groups[:n_keep])
+			for group in dataset_groups[n_keep:]:
+				print("- stop {} (macroF {:.4f})".format(group, scores[group]))
+				finish(group, outcomes)
+		alive = promoted
+
+	for group in sorted(alive, key=lambda group: scores[group], reverse=True):
+		print("* {} (macroF {:.4f})".format(group, scores[group]))
+		finish(group, outcomes)
+
+	## Epochs a plain sweep would have trained (ignoring early stopping)
+	full_epochs = len(configs) * rungs[-1]
+	print("\nTrained {} epochs instead of {} ({:.1f}%) in {:.1f} min".format(
+		epochs_trained, full_epochs, 100.0 * epochs_trained / full_epochs, (time.time() - start) / 60
+	))
+
+if __name__ == "__main__":
+	main()
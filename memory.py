@@ -0,0 +1,126 @@
+"""
+Peak memory of training steps, per batch (`train.py --track_memory`).
+
+For every batch the peak process RSS, the peak device memory (CUDA) and
+the bytes of tensors saved by autograd for the backward pass are recorded
+along with the batch's node count, token count and event ids. At the end
+of an epoch the worst batches are listed and memory is fitted against the
+number of nodes, to choose `--max_tree_len` / node budgets from data.
+"""
+import os
+import csv
+import json
+from contextlib import contextmanager
+
+import numpy as np
+import torch
+
+def read_proc_status():
+	"""(current RSS, peak RSS) of this process in bytes, from /proc (Linux); (None, None) elsewhere."""
+	rss, hwm = None, None
+	try:
+		with open("/proc/self/status") as f:
+			for line in f:
+				if line.startswith("VmRSS:"):
+					rss = int(line.split()[1]) * 1024
+				elif line.startswith("VmHWM:"):
+					hwm = int(line.split()[1]) * 1024
+	except OSError:
+		pass
+	return rss, hwm
+
+def reset_peak_rss():
+	"""Reset the peak RSS (VmHWM) of this process, returns False when not supported."""
+	try:
+		with open("/proc/self/clear_refs", "w") as fw:
+			fw.write("5")
+		return True
+	except OSError:
+		return False
+
+def fit_curve(nodes, values, degree=2):
+	"""Least-squares polynomial `values ~ nodes`, highest degree first, with its R^2."""
+	nodes, values = np.asarray(nodes, dtype=float), np.asarray(values, dtype=float)
+	degree = min(degree, len(np.unique(nodes)) - 1)
+	if degree < 1:
+		return None
+	coeffs = np.polyfit(nodes, values, degree)
+	residual = values - np.polyval(coeffs, nodes)
+	total = ((values - values.mean()) ** 2).sum()
+	return {"degree": int(degree), "coeffs": [float(c) for c in coeffs], "r2": float(1 - (residual ** 2).sum() / total) if total > 0 else 1.0}
+
+class MemoryTracker:
+	FIELDS = ["epoch", "batch", "trees", "nodes", "max_tree_nodes", "tokens", "rss_peak_mb", "rss_delta_mb", "device_peak_mb", "saved_tensors_mb", "event_ids"]
+
+	def __init__(self, device, enabled=True):
+		self.device = device
+		self.enabled = enabled
+		self.records = []
+		self.can_reset_rss = reset_peak_rss() if enabled else False
+
+	@contextmanager
+	def track(self, batch, epoch, batch_idx):
+		"""Measure the forward & backward pass run inside the block."""
+		if not self.enabled:
+			yield
+			return
+
+		if self.can_reset_rss:
+			reset_peak_rss()
+		rss_before, _ = read_proc_status()
+		cuda = self.device.type == "cuda"
+		if cuda:
+			torch.cuda.reset_peak_memory_stats(self.device)
+
+		## Count each saved storage once (weights & activations shared by several ops)
+		saved, seen = [0], set()
+		def pack(tensor):
+			key = (tensor.data_ptr(), tensor.numel(), tensor.dtype)
+			if key not in seen:
+				seen.add(key)
+				saved[0] += tensor.numel() * tensor.element_size()
+			return tensor
+		with torch.autograd.graph.saved_tensors_hooks(pack, lambda tensor: tensor):
+			yield
+
+		rss_after, rss_peak = read_proc_status()
+		if not self.can_reset_rss and rss_after is not None:
+			rss_peak = max(rss_before or 0, rss_after) ## no per-batch peak available, best effort
+		tree_nodes = torch.bincount(batch.batch)
+		self.records.append({
+			"epoch": epoch,
+			"batch": batch_idx,
+			"trees": int(batch.num_graphs),
+			"nodes": int(batch.num_nodes),
+			"max_tree_nodes": int(tree_nodes.max()),
+			"tokens": int(batch.attention_mask.sum()) + int(batch.attention_mask_seq.sum()),
+			"rss_peak_mb": rss_peak / 2 ** 20 if rss_peak is not None else None,
+			"rss_delta_mb": (rss_peak - rss_before) / 2 ** 20 if rss_peak is not None and rss_before is not None else None,
+			"device_peak_mb": torch.cuda.max_memory_allocated(self.device) / 2 ** 20 if cuda else None,
+			"saved_tensors_mb": saved[0] / 2 ** 20,
+			"event_ids": " ".join(str(event_id) for event_id in batch.event_id) if "event_id" in batch else "",
+		})
+
+	def summary(self, topk=10):
+		"""Worst batches and memory-vs-nodes fits of the records so far."""
+		if not self.records:
+			return {}
+		key = "device_peak_mb" if self.records[0]["device_peak_mb"] is not None else "rss_peak_mb"
+		worst = sorted(self.records, key=lambda record: (record[key] or 0, record["saved_tensors_mb"]), reverse=True)[:topk]
+		nodes = [record["nodes"] for record in self.records]
+		fits = {"saved_tensors_mb": fit_curve(nodes, [record["saved_tensors_mb"] for record in self.records])}
+		if self.records[0][key] is not None:
+			fits[key] = fit_curve(nodes, [record[key] for record in self.records])
+		return {"peak_key": key, "worst": worst, "fit_vs_nodes": fits}
+
+	def write(self, path, topk=10):
+		"""Write every batch to `path`.csv and the summary to `path`.json, returns the summary."""
+		os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+		with open(path + ".csv", "w", newline="") as fw:
+			writer = csv.DictWriter(fw, fieldnames=self.FIELDS)
+			writer.writeheader()
+			writer.writerows(self.records)
+		summary = self.summary(topk)
+		with open(path + ".json", "w") as fw:
+			json.dump(summary, fw, indent=2)
+		return summary
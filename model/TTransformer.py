@@ -1,4 +1,3 @@
-import ipdb
 import math
 from typing import Tuple
 
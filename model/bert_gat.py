@@ -1,7 +1,6 @@
 import copy
-import ipdb
 
-from transformers import BertModel
+from transformers import BertModel, BertConfig
 
 import torch
 import torch.nn as nn
@@ -10,27 +9,37 @@ from torch_geometric.nn import global_mean_pool, global_max_pool
 from torch_geometric.nn import GCNConv,GraphConv,GINConv,GATConv
 from torch_scatter import scatter_mean, scatter_max, scatter_add
 
+def load_bert(bert_version, pretrained=True):
+	"""`BertModel` of `bert_version`, with its pretrained weights or only its architecture (weights loaded later from a checkpoint)."""
+	if pretrained:
+		return BertModel.from_pretrained(bert_version)
+	return BertModel(BertConfig.from_pretrained(bert_version))
+
 class SimpleGAT_BERT(nn.Module):
-	def __init__(self,in_feats,hid_feats,out_feats,n_heads,gat_dropout,pooling='scatter_mean'):
+	def __init__(self,in_feats,hid_feats,out_feats,n_heads,gat_dropout,pooling='scatter_mean',bert_version='bert-base-uncased',pretrained=True):
 		super(SimpleGAT_BERT, self).__init__()
 		self.pooling = pooling
-		self.bert = BertModel.from_pretrained('bert-base-uncased')
+		self.bert = load_bert(bert_version, pretrained)
 		self.conv1 = GATConv(in_feats, hid_feats, heads=n_heads, dropout=gat_dropout)
 		self.conv2 = GATConv(hid_feats * n_heads, out_feats, heads=n_heads, concat=False, dropout=gat_dropout)
 
 	def forward(self, data):
 		#x, edge_index = data.x, data.edge_index
-		input_ids, attention_mask = data.input_ids, data.attention_mask
-		batch_size = max(data.batch) + 1
+		return self.propagate(self.encode(data.input_ids, data.attention_mask), data)
 
+	def encode(self, input_ids, attention_mask):
+		"""BERT `[CLS]` embedding of every node, i.e. of every (source, post) pair."""
 		# Feed input to BERT
 		outputs = self.bert(input_ids=input_ids,
 							attention_mask=attention_mask)
 
 		# Extract the last hidden state of the token `[CLS]` for classification task
 		last_hidden_state_cls = outputs[0][:, 0, :]
+		return last_hidden_state_cls
 
-		x, edge_index = last_hidden_state_cls, data.edge_index
+	def propagate(self, x, data):
+		"""GAT layers & pooling on top of the node embeddings `x` of the trees in `data`."""
+		edge_index = data.edge_index
 		#print('*******************After  x.shape', x.shape)
 		x = F.dropout(x, p=0.6, training=self.training)
 		#x = F.dropout(x, p=0.1, training=self.training)
@@ -61,7 +70,7 @@ class SimpleGAT_BERT(nn.Module):
 			x = torch.cat([x_mean,x_max],1)
 		elif self.pooling == 'root':
 			rootindex = data.rootindex
-			root_extend = torch.zeros(len(data.batch), 768).to(device)
+			root_extend = torch.zeros(len(data.batch), x.size(-1)).to(x.device)
 			batch_size = max(data.batch) + 1
 			for num_batch in range(batch_size):
 				index = (torch.eq(data.batch, num_batch))
@@ -75,11 +84,11 @@ class SimpleGAT_BERT(nn.Module):
 
 class SimpleGATBERTNet(nn.Module):
 	#def __init__(self, in_feats, hid_feats, out_feats, D_in, H, D_out, pooling='scatter_mean'):
-	def __init__(self, D_in, hid_feats, out_feats, H, D_out, gat_dropout, pooling='scatter_mean'):
+	def __init__(self, D_in, hid_feats, out_feats, H, D_out, gat_dropout, pooling='scatter_mean', bert_version='bert-base-uncased', pretrained=True):
 		super(SimpleGATBERTNet, self).__init__()
 		self.pooling = pooling
 		#D_in, H = 768,32,4
-		self.gnn = SimpleGAT_BERT(in_feats=D_in, hid_feats=hid_feats, out_feats=out_feats, n_heads=8, gat_dropout=gat_dropout, pooling=pooling)
+		self.gnn = SimpleGAT_BERT(in_feats=D_in, hid_feats=hid_feats, out_feats=out_feats, n_heads=8, gat_dropout=gat_dropout, pooling=pooling, bert_version=bert_version, pretrained=pretrained)
 		#self.gnn = SimpleGAT_BERT(D_in, hid_feats, out_feats, pooling, n_heads=8)
 
 		if (self.pooling == 'mean_max') or (self.pooling == 'scatter_mean_max'):
@@ -89,21 +98,39 @@ class SimpleGATBERTNet(nn.Module):
 		self.fc2 = nn.Linear(H, D_out)
 
 
+	## Parts of the pooled representation fed to `fc1`, in order
+	representation = ("gnn_x",)
+
 	def forward(self, data):
+		return self.classify(*self.represent(data))
+
+	def represent(self, data):
+		"""Pooled representation of each tree fed to `fc1`, see `representation`."""
 		gnn_x = self.gnn(data)
 		#print('x.shape',x.shape)
+		return (gnn_x,)
+
+	def classify(self, gnn_x):
 		x = self.fc1(gnn_x)
 		x = self.fc2(x)
 		x = F.log_softmax(x, dim=1)
 		return x
 
+	def encode(self, data):
+		"""Per-node encoder outputs, see `head`."""
+		return (self.gnn.encode(data.input_ids, data.attention_mask),)
+
+	def head(self, data, node_x):
+		"""Everything after the encoder, from cached per-node embeddings (`encode`)."""
+		return self.classify(self.gnn.propagate(node_x, data))
+
 
 
 class TripleGAT_BERT(nn.Module):
-	def __init__(self,in_feats,hid_feats,out_feats,pooling='scatter_mean'):
+	def __init__(self,in_feats,hid_feats,out_feats,pooling='scatter_mean',bert_version='bert-base-uncased'):
 		super(TripleGAT_BERT, self).__init__()
 		self.pooling = pooling
-		self.bert = BertModel.from_pretrained('bert-base-uncased')
+		self.bert = BertModel.from_pretrained(bert_version)
 		self.conv1 = GATConv(in_feats, hid_feats*2, heads=8,dropout=0.6)
 		self.conv2 = GATConv(hid_feats*8*2, hid_feats,heads=8,dropout=0.6)
 		self.conv3 = GATConv(hid_feats*8, out_feats,heads=1,concat=False,dropout=0.6)
@@ -159,10 +186,10 @@ class TripleGAT_BERT(nn.Module):
 
 
 class TripleGATBERTNet(nn.Module):
-	def __init__(self,in_feats,hid_feats,out_feats,D_in,H,D_out,pooling='scatter_mean'):
+	def __init__(self,in_feats,hid_feats,out_feats,D_in,H,D_out,pooling='scatter_mean',bert_version='bert-base-uncased'):
 		super(TripleGATBERTNet, self).__init__()
 		self.pooling = pooling
-		self.gnn = TripleGAT_BERT(in_feats, hid_feats, out_feats,pooling)
+		self.gnn = TripleGAT_BERT(in_feats, hid_feats, out_feats,pooling,bert_version)
 
 		self.fc = nn.Linear(out_feats,D_out)
 
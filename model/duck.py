@@ -1,30 +1,50 @@
-import ipdb
-
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
-from transformers import BertModel
 
 from .gat import SimpleGAT
-from .bert_gat import SimpleGAT_BERT
+from .bert_gat import SimpleGAT_BERT, load_bert
 from .TTransformer import TTransformerModel
 
+def pad_by_batch(x, batch, num_graphs):
+	"""
+	Node features `x` of each tree padded to (num_graphs, max_tree_len, dim), with the 
+	(num_graphs, max_tree_len) mask of real nodes. Trees are contiguous in `batch` as in
+	PyG batches; only tensor ops are used, so `num_graphs` may be a tensor and the 
+	function traces with dynamic shapes.
+	"""
+	graph_ids = torch.arange(num_graphs, device=batch.device)
+	counts = torch.zeros_like(graph_ids).scatter_add(0, batch, torch.ones_like(batch))
+	max_len = counts.max()
+
+	## Slot of every node in the flattened (num_graphs * max_tree_len) padded batch
+	position = torch.arange(batch.size(0), device=batch.device) - (counts.cumsum(0) - counts)[batch]
+	slots = batch * max_len + position
+	grid = graph_ids.unsqueeze(1) * max_len + torch.arange(max_len, device=batch.device).unsqueeze(0)
+
+	flat_mask = torch.zeros_like(grid.reshape(-1), dtype=torch.float)
+	flat = flat_mask.to(x.dtype).unsqueeze(1).repeat(1, x.size(-1)).index_put((slots,), x)
+	flat_mask = flat_mask.index_put((slots,), torch.ones_like(slots, dtype=torch.float))
+	return flat[grid], flat_mask[grid]
+
 # Create the BertClassfier class
 class BertClassifier(nn.Module):
 	"""Bert Model for Classification Tasks.
 	"""
-	def __init__(self, freeze_bert=False):
+	def __init__(self, freeze_bert=False, bert_version="bert-base-uncased", pretrained=True):
 		"""
 		@param    bert: a BertModel object
 		@param    classifier: a torch.nn.Module classifier
 		@param    freeze_bert (bool): Set `False` to fine-tune the BERT model
+		@param    bert_version (str): hub name or local path of the BERT encoder
+		@param    pretrained (bool): Set `False` to skip loading the pretrained weights (restored from a checkpoint later)
 		"""
 		super(BertClassifier, self).__init__()
 		# Specify hidden size of BERT, hidden size of our classifier, and number of labels
 		D_in, H, D_out = 768, 64, 2
 
 		# Instantiate BERT model
-		self.bert = BertModel.from_pretrained('bert-base-uncased')
+		self.bert = load_bert(bert_version, pretrained)
 
 		# Freeze the BERT model
 		#if freeze_bert:
@@ -90,54 +110,54 @@ class CCCTNet(nn.Module):
 	NEW: Comment Chain Comment Tree (CCCT) Network
 	Ignore the user tree network.
 	"""
-	def __init__(self, in_feats, hid_feats, out_feats, D_in, D_H, D_out):
+	def __init__(self, in_feats, hid_feats, out_feats, D_in, D_H, D_out, bert_version="bert-base-uncased", pretrained=True):
 		super(CCCTNet, self).__init__()
 		#D_in, H, D_out = 768, 64, 4
-		self.bert_seq = BertClassifier(freeze_bert=False)
-		self.bert_tt  = TTransformerModel(ntoken=self.bert_seq.bert.config.vocab_size)
-		self.gnn = SimpleGAT_BERT(in_feats=in_feats, hid_feats=hid_feats, out_feats=out_feats, n_heads=8, gat_dropout=0.6)
+		self.bert_seq = BertClassifier(freeze_bert=False, bert_version=bert_version, pretrained=pretrained)
+		self.bert_tt  = TTransformerModel(ntoken=self.bert_seq.bert.config.vocab_size, d_model=D_in, d_hid=D_in)
+		self.gnn = SimpleGAT_BERT(in_feats=in_feats, hid_feats=hid_feats, out_feats=out_feats, n_heads=8, gat_dropout=0.6, bert_version=bert_version, pretrained=pretrained)
 		
 		self.fc1 = nn.Linear((out_feats + D_in), D_H)
 		self.fc2 = nn.Linear(D_H, D_out)
 
 	def pad_and_reshape_batch(self, data, bert_x):
-		batch_size = data.y.__len__()
-		pad_tensor = torch.zeros([1, 768]).to(data.batch.device)
+		return pad_by_batch(bert_x, data.batch, data.y.__len__())
 
-		batches, tree_lens = [], []
-		for batch_idx in range(batch_size):
-			batch = bert_x[data.batch == batch_idx]
-			batches.append(batch)
+	## Parts of the pooled representation fed to `fc1`, in order
+	representation = ("bert_gat_x", "seq_x")
 
-			tree_len = (data.batch == batch_idx).sum()
-			tree_lens.append(tree_len)
+	def forward(self, data):
+		return self.classify(*self.represent(data))
 
-		max_len = max(tree_lens)
-		pad_batches, pad_masks = [], []
-		for batch_idx, batch in enumerate(batches):
-			pad_tensors = pad_tensor.repeat(max_len - len(batch), 1)
-			pad_batches.append(torch.cat((batch, pad_tensors), dim=0))
+	def represent(self, data):
+		"""Pooled representations of each tree concatenated before `fc1`, see `representation`."""
+		## 2-tier transformer
+		bert_x = self.bert_seq(data)
+		seq_x = self.chain(data, bert_x)
 
-			pad_mask = torch.zeros(max_len)
-			pad_mask[:len(batch)] = 1
-			pad_masks.append(pad_mask)
+		## BERT+GAT
+		bert_gat_x = self.gnn(data)
 
-		pad_batches = torch.stack(pad_batches).to(data.batch.device)
-		pad_masks   = torch.stack(pad_masks).to(data.batch.device)
-		return pad_batches, pad_masks
+		return bert_gat_x, seq_x
 
-	def forward(self, data):
-		## 2-tier transformer
-		bert_x = self.bert_seq(data)
+	def chain(self, data, bert_x):
+		"""Second tier of the 2-tier transformer, over the node embeddings of each comment chain."""
 		bert_x, bert_x_mask = self.pad_and_reshape_batch(data, bert_x)
 		seq_x = self.bert_tt(data, bert_x, bert_x_mask)
 		seq_x = seq_x[:, 0, :] ## Extract the representation of `[CLS]` token for each sequence
+		return seq_x
 
-		## BERT+GAT
-		bert_gat_x = self.gnn(data)
-
+	def classify(self, bert_gat_x, seq_x):
 		x = torch.cat((bert_gat_x, seq_x), 1)
 		x = self.fc1(x)
 		x = self.fc2(x)
 		x = F.log_softmax(x, dim=1)
 		return x
+
+	def encode(self, data):
+		"""Per-node encoder outputs (`bert_seq` and the GAT's BERT), see `head`."""
+		return self.bert_seq(data), self.gnn.encode(data.input_ids, data.attention_mask)
+
+	def head(self, data, bert_x, node_x):
+		"""Everything after the encoders, from cached per-node embeddings (`encode`)."""
+		return self.classify(self.gnn.propagate(node_x, data), self.chain(data, bert_x))
@@ -0,0 +1,191 @@
+"""
+Online scoring: update a thread's class probabilities as its replies arrive.
+
+	python online.py --checkpoint ./result/ckpt/twitter15_fold0_CCCTNet/best.pt --input new/data.csv --output updates.jsonl
+
+The per-node encoder outputs (BERT `[CLS]` of each (source, post) pair) do not
+depend on the rest of the tree, so `OnlineScorer` keeps them per thread along
+with the edges. A new reply costs one BERT pass over a single (source, reply)
+pair; only the GAT, the second-tier transformer and the classifier are run
+again over the cached embeddings. As in training, only the first
+`max_tree_len` replies of a thread are used: later replies are recorded but do
+not change the score, which bounds the cost of an update.
+
+`--input` replays a `data.csv` in the `preprocess.py` schema row by row (the
+source tweet of a thread first), one output line per update, and reports the
+update latency.
+"""
+import sys
+import json
+import time
+import argparse
+from collections import OrderedDict
+
+import numpy as np
+import torch
+from tqdm import tqdm
+from torch_geometric.data import Data
+
+from utils import MAX_LEN, get_tokenizer
+from evaluate import load_checkpoint
+from predict import LABELS, read_csv_threads
+
+def parse_args():
+	parser = argparse.ArgumentParser(description="Incremental scoring of threads with a trained DUCK checkpoint")
+	parser.add_argument("--checkpoint", type=str, required=True, help="best.pt or last.pt written by train.py")
+	parser.add_argument("--input", type=str, required=True, help="data.csv-style file replayed as a stream of posts")
+	parser.add_argument("--output", type=str, default=None, help="JSONL file, one line per update")
+	parser.add_argument("--max_tree_len", type=int, default=None, help="replies used per thread, default: the training value")
+	parser.add_argument("--quantize", type=str, default=None, choices=["int8"], help="dynamic quantization of the encoders for CPU inference")
+	parser.add_argument("--quantize_head", action="store_true", help="with --quantize, also quantize fc1 / fc2")
+	parser.add_argument("--max_threads", type=int, default=10000, help="threads kept in memory, the least recently updated are dropped first")
+	return parser.parse_args()
+
+class ThreadState:
+	"""Cached encoder outputs & edges of one thread."""
+	def __init__(self, source_text, capacity, cls_id):
+		self.source_text = source_text
+		self.capacity = capacity ## nodes kept, the source tweet included
+		self.cls_id = cls_id
+		self.embeddings = None   ## tuple of (capacity, hidden) tensors, one per encoder output
+		self.num_nodes = 0
+		self.edges = []          ## (parent, child) node positions
+		self.position = {}       ## post id -> node position
+		self.num_posts = 0       ## posts received, replies beyond `capacity` included
+
+	def append(self, post_id, parent, node_embeddings):
+		position = self.num_nodes
+		if self.embeddings is None:
+			self.embeddings = tuple(x.new_zeros(self.capacity, x.size(-1)) for x in node_embeddings)
+		for cache, x in zip(self.embeddings, node_embeddings):
+			cache[position] = x[0]
+		if parent is not None:
+			self.edges.append((self.position[parent], position))
+		self.position[post_id] = position
+		self.num_nodes += 1
+
+	def graph(self, device):
+		"""The thread as a one-tree batch for `model.head`."""
+		edges = self.edges if self.edges else [(0, 0)]
+		return Data(
+			edge_index=torch.tensor(edges, dtype=torch.long, device=device).t().contiguous(),
+			batch=torch.zeros(self.num_nodes, dtype=torch.long, device=device),
+			rootindex=torch.zeros(1, dtype=torch.long, device=device),
+			input_ids=torch.full((1, 1), self.cls_id, dtype=torch.long, device=device), ## `[CLS]` id read by the second-tier transformer
+			y=torch.full((1,), -1, dtype=torch.long, device=device),
+			num_nodes=self.num_nodes,
+		)
+
+class OnlineScorer:
+	"""
+	Per-thread incremental scoring with a model exposing `encode(data)` and `head(data, *node_embeddings)`
+	(`CCCTNet`, `SimpleGATBERTNet`). Threads are keyed by event id, at most `max_threads` are kept.
+	"""
+	def __init__(self, model, bert_version, max_tree_len, device, max_threads=10000):
+		self.model = model
+		self.tokenizer = get_tokenizer(bert_version)
+		self.max_tree_len = max_tree_len
+		self.device = device
+		self.max_threads = max_threads
+		self.threads = OrderedDict()
+
+	def encode_pair(self, source_text, text):
+		"""Encoder outputs of the node (source, text), same tokenization as `utils.preprocessing_for_bert_latest`."""
+		encoded = self.tokenizer.encode_plus(
+			text=source_text,
+			text_pair=text,
+			add_special_tokens=True,
+			max_length=MAX_LEN,
+			truncation=True,
+			padding="max_length",
+			return_attention_mask=True
+		)
+		data = Data(
+			input_ids=torch.tensor([encoded["input_ids"]], device=self.device),
+			attention_mask=torch.tensor([encoded["attention_mask"]], device=self.device),
+		)
+		return self.model.encode(data), encoded["input_ids"][0]
+
+	@torch.inference_mode()
+	def start(self, event_id, source_text, post_id=None):
+		"""Start a thread from its source tweet, returns its class probabilities."""
+		node_embeddings, cls_id = self.encode_pair(source_text, source_text)
+		state = ThreadState(source_text, self.max_tree_len + 1, cls_id)
+		state.append(post_id, None, node_embeddings)
+		state.num_posts = 1
+
+		self.threads[event_id] = state
+		self.threads.move_to_end(event_id)
+		while len(self.threads) > self.max_threads:
+			self.threads.popitem(last=False)
+		return self.score(event_id)
+
+	@torch.inference_mode()
+	def add_reply(self, event_id, text, parent=None, post_id=None):
+		"""
+		Add a reply to `parent` (a post id given to `start` / `add_reply`, the source tweet when None
+		or unknown) and return the updated class probabilities of the thread.
+		"""
+		state = self.threads[event_id]
+		self.threads.move_to_end(event_id)
+		state.num_posts += 1
+		if state.num_nodes < state.capacity:
+			if parent not in state.position:
+				parent = next(iter(state.position))
+			node_embeddings, _ = self.encode_pair(state.source_text, text)
+			state.append(post_id, parent, node_embeddings)
+		return self.score(event_id)
+
+	@torch.inference_mode()
+	def score(self, event_id):
+		state = self.threads[event_id]
+		n = state.num_nodes
+		log_probs = self.model.head(state.graph(self.device), *(cache[:n] for cache in state.embeddings))
+		return log_probs.exp()[0].cpu().numpy()
+
+	def drop(self, event_id):
+		self.threads.pop(event_id, None)
+
+def main():
+	cli = parse_args()
+	device = torch.device("cuda:0" if torch.cuda.is_available() else "cpu")
+	duck, model = load_checkpoint(cli.checkpoint, device, cli.quantize, cli.quantize_head, max_tree_len=cli.max_tree_len)
+	args, device = duck.args, duck.device
+	if not hasattr(model, "head"):
+		raise ValueError("{} does not support incremental scoring".format(args.modelName))
+	scorer = OnlineScorer(model, args.bertVersion, args.max_tree_len, device, cli.max_threads)
+
+	fw = open(cli.output, "w") if cli.output is not None else None
+	latencies = []
+	for event_id, _, rows in tqdm(read_csv_threads(cli.input), desc="Replaying", unit="thread", file=sys.stderr):
+		for row in sorted(rows, key=lambda row: int(float(row["self_idx"]))):
+			post_id = int(float(row["self_idx"]))
+			parent = row["parent_idx"]
+			parent = None if parent in ("None", "", "nan") else int(float(parent))
+
+			start = time.perf_counter()
+			if event_id not in scorer.threads:
+				probs = scorer.start(event_id, row["text"], post_id=post_id)
+			else:
+				probs = scorer.add_reply(event_id, row["text"], parent=parent, post_id=post_id)
+			latencies.append(time.perf_counter() - start)
+
+			if fw is not None:
+				fw.write(json.dumps({
+					"event_id": event_id,
+					"post": post_id,
+					"n_posts": scorer.threads[event_id].num_posts,
+					"pred": LABELS[int(probs.argmax())],
+					"probs": {LABELS[k]: round(float(p), 6) for k, p in enumerate(probs)},
+				}) + "\n")
+		scorer.drop(event_id) ## replayed threads are complete
+	if fw is not None:
+		fw.close()
+
+	latencies = np.array(latencies) * 1000
+	print("{} updates, latency mean {:.2f} ms, p50 {:.2f} ms, p95 {:.2f} ms, p99 {:.2f} ms".format(
+		len(latencies), latencies.mean(), np.percentile(latencies, 50), np.percentile(latencies, 95), np.percentile(latencies, 99)
+	))
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,70 @@
+"""
+Command line options of `train.py`.
+
+Kept apart from the training code and its imports (torch, transformers,
+torch_geometric, the models), so that `python train.py --help` and scripts
+reading the defaults start instantly.
+"""
+import argparse
+
+from cpu_utils import add_cpu_args
+
+def get_parser():
+	parser = argparse.ArgumentParser()
+
+	#Required parameters
+	parser.add_argument("--seed", type=int, default=42, help="random seed number for initialization")
+	parser.add_argument("--mode", default="DUCK", type=str, help="pick from CommentTree, UserTree or DUCK")
+	parser.add_argument("--baseDirectory", type=str, default=".", help="the data directory")
+	parser.add_argument("--foldnum", default=0, type=int, help="The fold number to test out")
+	parser.add_argument("--datasetName", default=None, type=str, required=True, help="The name of the dataset to play with")
+	parser.add_argument("--n_classes", default=4, type=int, help="4 for Twitter15/Twitter16, 3 for semeval2019")
+	parser.add_argument("--result_path", type=str, default="./result")
+
+	#Hyper-parameters
+	parser.add_argument("--bertVersion", default="bert-base-uncased", type=str, help="bert version, either a hub name or a local checkpoint directory (e.g. a 4/6-layer BERT)")
+	parser.add_argument("--weight_decay", default=0.0, type=float, help="the weight decay")
+	parser.add_argument("--learningRate", default=5e-5, type=float, help="the initial learning rate")
+	parser.add_argument("--learningRateGraph", default=1e-5, type=float, help="the inital learning rate for GNN")
+	parser.add_argument("--patience"    , default= 10, type=int, help="early stop patience")
+	parser.add_argument("--n_epochs"    , default= 10, type=int, help="fine tuning epoches")
+	parser.add_argument("--batchsize"   , default=256, type=int, help="batch size")
+	parser.add_argument("--multi_gpu"   , default=  0, type=int, help="number of GPUs")
+	parser.add_argument("--dropout_gat" , default=0.5, type=float)
+	parser.add_argument("--max_tree_len", default=1000, type=int, help="maximum tree length, for less GPU memory during training")
+	parser.add_argument("--log_every"   , default=50, type=int, help="show the running train loss/accuracy every N batches, 0 to disable")
+	parser.add_argument("--no_timing"   , dest="timing", action="store_false", help="disable the per-stage timings written next to the result file")
+	parser.add_argument("--eval_every"  , default=1, type=int, help="evaluate every K epochs (and after the last one), early stopping patience counts evaluations")
+	parser.add_argument("--eval_batch_tokens", default=16384, type=int, help="token budget of an evaluation batch, trees are batched by size; 0 to evaluate with --batchsize")
+
+	#Distributed data parallel (CPU: gloo)
+	parser.add_argument("--nproc_per_node", default=1, type=int, help="number of training processes to launch on this host")
+	parser.add_argument("--nnodes"      , default=1, type=int, help="number of hosts taking part in training")
+	parser.add_argument("--node_rank"   , default=0, type=int, help="rank of this host, 0 ~ nnodes-1")
+	parser.add_argument("--master_addr" , default="127.0.0.1", type=str, help="rendezvous address, the host of node_rank 0")
+	parser.add_argument("--master_port" , default=29500, type=int, help="rendezvous port")
+	parser.add_argument("--dist_backend", default="gloo", type=str, choices=["gloo", "nccl"], help="gloo for CPU training")
+
+	#CPU threading & affinity
+	add_cpu_args(parser)
+
+	#Profiling
+	parser.add_argument("--track_memory", action="store_true", help="record peak RSS / device memory / autograd saved tensors of every batch with its tree sizes")
+	parser.add_argument("--profile_steps", default=None, type=str, help="start:end, record training steps start ~ end-1 with torch.profiler (Chrome trace & operator tables in {result_path}/profile)")
+	parser.add_argument("--profile_topk", default=30, type=int, help="rows of the operator tables")
+
+	#torch.compile
+	parser.add_argument("--compile", action="store_true", help="torch.compile the model (dynamic shapes, eager fallback for frames that fail to compile)")
+	parser.add_argument("--compile_mode", default="default", type=str, choices=["default", "reduce-overhead", "max-autotune"], help="torch.compile mode")
+	parser.add_argument("--compile_cache", default=None, type=str, help="directory of compiled artifacts reused across runs, default: {result_path}/compile_cache")
+
+	#Checkpointing & resuming
+	parser.add_argument("--ckpt_dir", default=None, type=str, help="checkpoint directory (last.pt & best.pt), default: {result_path}/ckpt/{datasetName}_fold{foldnum}_{modelName}")
+	parser.add_argument("--ckpt_every_min", default=5, type=float, help="save last.pt at least every N minutes during an epoch, 0 to save only at the end of epochs")
+	parser.add_argument("--ckpt_every_steps", default=0, type=int, help="also save last.pt every N batches, 0 to disable")
+	parser.add_argument("--resume", action="store_true", help="continue from last.pt in the checkpoint directory, at the exact batch it was saved")
+	parser.add_argument("--snapshot", default=None, type=str, help="initial weights, encoder config & tokenizer from a snapshot written by snapshot.py (memory-mapped, replaces --bertVersion)")
+
+	#pick up the model to play with
+	parser.add_argument("--modelName", default=None, required=True, type=str, help="pick up the model to play with")
+	return parser
@@ -0,0 +1,206 @@
+"""
+Batch prediction: class probabilities of new threads from a trained checkpoint.
+
+	python predict.py --checkpoint ./result/ckpt/twitter15_fold0_CCCTNet/best.pt --input new/data.csv --output scores.jsonl
+	python predict.py --checkpoint ... --input ./data/Twitter16graph --output scores.parquet
+
+`--input` is either a `data.csv` in the `preprocess.py` schema (rows of a
+thread next to each other, as in the original files) or a directory of
+`.npz` trees written by `preprocess.py --build_graph`. Threads are read,
+tokenized and batched (up to `--batch_tokens` tokens) in a stream by the
+loader workers, and one line per thread is written as soon as its batch
+is scored, so memory does not grow with the input.
+"""
+import os
+import csv
+import sys
+import json
+import time
+import argparse
+import numpy as np
+
+import torch
+from tqdm import tqdm
+from torch.utils.data import IterableDataset, DataLoader, get_worker_info
+from torch_geometric.data import Batch
+
+from utils import MAX_LEN, MAX_LEN_SEQ
+from dataset import make_comment_tree
+from evaluate import load_checkpoint
+from compiler import compile_model
+from cpu_utils import add_cpu_args, configure_threads, worker_init_fn
+
+try:
+	import pyarrow as pa
+	import pyarrow.parquet as pq
+except ImportError: ## only needed for .parquet outputs
+	pa = pq = None
+
+## Class indices of `preprocess.read_labels`
+LABELS = ["true", "false", "unverified", "non-rumor"]
+
+def parse_args():
+	parser = argparse.ArgumentParser(description="Score threads with a trained DUCK checkpoint")
+	parser.add_argument("--checkpoint", type=str, required=True, help="best.pt or last.pt written by train.py")
+	parser.add_argument("--input", type=str, required=True, help="data.csv-style file or directory of .npz trees")
+	parser.add_argument("--output", type=str, required=True, help=".jsonl or .parquet")
+	parser.add_argument("--batch_tokens", type=int, default=16384, help="token budget of a batch")
+	parser.add_argument("--batch_trees", type=int, default=256, help="maximum trees per batch")
+	parser.add_argument("--max_tree_len", type=int, default=None, help="responses kept per tree, default: the training value")
+	parser.add_argument("--compile", action="store_true", help="torch.compile the model, see compiler.py")
+	parser.add_argument("--compile_cache", type=str, default="./result/compile_cache", help="directory of compiled artifacts reused across runs")
+	parser.add_argument("--quantize", type=str, default=None, choices=["int8"], help="dynamic quantization of the encoders for CPU inference")
+	parser.add_argument("--quantize_head", action="store_true", help="with --quantize, also quantize fc1 / fc2")
+	add_cpu_args(parser) ## --num_workers: loader processes reading & tokenizing threads
+	parser.set_defaults(num_workers=2)
+	return parser.parse_args()
+
+def tree_from_rows(rows):
+	"""
+	(root, nodecontent, edgematrix, rootindex) of one thread from its `data.csv` rows,
+	same output as `preprocess.constructMat_txt` without its quadratic scan.
+	"""
+	nodes = {}
+	for row in rows:
+		parent = row["parent_idx"]
+		parent = None if parent in ("None", "", "nan") else int(float(parent))
+		nodes[int(float(row["self_idx"]))] = (parent, row["text"])
+	order = sorted(nodes)
+	position = {idx: i for i, idx in enumerate(order)}
+
+	edges = sorted((position[parent], position[child]) for child, (parent, _) in nodes.items() if parent is not None and parent in position)
+	edgematrix = np.array([[row for row, _ in edges], [col for _, col in edges]]) if edges else np.array([[0], [0]])
+	root_idx = next((idx for idx in order if nodes[idx][0] is None), order[0])
+	texts = [nodes[idx][1] for idx in order]
+	return np.array([nodes[root_idx][1]]), np.array(texts[1:]), edgematrix, position[root_idx]
+
+def read_csv_threads(path):
+	"""Yield (event id, label or None, rows) for each run of rows sharing a `source_id`."""
+	with open(path, newline="") as f:
+		event_id, label, rows = None, None, []
+		for row in csv.DictReader(f):
+			if row["source_id"] != event_id and rows:
+				yield event_id, label, rows
+				rows = []
+			event_id, label = row["source_id"], row.get("veracity")
+			rows.append(row)
+		if rows:
+			yield event_id, label, rows
+
+class ThreadStream(IterableDataset):
+	"""Batches of trees from `--input`, built by each loader worker for its share of the threads."""
+	def __init__(self, path, max_tree_len, bert_version, batch_tokens, batch_trees):
+		self.path = path
+		self.max_tree_len = max_tree_len
+		self.bert_version = bert_version
+		self.batch_tokens = batch_tokens
+		self.batch_trees = batch_trees
+
+	def threads(self):
+		"""Yield a thunk per thread, only the threads of this worker are actually read."""
+		if os.path.isdir(self.path):
+			for name in sorted(os.listdir(self.path)):
+				if not name.endswith(".npz"):
+					continue
+				def load(name=name):
+					data = np.load(os.path.join(self.path, name), allow_pickle=True)
+					return name[:-len(".npz")], data["root"], data["nodecontent"], data["edgematrix"], int(data["y"]), int(data["rootindex"])
+				yield load
+		else:
+			for event_id, label, rows in read_csv_threads(self.path):
+				def load(event_id=event_id, label=label, rows=rows):
+					root, nodecontent, edgematrix, rootindex = tree_from_rows(rows)
+					y = LABELS.index(label.lower()) if label is not None and label.lower() in LABELS else -1
+					return event_id, root, nodecontent, edgematrix, y, rootindex
+				yield load
+
+	def __iter__(self):
+		worker = get_worker_info()
+		worker_id, n_workers = (worker.id, worker.num_workers) if worker is not None else (0, 1)
+
+		batch, batch_tokens = [], 0
+		for k, load in enumerate(self.threads()):
+			if k % n_workers != worker_id:
+				continue
+			event_id, root, nodecontent, edgematrix, y, rootindex = load()
+			graph = make_comment_tree(root, nodecontent, edgematrix, y, rootindex, self.max_tree_len, self.bert_version, event_id=event_id)
+			tokens = graph.num_nodes * MAX_LEN + MAX_LEN_SEQ
+			if batch and (batch_tokens + tokens > self.batch_tokens or len(batch) >= self.batch_trees):
+				yield Batch.from_data_list(batch)
+				batch, batch_tokens = [], 0
+			batch.append(graph)
+			batch_tokens += tokens
+		if batch:
+			yield Batch.from_data_list(batch)
+
+class JsonlWriter:
+	def __init__(self, path):
+		self.fw = open(path, "w")
+
+	def write(self, event_ids, probs, labels):
+		for event_id, prob, label in zip(event_ids, probs, labels):
+			self.fw.write(json.dumps({
+				"event_id": event_id,
+				"pred": LABELS[int(prob.argmax())],
+				"probs": {LABELS[k]: round(float(p), 6) for k, p in enumerate(prob)},
+				"label": LABELS[label] if label >= 0 else None,
+			}) + "\n")
+		self.fw.flush()
+
+	def close(self):
+		self.fw.close()
+
+class ParquetWriter:
+	"""One row group per batch."""
+	def __init__(self, path, n_classes):
+		if pq is None:
+			raise ImportError("Writing .parquet requires pyarrow (pip install pyarrow)")
+		self.n_classes = n_classes
+		self.schema = pa.schema(
+			[("event_id", pa.string()), ("pred", pa.string()), ("label", pa.string())] +
+			[("prob_{}".format(LABELS[k]), pa.float32()) for k in range(n_classes)]
+		)
+		self.writer = pq.ParquetWriter(path, self.schema)
+
+	def write(self, event_ids, probs, labels):
+		columns = {
+			"event_id": [str(event_id) for event_id in event_ids],
+			"pred": [LABELS[int(prob.argmax())] for prob in probs],
+			"label": [LABELS[label] if label >= 0 else None for label in labels],
+		}
+		for k in range(self.n_classes):
+			columns["prob_{}".format(LABELS[k])] = probs[:, k].astype(np.float32)
+		self.writer.write_table(pa.Table.from_pydict(columns, schema=self.schema))
+
+	def close(self):
+		self.writer.close()
+
+def main():
+	cli = parse_args()
+	layout = configure_threads(cli, local_rank=0, local_world_size=1)
+	device = torch.device("cuda:0" if torch.cuda.is_available() else "cpu")
+	duck, model = load_checkpoint(cli.checkpoint, device, cli.quantize, cli.quantize_head, max_tree_len=cli.max_tree_len)
+	args, device = duck.args, duck.device
+	if cli.compile:
+		compile_model(model, cache_dir=cli.compile_cache)
+
+	stream = ThreadStream(cli.input, args.max_tree_len, args.bertVersion, cli.batch_tokens, cli.batch_trees)
+	loader = DataLoader(stream, batch_size=None, num_workers=layout["num_workers"], worker_init_fn=worker_init_fn(layout), pin_memory=device.type == "cuda")
+	writer = ParquetWriter(cli.output, args.n_classes) if cli.output.endswith(".parquet") else JsonlWriter(cli.output)
+
+	n_threads, start = 0, time.time()
+	try:
+		with torch.inference_mode():
+			for batch in tqdm(loader, desc="Scoring", unit="batch", file=sys.stderr):
+				event_ids = batch.event_id
+				batch = batch.to(device, non_blocking=True)
+				probs = model(batch).exp() ## log-probabilities -> probabilities
+				writer.write(event_ids, probs.cpu().numpy(), batch.y.tolist())
+				n_threads += len(event_ids)
+	finally:
+		writer.close()
+	elapsed = time.time() - start
+	print("{} threads scored in {:.1f}s ({:.1f} threads/sec), written to {}".format(n_threads, elapsed, n_threads / max(elapsed, 1e-9), cli.output))
+
+if __name__ == "__main__":
+	main()
@@ -1,5 +1,7 @@
 import os
 import csv
+import json
+import time
 import ipdb
 import pickle
 import argparse
@@ -15,6 +17,13 @@ def parse_args():
 	parser.add_argument("--make_label", action="store_true")
 	parser.add_argument("--build_graph", action="store_true")
 	parser.add_argument("--split_5_fold", action="store_true")
+	parser.add_argument("--benchmark", action="store_true", help="time the stages of --build_graph instead of running it")
+
+	## Benchmark
+	parser.add_argument("--stage", type=str, default="all", choices=["all", "parse", "labels", "construct", "save"], help="with --benchmark, time only this stage (its inputs are still prepared)")
+	parser.add_argument("--max_events", type=int, default=0, help="with --benchmark, only build the first N events, 0 for all")
+	parser.add_argument("--bench_dir", type=str, default=None, help="with --benchmark, where the save stage writes, default: the graph directory")
+	parser.add_argument("--bench_output", type=str, default=None, help="with --benchmark, JSON file for the stage & per-event timings")
 
 	## Others
 	#parser.add_argument("--data_root", type=str, default="../dataset/processed")
@@ -22,7 +31,7 @@ def parse_args():
 	parser.add_argument("--fold", type=str, default="0,1,2,3,4")
 	parser.add_argument("--data_root", type=str, default="./data", help="root directory for DUCK's data")
 	parser.add_argument("--data_source", type=str, default="../RumorV2/dataset/processedV2")
-	parser.add_argument("--dataset", type=str, default="Twitter15", choices=["semeval2019", "Twitter15", "Twitter16"])
+	parser.add_argument("--dataset", type=str, default="Twitter15", help="semeval2019, Twitter15, Twitter16 or a dataset generated by synthetic.py")
 
 	args = parser.parse_args()
 
@@ -133,11 +142,9 @@ def constructMat_txt(tree):
     edgematrix=[row,col]
     return x_text, edgematrix, root_text, rootindex
 
-def build_graph(args):
+def read_trees(args):
+	"""Stage 1, parse `data.csv` into {source id: {self_idx: node}}."""
 	treePath = "{}/{}/data.csv".format(args.data_source, args.dataset.lower())
-	savePath = "{}/{}graph".format(args.data_root, args.dataset)
-	os.makedirs(savePath, exist_ok=True)
-
 	tree_df = pd.read_csv(treePath)
 
 	print("Reading {} tree...".format(args.dataset))
@@ -150,7 +157,10 @@ def build_graph(args):
 			treeDic[eid] = {}
 		treeDic[eid][indexC] = {"parent": indexP, "max_degree": max_degree, "maxL": maxL, "vec": Vec}
 	print("tree no", len(treeDic))
+	return treeDic
 
+def read_labels(args):
+	"""Stage 2, read `data.label.txt`, returns the event ids and {event id: label}."""
 	labelPath = "{}/{}_5fold/data.label.txt".format(args.data_root, args.dataset)
 	labelset_nonR, labelset_f, labelset_t, labelset_u = ["non-rumor", "non-rumour"], ["false"], ["true"], ["unverified"]
 
@@ -177,6 +187,34 @@ def build_graph(args):
 			l4 += 1
 	print(len(labelDic))
 	print("T: {}, F: {}, U: {}, N: {}".format(l1, l2, l3, l4))
+	return event, labelDic
+
+def construct_tree(event):
+	"""Stage 3, assemble one tree with `constructMat_txt`."""
+	## Construct matrix with text content
+	x_text, tree, root_text, rootindex = constructMat_txt(event)
+	return x_text, np.array(tree), root_text, np.array(rootindex)
+
+def save_tree(savePath, id, x_text, tree, root_text, rootindex, y):
+	"""Stage 4, write one tree to `{savePath}/{id}.npz`."""
+	## Features to be added
+	## - edgematrix (v)
+	## - root (v)
+	## - y (v)
+	## - rootindex (v)
+	## - nodecontent (v) - should contain content of responses only, not including root
+	## - topindex
+	## - triIndex
+
+	#np.savez("{}/{}.npz".format(savePath, id), x=x_x, root=rootfeat, edgeindex=tree, rootindex=rootindex, y=y)
+	np.savez("{}/{}.npz".format(savePath, id), nodecontent=x_text[1:], root=[root_text], edgematrix=tree, rootindex=rootindex, y=np.array(y))
+
+def build_graph(args):
+	savePath = "{}/{}graph".format(args.data_root, args.dataset)
+	os.makedirs(savePath, exist_ok=True)
+
+	treeDic = read_trees(args)
+	event, labelDic = read_labels(args)
 
 	def loadEid(event, id, y):
 		if event is None:
@@ -187,22 +225,7 @@ def build_graph(args):
 		#x_word, x_index, tree, rootfeat, rootindex = constructMat(event)
 		#x_x = getfeature(x_word, x_index)
 		#rootfeat, tree, x_x, rootindex, y = np.array(rootfeat), np.array(tree), np.array(x_x), np.array(rootindex), np.array(y)
-
-		## Construct matrix with text content
-		x_text, tree, root_text, rootindex = constructMat_txt(event)
-		tree, rootindex, y = np.array(tree), np.array(rootindex), np.array(y)
-		
-		## Features to be added
-		## - edgematrix (v)
-		## - root (v)
-		## - y (v)
-		## - rootindex (v)
-		## - nodecontent (v) - should contain content of responses only, not including root
-		## - topindex
-		## - triIndex
-
-		#np.savez("{}/{}.npz".format(savePath, id), x=x_x, root=rootfeat, edgeindex=tree, rootindex=rootindex, y=y)
-		np.savez("{}/{}.npz".format(savePath, id), nodecontent=x_text[1:], root=[root_text], edgematrix=tree, rootindex=rootindex, y=y)
+		save_tree(savePath, id, *construct_tree(event), y)
 		return None
 
 	print("Loading dataset...")
@@ -211,6 +234,73 @@ def build_graph(args):
 
 	return
 
+def benchmark_build_graph(args):
+	"""
+	Time the stages of `build_graph` one after another (tree building & writing
+	sequentially, event by event), or only `--stage` with its inputs prepared 
+	untimed. Reports seconds and events/sec per stage and the per-event time of 
+	`construct` & `save` by number of nodes.
+	"""
+	stages = ["parse", "labels", "construct", "save"] if args.stage == "all" else [args.stage]
+	savePath = args.bench_dir or "{}/{}graph".format(args.data_root, args.dataset)
+	os.makedirs(savePath, exist_ok=True)
+	timings, per_event = {}, []
+
+	start = time.perf_counter()
+	treeDic = read_trees(args)
+	timings["parse"] = time.perf_counter() - start
+
+	start = time.perf_counter()
+	event, labelDic = read_labels(args)
+	timings["labels"] = time.perf_counter() - start
+
+	event = [eid for eid in event if eid in treeDic]
+	if args.max_events > 0:
+		event = event[:args.max_events]
+
+	built, timings["construct"], timings["save"] = {}, 0.0, 0.0
+	if "construct" in stages or "save" in stages:
+		for eid in tqdm(event):
+			start = time.perf_counter()
+			built[eid] = construct_tree(treeDic[eid])
+			construct_time = time.perf_counter() - start
+			timings["construct"] += construct_time
+			per_event.append({"event": eid, "nodes": len(treeDic[eid]), "construct": construct_time, "save": None})
+	if "save" in stages:
+		for record in tqdm(per_event):
+			start = time.perf_counter()
+			save_tree(savePath, record["event"], *built[record["event"]], labelDic[record["event"]])
+			record["save"] = time.perf_counter() - start
+			timings["save"] += record["save"]
+
+	n_events = len(event)
+	summary = {"dataset": args.dataset, "events": n_events, "stages": {}}
+	print("\n{:10s} {:>10s} {:>12s}".format("stage", "time (s)", "events/sec"))
+	for stage in stages:
+		summary["stages"][stage] = {"seconds": timings[stage], "events_per_sec": n_events / timings[stage] if timings[stage] > 0 else None}
+		print("{:10s} {:10.3f} {:12.1f}".format(stage, timings[stage], n_events / timings[stage] if timings[stage] > 0 else float("nan")))
+
+	## Per-event time by number of nodes, in power-of-2 buckets
+	buckets = {}
+	for record in per_event:
+		bucket = 1 << max(0, int(record["nodes"]) - 1).bit_length()
+		buckets.setdefault(bucket, []).append(record)
+	summary["by_nodes"] = []
+	if buckets:
+		print("\n{:>10s} {:>8s} {:>16s} {:>12s}".format("nodes <=", "events", "construct (ms)", "save (ms)"))
+	for bucket in sorted(buckets):
+		records = buckets[bucket]
+		construct_ms = 1000 * np.mean([record["construct"] for record in records])
+		save_ms = 1000 * np.mean([record["save"] for record in records]) if records[0]["save"] is not None else None
+		summary["by_nodes"].append({"max_nodes": bucket, "events": len(records), "construct_ms": construct_ms, "save_ms": save_ms})
+		print("{:10d} {:8d} {:16.3f} {:>12s}".format(bucket, len(records), construct_ms, "{:.3f}".format(save_ms) if save_ms is not None else "-"))
+
+	if args.bench_output is not None:
+		os.makedirs(os.path.dirname(os.path.abspath(args.bench_output)), exist_ok=True)
+		with open(args.bench_output, "w") as fw:
+			json.dump({"summary": summary, "events": per_event}, fw, indent=2)
+		print("Results written to {}".format(args.bench_output))
+
 def split_5_fold(args):
 	print("Splitting 5 fold for {}".format(args.dataset))
 
@@ -242,6 +332,7 @@ def make_label(args):
 
 	path_i = "{}/{}/data.csv".format(args.data_source, args.dataset.lower())
 	path_o = "{}/{}_5fold/data.label.txt".format(args.data_root, args.dataset)
+	os.makedirs(os.path.dirname(path_o), exist_ok=True)
 
 	data_df = pd.read_csv(path_i)
 
@@ -253,7 +344,9 @@ def make_label(args):
 if __name__ == "__main__":
 	args = parse_args()
 
-	if args.split_5_fold:
+	if args.benchmark:
+		benchmark_build_graph(args)
+	elif args.split_5_fold:
 		split_5_fold(args)
 	elif args.build_graph:
 		build_graph(args)
@@ -0,0 +1,77 @@
+"""
+Operator-level profiling of a window of training steps (`train.py --profile_steps start:end`).
+
+Steps `start` to `end - 1` (counted from the first step of the run) are
+recorded with `torch.profiler`: CPU (and CUDA) ops with input shapes,
+memory allocations and Python stacks. The window is written as a Chrome
+trace (open in chrome://tracing or https://ui.perfetto.dev) plus top-k
+operator tables, then training goes on without the profiler.
+"""
+import os
+
+import torch
+from torch.profiler import profile, ProfilerActivity
+
+def parse_steps(spec):
+	"""'10:20' -> (10, 20)"""
+	start, end = (int(value) for value in spec.split(":"))
+	if start < 0 or end <= start:
+		raise ValueError("--profile_steps expects start:end with 0 <= start < end, got {}".format(spec))
+	return start, end
+
+class StepProfiler:
+	def __init__(self, spec, output_prefix, topk=30):
+		self.start, self.end = parse_steps(spec)
+		self.output_prefix = output_prefix
+		self.topk = topk
+		self.steps = 0
+		self.profiler = None
+		self.done = False
+		self._maybe_start()
+
+	def _maybe_start(self):
+		if self.done or self.profiler is not None or self.steps != self.start:
+			return
+		activities = [ProfilerActivity.CPU]
+		if torch.cuda.is_available():
+			activities.append(ProfilerActivity.CUDA)
+		print("Profiling steps {} to {}...".format(self.start, self.end - 1))
+		self.profiler = profile(activities=activities, record_shapes=True, profile_memory=True, with_stack=True)
+		self.profiler.start()
+
+	def step(self):
+		"""Call once after every training step."""
+		self.steps += 1
+		if self.profiler is None:
+			self._maybe_start()
+		elif self.steps >= self.end:
+			self.finish()
+
+	def finish(self):
+		"""Stop profiling (if still running) and write the trace and operator tables."""
+		if self.profiler is None:
+			return
+		profiler, self.profiler, self.done = self.profiler, None, True
+		profiler.stop()
+
+		os.makedirs(os.path.dirname(os.path.abspath(self.output_prefix)), exist_ok=True)
+		trace_path = self.output_prefix + "_trace.json"
+		profiler.export_chrome_trace(trace_path)
+
+		sort_by = "self_cuda_time_total" if torch.cuda.is_available() else "self_cpu_time_total"
+		tables = [
+			("Top {} operators by self time".format(self.topk),
+				profiler.key_averages().table(sort_by=sort_by, row_limit=self.topk)),
+			("Top {} operators by input shape".format(self.topk),
+				profiler.key_averages(group_by_input_shape=True).table(sort_by=sort_by, row_limit=self.topk)),
+			("Top {} operators by call stack".format(self.topk),
+				profiler.key_averages(group_by_stack_n=5).table(sort_by=sort_by, row_limit=self.topk)),
+			("Top {} operators by allocated memory".format(self.topk),
+				profiler.key_averages().table(sort_by="self_cpu_memory_usage", row_limit=self.topk)),
+		]
+		table_path = self.output_prefix + "_ops.txt"
+		with open(table_path, "w") as fw:
+			for title, table in tables:
+				fw.write("## {}\n{}\n\n".format(title, table))
+		print(tables[0][1])
+		print("Profile of steps {} to {} written to {} and {}".format(self.start, self.steps - 1, trace_path, table_path))
@@ -0,0 +1,129 @@
+"""
+Post-training dynamic int8 quantization for CPU inference.
+
+	python quantize.py --checkpoint ./result/ckpt/twitter15_fold0_CCCTNet/best.pt --output ./result/ckpt/twitter15_fold0_CCCTNet/best_int8.pt
+	python predict.py --checkpoint ./result/ckpt/twitter15_fold0_CCCTNet/best_int8.pt --input new/data.csv --output scores.jsonl
+
+The `nn.Linear` layers of the BERT encoders (and of `fc1` / `fc2` with
+`--quantize_head`) get int8 weights, their activations are quantized on the
+fly. The GAT layers and the second-tier transformer stay in fp32: the latter
+is small next to the encoders, and the fast path of `nn.TransformerEncoderLayer`
+reads its Linear weights as tensors, which quantized Linear layers do not have.
+
+The quantized checkpoint is loaded by `evaluate.load_checkpoint` like any
+other, so `evaluate.py`, `predict.py`, `server.py` and `export.py` take it
+as is (or quantize an fp32 checkpoint on the fly with `--quantize int8`).
+This script also evaluates both models on the test split of the checkpoint's
+fold and reports macro-F1 and CPU throughput of each.
+"""
+import io
+import os
+import json
+import time
+import argparse
+
+import torch
+import torch.nn as nn
+try:
+	import torch.ao.nn.quantized.dynamic as nnqd
+	from torch.ao.quantization import default_dynamic_qconfig, convert
+except ImportError: ## PyTorch < 1.13 (the pinned 1.9 / 1.11)
+	import torch.nn.quantized.dynamic as nnqd
+	from torch.quantization import default_dynamic_qconfig, convert
+
+QCONFIGS = {"int8": default_dynamic_qconfig}
+
+## Submodules whose Linear layers are quantized
+ENCODERS = ["bert_seq.bert", "gnn.bert"]
+HEAD = ["fc1", "fc2"]
+
+def parse_args():
+	parser = argparse.ArgumentParser(description="Dynamic int8 quantization of a DUCK checkpoint")
+	parser.add_argument("--checkpoint", type=str, required=True, help="best.pt or last.pt written by train.py")
+	parser.add_argument("--output", type=str, default=None, help="quantized checkpoint, default: {checkpoint}_int8.pt")
+	parser.add_argument("--quantize_head", action="store_true", help="also quantize fc1 / fc2")
+	parser.add_argument("--baseDirectory", type=str, default=None, help="the data directory, default: the one used for training")
+	parser.add_argument("--eval_batch_tokens", type=int, default=None, help="token budget of an evaluation batch, 0 to use --batchsize")
+	parser.add_argument("--num_workers", type=int, default=None)
+	parser.add_argument("--intra_op_threads", type=int, default=0, help="torch intra-op threads, 0 to keep the default")
+	parser.add_argument("--no_report", dest="report", action="store_false", help="only write the quantized checkpoint")
+	return parser.parse_args()
+
+def quantize_model(model, dtype="int8", include_head=False):
+	"""Quantize the encoders' (and optionally the classifier's) Linear layers of `model` in place, on CPU."""
+	if dtype not in QCONFIGS:
+		raise ValueError("Unsupported quantization {}, choose from {}".format(dtype, list(QCONFIGS)))
+	model.cpu()
+	targets = ENCODERS + (HEAD if include_head else [])
+	modules = dict(model.named_modules())
+	for name in targets:
+		if name not in modules:
+			continue
+		for module in modules[name].modules():
+			if type(module) is nn.Linear:
+				module.qconfig = QCONFIGS[dtype]
+	convert(model, mapping={nn.Linear: nnqd.Linear}, inplace=True)
+	model.quantized = {"dtype": dtype, "head": include_head}
+	return model
+
+def model_size_mb(model):
+	"""Size of the serialized state dict."""
+	buffer = io.BytesIO()
+	torch.save(model.state_dict(), buffer)
+	return buffer.tell() / 2 ** 20
+
+def benchmark(model, loader, device, n_classes):
+	from evaluate import Evaluator
+	start = time.perf_counter()
+	val_loss, metrics = Evaluator(loader, device)(model)
+	elapsed = time.perf_counter() - start
+	F = metrics[4::4] ## per-class F1, as in `format_metrics`
+	return {
+		"val_loss": val_loss,
+		"acc": float(metrics[0]),
+		"macro_f1": float(sum(F) / n_classes),
+		"trees_per_sec": len(loader.dataset) / elapsed,
+		"size_mb": model_size_mb(model),
+	}
+
+def main():
+	cli = parse_args()
+	from evaluate import load_checkpoint, build_eval_loader
+
+	if cli.intra_op_threads > 0:
+		torch.set_num_threads(cli.intra_op_threads)
+	output = cli.output or "{}_int8.pt".format(os.path.splitext(cli.checkpoint)[0])
+	overrides = {"baseDirectory": cli.baseDirectory, "eval_batch_tokens": cli.eval_batch_tokens, "num_workers": cli.num_workers}
+	device = torch.device("cpu")
+
+	duck, model = load_checkpoint(cli.checkpoint, device, **overrides)
+	qduck, qmodel = load_checkpoint(cli.checkpoint, device, quantize="int8", quantize_head=cli.quantize_head, **overrides)
+	torch.save({"model": qmodel.state_dict(), "args": vars(qduck.args), "quantize": qmodel.quantized}, output)
+	print("Quantized checkpoint written to {}".format(output))
+	if not cli.report:
+		return
+
+	args = duck.args
+	duck.x_train, duck.x_test = duck.loadfolddatawithKnownFold()
+	_, testdata_list = duck.loadData()
+	loader = build_eval_loader(testdata_list, args.batchsize, args.eval_batch_tokens, num_workers=args.num_workers)
+
+	report = {"checkpoint": cli.checkpoint, "quantized": output, "quantize_head": cli.quantize_head, "threads": torch.get_num_threads()}
+	report["fp32"] = benchmark(model, loader, device, args.n_classes)
+	report["int8"] = benchmark(qmodel, loader, device, args.n_classes)
+	report["speedup"] = report["int8"]["trees_per_sec"] / report["fp32"]["trees_per_sec"]
+	report["macro_f1_change"] = report["int8"]["macro_f1"] - report["fp32"]["macro_f1"]
+
+	print("\n{:6s} {:>8s} {:>9s} {:>11s} {:>10s}".format("", "acc", "macro-F1", "trees/sec", "size (MB)"))
+	for name in ["fp32", "int8"]:
+		result = report[name]
+		print("{:6s} {:8.4f} {:9.4f} {:11.1f} {:10.1f}".format(name, result["acc"], result["macro_f1"], result["trees_per_sec"], result["size_mb"]))
+	print("speedup {:.2f}x, macro-F1 change {:+.4f}".format(report["speedup"], report["macro_f1_change"]))
+
+	report_path = os.path.splitext(output)[0] + "_report.json"
+	with open(report_path, "w") as fw:
+		json.dump(report, fw, indent=2)
+	print("Report written to {}".format(report_path))
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,268 @@
+"""
+Micro-batching inference server.
+
+	python server.py --checkpoint ./result/ckpt/twitter15_fold0_CCCTNet/best.pt --port 8080
+	python server.py --checkpoint ... --unix_socket /tmp/duck.sock
+
+	curl -s localhost:8080/score -d '{"event_id": "1", "posts": [{"self_idx": 1, "parent_idx": null, "text": "..."}, ...]}'
+	curl -s localhost:8080/health
+
+Each request carries one thread (`posts` in the `data.csv` schema of
+`preprocess.py`). Threads are tokenized in a thread pool and queued; a
+single batching task takes threads from the queue until the batch reaches
+`--batch_tokens` tokens or `--batch_trees` trees, or `--max_wait_ms` has
+passed since its first thread, runs one forward pass and answers every
+request of the batch. When `--max_queue` threads are already waiting, new
+requests are rejected with 503 and a `Retry-After` header rather than
+queued, which keeps the latency of accepted requests bounded.
+
+Plain HTTP/1.1 on asyncio streams, only the standard library is needed on
+top of the model's dependencies.
+"""
+import json
+import time
+import asyncio
+import argparse
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import torch
+from torch_geometric.data import Batch
+
+from utils import MAX_LEN, MAX_LEN_SEQ
+from dataset import make_comment_tree
+from evaluate import load_checkpoint
+from compiler import compile_model
+from cpu_utils import add_cpu_args, configure_threads
+from predict import LABELS, tree_from_rows
+
+def parse_args():
+	parser = argparse.ArgumentParser(description="Micro-batching HTTP server for a trained DUCK checkpoint")
+	parser.add_argument("--checkpoint", type=str, required=True, help="best.pt or last.pt written by train.py")
+	parser.add_argument("--host", type=str, default="127.0.0.1")
+	parser.add_argument("--port", type=int, default=8080)
+	parser.add_argument("--unix_socket", type=str, default=None, help="listen on this Unix socket instead of --host/--port")
+	parser.add_argument("--max_tree_len", type=int, default=None, help="responses kept per tree, default: the training value")
+	parser.add_argument("--compile", action="store_true", help="torch.compile the model, see compiler.py")
+	parser.add_argument("--compile_cache", type=str, default="./result/compile_cache", help="directory of compiled artifacts reused across runs")
+	parser.add_argument("--quantize", type=str, default=None, choices=["int8"], help="dynamic quantization of the encoders for CPU inference")
+	parser.add_argument("--quantize_head", action="store_true", help="with --quantize, also quantize fc1 / fc2")
+
+	#Batching
+	parser.add_argument("--batch_tokens", type=int, default=8192, help="token budget of a batch")
+	parser.add_argument("--batch_trees", type=int, default=64, help="maximum trees per batch")
+	parser.add_argument("--max_wait_ms", type=float, default=10, help="longest time a batch waits for more threads")
+	parser.add_argument("--max_queue", type=int, default=256, help="threads waiting for a batch before requests are rejected")
+	parser.add_argument("--tokenize_workers", type=int, default=2, help="threads tokenizing incoming requests")
+
+	#CPU
+	add_cpu_args(parser)
+	return parser.parse_args()
+
+class Overloaded(Exception):
+	pass
+
+class MicroBatcher:
+	"""Queue of (tree, future) served in batches by `run`, one forward pass at a time."""
+	def __init__(self, model, device, batch_tokens, batch_trees, max_wait_ms, max_queue):
+		self.model = model
+		self.device = device
+		self.batch_tokens = batch_tokens
+		self.batch_trees = batch_trees
+		self.max_wait = max_wait_ms / 1000
+		self.queue = asyncio.Queue(maxsize=max_queue)
+		self.pending = None ## item taken from the queue that did not fit the previous batch
+		self.executor = ThreadPoolExecutor(max_workers=1) ## forward passes, off the event loop
+		self.n_batches, self.n_trees = 0, 0
+		self.latencies = deque(maxlen=10000)
+
+	def submit(self, graph):
+		"""Queue `graph` and return a future of its class probabilities, raises `Overloaded` when the queue is full."""
+		future = asyncio.get_running_loop().create_future()
+		try:
+			self.queue.put_nowait((graph, future, time.perf_counter()))
+		except asyncio.QueueFull:
+			raise Overloaded()
+		return future
+
+	@staticmethod
+	def tokens(graph):
+		return graph.num_nodes * MAX_LEN + MAX_LEN_SEQ
+
+	async def next_batch(self):
+		item = self.pending if self.pending is not None else await self.queue.get()
+		self.pending = None
+		batch, batch_tokens = [item], self.tokens(item[0])
+		deadline = time.perf_counter() + self.max_wait
+		while len(batch) < self.batch_trees:
+			timeout = deadline - time.perf_counter()
+			if timeout <= 0:
+				break
+			try:
+				item = await asyncio.wait_for(self.queue.get(), timeout)
+			except asyncio.TimeoutError:
+				break
+			if batch_tokens + self.tokens(item[0]) > self.batch_tokens:
+				self.pending = item
+				break
+			batch.append(item)
+			batch_tokens += self.tokens(item[0])
+		return batch
+
+	def forward(self, graphs):
+		with torch.inference_mode():
+			batch = Batch.from_data_list(graphs).to(self.device)
+			return self.model(batch).exp().cpu().numpy() ## log-probabilities -> probabilities
+
+	async def run(self):
+		loop = asyncio.get_running_loop()
+		while True:
+			batch = await self.next_batch()
+			batch = [(graph, future, start) for graph, future, start in batch if not future.cancelled()]
+			if not batch:
+				continue
+			try:
+				probs = await loop.run_in_executor(self.executor, self.forward, [graph for graph, _, _ in batch])
+			except Exception as e:
+				for _, future, _ in batch:
+					if not future.done():
+						future.set_exception(e)
+				continue
+			now = time.perf_counter()
+			for (_, future, start), prob in zip(batch, probs):
+				if not future.done():
+					future.set_result(prob)
+				self.latencies.append(now - start)
+			self.n_batches += 1
+			self.n_trees += len(batch)
+
+	def stats(self):
+		latencies = np.array(self.latencies) * 1000
+		return {
+			"queued": self.queue.qsize() + (self.pending is not None),
+			"max_queue": self.queue.maxsize,
+			"batches": self.n_batches,
+			"trees": self.n_trees,
+			"mean_batch_trees": self.n_trees / max(self.n_batches, 1),
+			"latency_p50_ms": float(np.percentile(latencies, 50)) if len(latencies) else None,
+			"latency_p99_ms": float(np.percentile(latencies, 99)) if len(latencies) else None,
+		}
+
+class Server:
+	def __init__(self, batcher, max_tree_len, bert_version, tokenize_workers):
+		self.batcher = batcher
+		self.max_tree_len = max_tree_len
+		self.bert_version = bert_version
+		self.tokenizer_pool = ThreadPoolExecutor(max_workers=tokenize_workers)
+		self.started = time.time()
+
+	def make_tree(self, request):
+		rows = [{
+			"self_idx": str(post["self_idx"]),
+			"parent_idx": str(post.get("parent_idx")),
+			"text": post["text"],
+		} for post in request["posts"]]
+		root, nodecontent, edgematrix, rootindex = tree_from_rows(rows)
+		return make_comment_tree(root, nodecontent, edgematrix, -1, rootindex, self.max_tree_len, self.bert_version, event_id=request.get("event_id"))
+
+	async def score(self, body):
+		try:
+			request = json.loads(body)
+			if not request.get("posts"):
+				raise ValueError("`posts` is empty")
+		except (ValueError, TypeError, AttributeError) as e:
+			return 400, {"error": "bad request: {}".format(e)}
+		if self.batcher.queue.full():
+			raise Overloaded()
+		try:
+			graph = await asyncio.get_running_loop().run_in_executor(self.tokenizer_pool, self.make_tree, request)
+		except (KeyError, ValueError, TypeError) as e:
+			return 400, {"error": "bad thread: {}".format(e)}
+		prob = await self.batcher.submit(graph)
+		return 200, {
+			"event_id": request.get("event_id"),
+			"pred": LABELS[int(prob.argmax())],
+			"probs": {LABELS[k]: round(float(p), 6) for k, p in enumerate(prob)},
+		}
+
+	async def route(self, method, path, body):
+		if path == "/health" and method == "GET":
+			stats = self.batcher.stats()
+			stats.update({"status": "ok", "uptime_sec": time.time() - self.started})
+			return 200, stats
+		if path == "/score" and method == "POST":
+			try:
+				return await self.score(body)
+			except Overloaded:
+				return 503, {"error": "overloaded, retry later"}
+		return 404, {"error": "not found"}
+
+	async def handle(self, reader, writer):
+		"""HTTP/1.1 with keep-alive, one request at a time per connection."""
+		try:
+			while True:
+				request_line = await reader.readline()
+				if not request_line:
+					break
+				method, path, _ = request_line.decode("latin-1").split(" ", 2)
+				headers = {}
+				while True:
+					line = await reader.readline()
+					if line in (b"\r\n", b"\n", b""):
+						break
+					key, _, value = line.decode("latin-1").partition(":")
+					headers[key.strip().lower()] = value.strip()
+				body = await reader.readexactly(int(headers.get("content-length", 0)))
+
+				try:
+					status, payload = await self.route(method, path.split("?")[0], body)
+				except Exception as e: ## model or tokenizer failure, the client still gets an answer
+					status, payload = 500, {"error": "internal error: {}".format(e)}
+				data = json.dumps(payload).encode()
+				reason = {200: "OK", 400: "Bad Request", 404: "Not Found", 500: "Internal Server Error", 503: "Service Unavailable"}[status]
+				head = "HTTP/1.1 {} {}\r\nContent-Type: application/json\r\nContent-Length: {}\r\n".format(status, reason, len(data))
+				if status == 503:
+					head += "Retry-After: 1\r\n"
+				close = headers.get("connection", "").lower() == "close"
+				if close:
+					head += "Connection: close\r\n"
+				writer.write(head.encode() + b"\r\n" + data)
+				await writer.drain()
+				if close:
+					break
+		except (ValueError, asyncio.IncompleteReadError, ConnectionError):
+			pass
+		finally:
+			writer.close()
+
+async def serve(cli):
+	device = torch.device("cuda:0" if torch.cuda.is_available() else "cpu")
+	configure_threads(cli, local_rank=0, local_world_size=1) ## --intra_op_threads for the forward pass, --pin_cores
+	duck, model = load_checkpoint(cli.checkpoint, device, cli.quantize, cli.quantize_head, max_tree_len=cli.max_tree_len)
+	args, device = duck.args, duck.device
+	if cli.compile:
+		compile_model(model, cache_dir=cli.compile_cache)
+
+	batcher = MicroBatcher(model, device, cli.batch_tokens, cli.batch_trees, cli.max_wait_ms, cli.max_queue)
+	server = Server(batcher, args.max_tree_len, args.bertVersion, cli.tokenize_workers)
+	if cli.unix_socket is not None:
+		listener = await asyncio.start_unix_server(server.handle, path=cli.unix_socket)
+		print("Serving {} on {}".format(args.modelName, cli.unix_socket))
+	else:
+		listener = await asyncio.start_server(server.handle, cli.host, cli.port)
+		print("Serving {} on http://{}:{}".format(args.modelName, cli.host, cli.port))
+
+	worker = asyncio.ensure_future(batcher.run())
+	async with listener:
+		await asyncio.gather(listener.serve_forever(), worker)
+
+def main():
+	cli = parse_args()
+	try:
+		asyncio.run(serve(cli))
+	except KeyboardInterrupt:
+		pass
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,288 @@
+"""
+Single-file model snapshots, memory-mapped on load.
+
+	python snapshot.py --checkpoint ./result/ckpt/twitter15_fold0_CCCTNet/best.pt --output ./result/ccct.snap
+	python snapshot.py --modelName CCCTNet --bertVersion bert-base-uncased --output ./result/ccct_init.snap
+	python predict.py --checkpoint ./result/ccct.snap --input new/data.csv --output scores.jsonl
+	python train.py ... --modelName CCCTNet --snapshot ./result/ccct_init.snap
+
+A snapshot holds the training arguments, the encoder config and tokenizer
+files, and every parameter & buffer of the model (`--checkpoint` weights, or
+a freshly built model with its pretrained encoders) as raw, aligned arrays:
+
+	b"DUCKSNAP" | header length (uint64) | JSON header | tensor data
+
+Loading builds the model on the meta device (no weights are read or
+initialised) and points its parameters at a copy-on-write memory map of the
+file: start-up costs a few page faults instead of reading and copying the
+weights, and every process serving the same snapshot shares its pages
+through the page cache until it writes to them. The tokenizer and config
+files are written once to `{snapshot}.assets-{id}`, which becomes `--bertVersion`.
+
+`--compare N` starts N processes loading the checkpoint, then N loading the
+snapshot, and reports their start-up time and their aggregate RSS & PSS
+(proportional set size, which splits shared pages between processes).
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import shutil
+import struct
+import argparse
+import tempfile
+import subprocess
+
+import numpy as np
+import torch
+import torch.nn as nn
+
+MAGIC = b"DUCKSNAP"
+FORMAT_VERSION = 1
+ALIGN = 64
+
+DTYPES = {
+	torch.float32: "float32", torch.float16: "float16", torch.float64: "float64",
+	torch.int64: "int64", torch.int32: "int32", torch.uint8: "uint8", torch.bool: "bool",
+}
+
+def parse_args():
+	parser = argparse.ArgumentParser(description="Write or benchmark memory-mapped DUCK snapshots")
+	parser.add_argument("--output", type=str, default=None, help="snapshot file to write")
+	parser.add_argument("--checkpoint", type=str, default=None, help="best.pt / last.pt to snapshot")
+	parser.add_argument("--modelName", type=str, default=None, help="without --checkpoint: snapshot a freshly built model")
+	parser.add_argument("--bertVersion", type=str, default="bert-base-uncased", help="without --checkpoint: encoder of the fresh model")
+	parser.add_argument("--n_classes", type=int, default=4, help="without --checkpoint: classes of the fresh model")
+	parser.add_argument("--seed", type=int, default=42, help="without --checkpoint: seed of the fresh model's non-pretrained layers")
+	parser.add_argument("--compare", type=int, default=0, help="start N processes per format and compare start-up time & memory (needs --checkpoint)")
+	parser.add_argument("--child", type=str, default=None, help=argparse.SUPPRESS) ## model file loaded by a --compare process
+	return parser.parse_args()
+
+def is_snapshot(path):
+	try:
+		with open(path, "rb") as f:
+			return f.read(len(MAGIC)) == MAGIC
+	except OSError:
+		return False
+
+def read_header(path):
+	"""(header, offset of the tensor data) of a snapshot."""
+	with open(path, "rb") as f:
+		if f.read(len(MAGIC)) != MAGIC:
+			raise ValueError("{} is not a DUCK snapshot".format(path))
+		(length,) = struct.unpack("<Q", f.read(8))
+		header = json.loads(f.read(length).decode("utf-8"))
+	if header["format"] != FORMAT_VERSION:
+		raise ValueError("Unsupported snapshot format {} in {}".format(header["format"], path))
+	data_start = len(MAGIC) + 8 + length
+	return header, data_start + (-data_start) % ALIGN
+
+def bert_assets(bert_version):
+	"""Encoder config & tokenizer files of `bert_version`, as {file name: content}."""
+	from utils import get_tokenizer, get_bert_config
+	assets = {}
+	with tempfile.TemporaryDirectory() as tmp:
+		get_bert_config(bert_version).save_pretrained(tmp)
+		get_tokenizer(bert_version).save_pretrained(tmp)
+		for name in sorted(os.listdir(tmp)):
+			with open(os.path.join(tmp, name), encoding="utf-8") as f:
+				assets[name] = f.read()
+	return assets
+
+def write_snapshot(path, model, args):
+	"""Write `model` with its training arguments `args` (dict) and the files of `args["bertVersion"]` to `path`."""
+	if getattr(model, "quantized", None):
+		raise ValueError("Quantized models cannot be snapshotted, snapshot the fp32 checkpoint")
+	tensors = [(name, tensor) for name, tensor in model.named_parameters()] + [(name, tensor) for name, tensor in model.named_buffers()]
+	index, offset = {}, 0
+	for name, tensor in tensors:
+		if tensor.dtype not in DTYPES:
+			raise ValueError("Cannot snapshot {} of dtype {}".format(name, tensor.dtype))
+		offset += (-offset) % ALIGN
+		nbytes = tensor.numel() * tensor.element_size()
+		index[name] = {"dtype": DTYPES[tensor.dtype], "shape": list(tensor.shape), "offset": offset, "nbytes": nbytes}
+		offset += nbytes
+
+	header = json.dumps({
+		"format": FORMAT_VERSION,
+		"id": uuid.uuid4().hex,
+		"created": time.time(),
+		"args": args,
+		"assets": bert_assets(args["bertVersion"]),
+		"tensors": index,
+	}).encode("utf-8")
+
+	tmp_path = path + ".tmp"
+	with open(tmp_path, "wb") as fw:
+		fw.write(MAGIC + struct.pack("<Q", len(header)) + header)
+		fw.write(b"\0" * ((-fw.tell()) % ALIGN))
+		data_start = fw.tell()
+		for name, tensor in tensors:
+			fw.seek(data_start + index[name]["offset"])
+			fw.write(tensor.detach().cpu().contiguous().numpy().tobytes())
+	os.replace(tmp_path, path)
+	return path
+
+def extract_assets(path, header=None):
+	"""
+	Write the config & tokenizer files of a snapshot to `{path}.assets-{id}` (once), returns the directory.
+	The id in the name means a directory is never replaced while another process may read it.
+	"""
+	if header is None:
+		header, _ = read_header(path)
+	parent = os.path.dirname(os.path.abspath(path))
+	if os.access(parent, os.W_OK):
+		assets_dir = "{}.assets-{}".format(path, header["id"])
+	else: ## read-only snapshot directory
+		parent = tempfile.gettempdir()
+		assets_dir = os.path.join(parent, "duck_snapshot_{}".format(header["id"]))
+	if os.path.isfile(os.path.join(assets_dir, ".snapshot_id")):
+		return assets_dir
+
+	tmp_dir = tempfile.mkdtemp(dir=parent)
+	for name, content in header["assets"].items():
+		with open(os.path.join(tmp_dir, name), "w", encoding="utf-8") as fw:
+			fw.write(content)
+	with open(os.path.join(tmp_dir, ".snapshot_id"), "w") as fw: ## written last: marks a complete directory
+		fw.write(header["id"])
+	try:
+		os.rename(tmp_dir, assets_dir)
+	except OSError: ## another process got there first, its files are the same
+		shutil.rmtree(tmp_dir, ignore_errors=True)
+	return assets_dir
+
+def map_tensors(path, header=None, data_start=None):
+	"""{name: tensor} backed by a copy-on-write memory map of the snapshot."""
+	if header is None:
+		header, data_start = read_header(path)
+	data = np.memmap(path, dtype=np.uint8, mode="c", offset=data_start)
+	tensors = {}
+	for name, entry in header["tensors"].items():
+		array = data[entry["offset"]:entry["offset"] + entry["nbytes"]].view(entry["dtype"]).reshape(entry["shape"])
+		tensors[name] = torch.from_numpy(np.asarray(array))
+	return tensors
+
+def assign_tensors(model, tensors):
+	"""Point the parameters & buffers of `model` (built on the meta device) at `tensors`, without copying."""
+	for name, tensor in tensors.items():
+		module_name, _, attr = name.rpartition(".")
+		module = model.get_submodule(module_name)
+		current = module._parameters.get(attr, module._buffers.get(attr))
+		if current is not None and (current.shape != tensor.shape or current.dtype != tensor.dtype):
+			raise ValueError("{} is {} {} in the snapshot but {} {} in the model (different arguments, e.g. --n_classes?)".format(
+				name, tuple(tensor.shape), tensor.dtype, tuple(current.shape), current.dtype))
+		if attr in module._parameters:
+			module._parameters[attr] = nn.Parameter(tensor, requires_grad=module._parameters[attr].requires_grad)
+		elif attr in module._buffers:
+			module._buffers[attr] = tensor
+		else:
+			raise KeyError("{} of the snapshot is not in the model".format(name))
+	missing = [name for name, tensor in list(model.named_parameters()) + list(model.named_buffers()) if tensor.is_meta]
+	if missing:
+		raise ValueError("Tensors missing from the snapshot: {}".format(", ".join(missing)))
+	return model
+
+def build_from_snapshot(duck, path):
+	"""The `duck.modelName` model with the weights of snapshot `path`, memory-mapped (on CPU)."""
+	header, data_start = read_header(path)
+	if header["args"]["modelName"] != duck.modelName:
+		raise ValueError("Snapshot {} holds a {} model, not {}".format(path, header["args"]["modelName"], duck.modelName))
+	with torch.device("meta"):
+		model = duck.init_model(pretrained=False)
+	return assign_tensors(model, map_tensors(path, header, data_start))
+
+def load_snapshot(path, device, quantize=None, quantize_head=False, **overrides):
+	"""Same as `evaluate.load_checkpoint` for a snapshot."""
+	from train import DUCK
+	from options import get_parser
+
+	header, _ = read_header(path)
+	config = vars(get_parser().parse_args(["--datasetName", "", "--modelName", ""]))
+	config.update(header["args"])
+	for key, value in overrides.items():
+		if key in config and value is not None:
+			config[key] = value
+	config["bertVersion"] = extract_assets(path, header)
+	config["snapshot"] = None ## the weights are the snapshot's
+	duck = DUCK(argparse.Namespace(**config))
+
+	model = build_from_snapshot(duck, path)
+	if quantize is not None:
+		from quantize import quantize_model
+		model = quantize_model(model, quantize, quantize_head)
+		device = torch.device("cpu") ## quantized kernels run on CPU only
+	model.to(device)
+	model.eval()
+	duck.device = device
+	return duck, model
+
+def proc_memory(pid):
+	"""(RSS, PSS) of process `pid` in bytes, from /proc (Linux); (None, None) elsewhere."""
+	rss, pss = None, None
+	try:
+		with open("/proc/{}/smaps_rollup".format(pid)) as f:
+			for line in f:
+				if line.startswith("Rss:"):
+					rss = int(line.split()[1]) * 1024
+				elif line.startswith("Pss:"):
+					pss = int(line.split()[1]) * 1024
+	except OSError:
+		pass
+	return rss, pss
+
+def compare(checkpoint, snapshot, n_procs):
+	"""Start `n_procs` processes loading each file at once, report start-up time & aggregate memory."""
+	print("\n{:10s} {:>6s} {:>13s} {:>13s} {:>13s}".format("format", "procs", "startup (s)", "sum RSS (MB)", "sum PSS (MB)"))
+	for name, path in (("checkpoint", checkpoint), ("snapshot", snapshot)):
+		start = time.perf_counter()
+		procs = [subprocess.Popen([sys.executable, __file__, "--child", path], stdin=subprocess.PIPE, stdout=subprocess.PIPE) for _ in range(n_procs)]
+		startup = []
+		for proc in procs:
+			proc.stdout.readline() ## "ready" once the model is loaded
+			startup.append(time.perf_counter() - start)
+		memory = [proc_memory(proc.pid) for proc in procs]
+		for proc in procs:
+			proc.stdin.close()
+			proc.wait()
+
+		rss = sum(m[0] for m in memory) / 2 ** 20 if all(m[0] is not None for m in memory) else float("nan")
+		pss = sum(m[1] for m in memory) / 2 ** 20 if all(m[1] is not None for m in memory) else float("nan")
+		print("{:10s} {:6d} {:13.2f} {:13.1f} {:13.1f}".format(name, n_procs, float(np.mean(startup)), rss, pss))
+
+def main():
+	cli = parse_args()
+	if cli.child is not None:
+		from evaluate import load_checkpoint
+		load_checkpoint(cli.child, torch.device("cpu"))
+		print("ready", flush=True)
+		sys.stdin.read() ## stay alive while the parent measures memory
+		return
+
+	from evaluate import load_checkpoint
+	if cli.checkpoint is not None:
+		duck, model = load_checkpoint(cli.checkpoint, torch.device("cpu"))
+	elif cli.modelName is not None:
+		from train import DUCK
+		from options import get_parser
+		args = get_parser().parse_args([
+			"--datasetName", "", "--modelName", cli.modelName, "--bertVersion", cli.bertVersion,
+			"--n_classes", str(cli.n_classes), "--seed", str(cli.seed)
+		])
+		torch.manual_seed(cli.seed)
+		duck = DUCK(args)
+		model = duck.init_model()
+	else:
+		raise ValueError("Give --checkpoint or --modelName")
+
+	output = cli.output or "{}.snap".format(os.path.splitext(cli.checkpoint or cli.modelName)[0])
+	write_snapshot(output, model, vars(duck.args))
+	print("Snapshot of {} written to {} ({:.1f} MB)".format(duck.modelName, output, os.path.getsize(output) / 2 ** 20))
+
+	if cli.compare > 0:
+		if cli.checkpoint is None:
+			raise ValueError("--compare needs --checkpoint")
+		compare(cli.checkpoint, output, cli.compare)
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,189 @@
+"""
+Run a grid of `train.py` configurations in parallel.
+
+	python sweep.py --grid scripts/grid_run.json
+
+Every run is a separate `python train.py` process; runs are scheduled onto
+slots sized from the available cores and memory, each slot pinned to its own
+cores. Configurations already present in `{result_path}/{datasetName}.txt`
+are skipped and unfinished ones resume from their last checkpoint (one
+`--ckpt_dir` per configuration), so an interrupted sweep can simply be restarted.
+"""
+import os
+import sys
+import json
+import time
+import queue
+import argparse
+import itertools
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+from cpu_utils import available_cores
+
+def parse_args():
+	parser = argparse.ArgumentParser(description="Parallel hyper-parameter sweep for DUCK")
+	parser.add_argument("--grid", type=str, required=True, help="JSON grid definition, see scripts/grid_run.json")
+	parser.add_argument("--jobs", type=int, default=0, help="concurrent runs, 0 for auto (from cores and memory)")
+	parser.add_argument("--threads_per_run", type=int, default=0, help="intra-op threads of each run, 0 for auto")
+	parser.add_argument("--mem_per_run_gb", type=float, default=6.0, help="expected peak memory of one run, caps the number of concurrent runs")
+	parser.add_argument("--no_pin", action="store_true", help="do not pin runs to disjoint cores")
+	parser.add_argument("--log_dir", type=str, default=None, help="per-run logs, default: {result_path}/logs")
+	parser.add_argument("--dry_run", action="store_true", help="only print the commands to run")
+	return parser.parse_args()
+
+def load_grid(path):
+	"""
+	Expand a grid definition into a list of `train.py` argument dicts.
+	{
+		"args": {...},                                   ## shared by all runs
+		"grid": {"learningRateGraph": [1e-4, 2e-4], ...}, ## cartesian product, in key order
+		"per_dataset": {"semeval2019": {"n_classes": 3}}  ## overrides by datasetName
+	}
+	"""
+	with open(path) as f:
+		spec = json.load(f)
+
+	base, grid, per_dataset = spec.get("args", {}), spec.get("grid", {}), spec.get("per_dataset", {})
+	keys = list(grid.keys())
+	configs = []
+	for values in itertools.product(*[grid[key] for key in keys]):
+		config = dict(base)
+		config.update(zip(keys, values))
+		config.update(per_dataset.get(config.get("datasetName"), {}))
+		configs.append(config)
+	return configs
+
+def result_key(fold, lr, glr, dropout):
+	## Same precision as `DUCK.format_result`
+	return "{:d}\t{:.0E}\t{:.0E}\t{:.4f}".format(int(fold), float(lr), float(glr), float(dropout))
+
+def completed_runs(result_file):
+	done = set()
+	if not os.path.isfile(result_file):
+		return done
+	with open(result_file) as f:
+		next(f, None) ## header
+		for line in f:
+			fields = line.split()
+			if len(fields) >= 4:
+				done.add(result_key(*fields[:4]))
+	return done
+
+def config_key(config):
+	return result_key(
+		config.get("foldnum", 0),
+		config.get("learningRate", 5e-5),
+		config.get("learningRateGraph", 1e-5),
+		config.get("dropout_gat", 0.5)
+	)
+
+def config_name(config):
+	return "{}_fold{}_lr{:.0E}_glr{:.0E}_do{}".format(
+		config.get("datasetName"), config.get("foldnum", 0),
+		float(config.get("learningRate", 5e-5)), float(config.get("learningRateGraph", 1e-5)), config.get("dropout_gat", 0.5)
+	)
+
+def to_argv(config):
+	argv = []
+	for key, value in config.items():
+		if isinstance(value, bool):
+			if value:
+				argv.append("--{}".format(key))
+		else:
+			argv.extend(["--{}".format(key), str(value)])
+	return argv
+
+def to_command(config):
+	return [sys.executable, "train.py"] + to_argv(config)
+
+def available_memory_gb():
+	try:
+		with open("/proc/meminfo") as f:
+			for line in f:
+				if line.startswith("MemAvailable:"):
+					return int(line.split()[1]) / 1024 ** 2
+	except OSError:
+		pass
+	return None
+
+def plan_slots(n_runs, jobs=0, threads_per_run=0, mem_per_run_gb=6.0):
+	"""Return one core list per concurrent slot."""
+	cores = available_cores()
+	if jobs <= 0:
+		threads = threads_per_run if threads_per_run > 0 else min(4, len(cores))
+		jobs = max(1, len(cores) // threads)
+		mem_gb = available_memory_gb()
+		if mem_gb is not None and mem_per_run_gb > 0:
+			jobs = max(1, min(jobs, int(mem_gb // mem_per_run_gb)))
+	jobs = max(1, min(jobs, n_runs))
+	threads = threads_per_run if threads_per_run > 0 else max(1, len(cores) // jobs)
+	return [cores[i * threads:(i + 1) * threads] or cores for i in range(jobs)]
+
+def main():
+	args = parse_args()
+
+	configs = load_grid(args.grid)
+	todo, done_cache = [], {}
+	for config in configs:
+		result_file = "{}/{}.txt".format(config.get("result_path", "./result"), config.get("datasetName"))
+		if result_file not in done_cache:
+			done_cache[result_file] = completed_runs(result_file)
+		if config_key(config) not in done_cache[result_file]:
+			todo.append(config)
+	print("{} runs in grid, {} already in the result files, {} to run".format(len(configs), len(configs) - len(todo), len(todo)))
+	if not todo:
+		return
+
+	slots = plan_slots(len(todo), args.jobs, args.threads_per_run, args.mem_per_run_gb)
+	print("Running on {} slots of {} core(s)".format(len(slots), len(slots[0])))
+
+	free_slots = queue.Queue()
+	for slot in slots:
+		free_slots.put(slot)
+
+	def run(config):
+		slot = free_slots.get()
+		try:
+			config = dict(config)
+			config["intra_op_threads"] = len(slot)
+			if not args.no_pin:
+				config["pin_cores"] = ",".join(str(core) for core in slot)
+			config.setdefault("resume", True) ## an interrupted run continues from its last checkpoint
+			name = config_name(config)
+			## One checkpoint directory per configuration, runs of a fold must not resume each other's state
+			config.setdefault("ckpt_dir", "{}/ckpt/{}_{}".format(config.get("result_path", "./result"), name, config.get("modelName")))
+			cmd = to_command(config)
+			if args.dry_run:
+				print(" ".join(cmd))
+				return name, 0, 0.0
+
+			log_dir = args.log_dir or "{}/logs".format(config.get("result_path", "./result"))
+			os.makedirs(log_dir, exist_ok=True)
+			start = time.time()
+			with open("{}/{}.log".format(log_dir, name), "w") as log:
+				returncode = subprocess.call(cmd, stdout=log, stderr=subprocess.STDOUT)
+			elapsed = time.time() - start
+			print("[{}] {} ({:.1f} min)".format("done" if returncode == 0 else "FAILED", name, elapsed / 60))
+			return name, returncode, elapsed
+		finally:
+			free_slots.put(slot)
+
+	start = time.time()
+	with ThreadPoolExecutor(max_workers=len(slots)) as executor:
+		outcomes = list(executor.map(run, todo))
+	wall = time.time() - start
+
+	failed = [name for name, returncode, _ in outcomes if returncode != 0]
+	serial = sum(elapsed for _, _, elapsed in outcomes)
+	print("\n{} runs finished in {:.1f} min wall time ({:.1f} min of run time, {:.1f}x)".format(
+		len(outcomes), wall / 60, serial / 60, serial / wall if wall > 0 else 0.0
+	))
+	if failed:
+		print("{} failed runs:".format(len(failed)))
+		for name in failed:
+			print("- {}".format(name))
+		sys.exit(1)
+
+if __name__ == "__main__":
+	main()
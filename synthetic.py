@@ -0,0 +1,132 @@
+"""
+Synthetic rumour threads in the layout read by `preprocess.py`, for benchmarks and scaling tests.
+
+	python synthetic.py --dataset Synthetic --n_events 10000 --shape mixed --output ./data/synthetic_source
+	python preprocess.py --data_source ./data/synthetic_source --dataset Synthetic --split_5_fold
+	python preprocess.py --data_source ./data/synthetic_source --dataset Synthetic --make_label
+	python preprocess.py --data_source ./data/synthetic_source --dataset Synthetic --build_graph
+
+Writes `{output}/{dataset.lower()}/data.csv` (source_id, parent_idx, self_idx,
+num_parent, max_seq_len, text, veracity) and `split_{fold}/train.csv` /
+`test.csv`. The output only depends on the arguments and `--seed`.
+"""
+import os
+import csv
+import argparse
+import numpy as np
+
+LABELS = {4: ["true", "false", "unverified", "non-rumor"], 3: ["true", "false", "unverified"]}
+SYLLABLES = ["ka", "ro", "mi", "te", "su", "na", "lo", "vi", "pe", "da", "zu", "ne", "fo", "ri", "ma", "ti", "ba", "go", "le", "shi"]
+
+def parse_args():
+	parser = argparse.ArgumentParser(description="Synthetic rumour thread generator for DUCK")
+	parser.add_argument("--dataset", type=str, default="Synthetic", help="dataset name, the data goes to {output}/{dataset.lower()}")
+	parser.add_argument("--output", type=str, default="./data/synthetic_source", help="used as `--data_source` of preprocess.py")
+	parser.add_argument("--seed", type=int, default=0)
+	parser.add_argument("--n_events", type=int, default=1000, help="number of source tweets (trees)")
+	parser.add_argument("--n_classes", type=int, default=4, choices=[3, 4])
+	parser.add_argument("--n_folds", type=int, default=5)
+
+	## Tree sizes & shapes
+	parser.add_argument("--size_dist", type=str, default="powerlaw", choices=["powerlaw", "uniform", "fixed"], help="distribution of the number of posts per tree")
+	parser.add_argument("--min_size", type=int, default=2, help="smallest tree (source tweet included)")
+	parser.add_argument("--max_size", type=int, default=500, help="largest tree, also the size of every tree with --size_dist fixed")
+	parser.add_argument("--alpha", type=float, default=1.8, help="exponent of the power-law size distribution")
+	parser.add_argument("--shape", type=str, default="attach", choices=["attach", "star", "chain", "mixed"],
+		help="attach: replies attach to popular posts (preferential attachment), star: all replies to the source, chain: each reply to the previous one, mixed: random per tree")
+
+	## Text
+	parser.add_argument("--min_words", type=int, default=5)
+	parser.add_argument("--max_words", type=int, default=30)
+	parser.add_argument("--vocab_size", type=int, default=5000)
+	return parser.parse_args()
+
+def make_vocab(vocab_size, rng):
+	"""Pronounceable pseudo-words, so that a WordPiece tokenizer splits them like real words."""
+	words = set()
+	while len(words) < vocab_size:
+		words.add("".join(rng.choice(SYLLABLES, size=rng.randint(1, 4))))
+	return sorted(words)
+
+def tree_size(args, rng):
+	if args.size_dist == "fixed":
+		return args.max_size
+	if args.size_dist == "uniform":
+		return rng.randint(args.min_size, args.max_size + 1)
+	## Discrete power law on [min_size, max_size] by inverse transform sampling
+	u = rng.random_sample()
+	a, lo, hi = 1.0 - args.alpha, float(args.min_size), float(args.max_size + 1)
+	size = (lo ** a + u * (hi ** a - lo ** a)) ** (1.0 / a) if a != 0 else lo * (hi / lo) ** u
+	return int(min(max(size, args.min_size), args.max_size))
+
+def tree_parents(n_nodes, shape, rng):
+	"""Parent (1-based `self_idx`) of nodes 2..n_nodes, node 1 being the source tweet."""
+	parents = []
+	degree = np.ones(n_nodes + 1)
+	for child in range(2, n_nodes + 1):
+		if shape == "star":
+			parent = 1
+		elif shape == "chain":
+			parent = child - 1
+		else:
+			weights = degree[1:child]
+			parent = 1 + rng.choice(child - 1, p=weights / weights.sum())
+			degree[parent] += 1
+		parents.append(parent)
+	return parents
+
+def depth_of(parents):
+	depth = {1: 0}
+	for child, parent in enumerate(parents, start=2):
+		depth[child] = depth[parent] + 1
+	return depth
+
+def main():
+	args = parse_args()
+	rng = np.random.RandomState(args.seed)
+	vocab = np.array(make_vocab(args.vocab_size, rng))
+	labels = LABELS[args.n_classes]
+
+	path = "{}/{}".format(args.output, args.dataset.lower())
+	os.makedirs(path, exist_ok=True)
+
+	print("Generating {} events...".format(args.n_events))
+	source_ids, n_posts = [], 0
+	with open("{}/data.csv".format(path), "w", newline="") as fw:
+		writer = csv.writer(fw)
+		writer.writerow(["source_id", "parent_idx", "self_idx", "num_parent", "max_seq_len", "text", "veracity"])
+		for event in range(args.n_events):
+			source_id = 10 ** 17 + args.seed * 10 ** 9 + event
+			n_nodes = tree_size(args, rng)
+			shape = args.shape if args.shape != "mixed" else rng.choice(["attach", "star", "chain"])
+			parents = tree_parents(n_nodes, shape, rng)
+			depth = depth_of(parents)
+			label = labels[rng.randint(len(labels))]
+
+			posts = [" ".join(rng.choice(vocab, size=rng.randint(args.min_words, args.max_words + 1))) for _ in range(n_nodes)]
+			max_seq_len = max(len(post.split()) for post in posts)
+			for self_idx in range(1, n_nodes + 1):
+				parent_idx = "None" if self_idx == 1 else parents[self_idx - 2]
+				writer.writerow([source_id, parent_idx, self_idx, depth[self_idx], max_seq_len, posts[self_idx - 1], label])
+			source_ids.append(source_id)
+			n_posts += n_nodes
+
+	## Folds: a fixed shuffle of the events cut into `n_folds` test sets
+	order = rng.permutation(len(source_ids))
+	test_folds = np.array_split(order, args.n_folds)
+	for fold, test_idx in enumerate(test_folds):
+		test_set = set(test_idx.tolist())
+		fold_path = "{}/split_{}".format(path, fold)
+		os.makedirs(fold_path, exist_ok=True)
+		for name, keep in (("train", lambda i: i not in test_set), ("test", lambda i: i in test_set)):
+			with open("{}/{}.csv".format(fold_path, name), "w", newline="") as fw:
+				writer = csv.writer(fw)
+				writer.writerow(["source_id"])
+				for i in range(len(source_ids)):
+					if keep(i):
+						writer.writerow([source_ids[i]])
+
+	print("{} events, {} posts ({:.1f} per tree) written to {}".format(len(source_ids), n_posts, n_posts / max(len(source_ids), 1), path))
+
+if __name__ == "__main__":
+	main()
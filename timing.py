@@ -0,0 +1,137 @@
+"""
+Lightweight per-stage timing of the training pipeline.
+
+Stages run in the main process are timed with `StageTimer.stage`; modules
+are timed with forward hooks (`attach_module_timers`); stages run in
+DataLoader workers (`np.load`, tokenization, collate) are measured there and
+travel with the batch in its `stage_times` attribute.
+Timings are wall-clock: on GPU, kernels are asynchronous and a stage only
+accounts for the time it took to launch them.
+"""
+import os
+import csv
+import json
+import time
+from contextlib import contextmanager
+
+import numpy as np
+import torch
+
+class StageTimer:
+	def __init__(self, enabled=True):
+		self.enabled = enabled
+		self.samples = {}
+
+	def add(self, name, seconds):
+		if self.enabled:
+			self.samples.setdefault(name, []).append(seconds)
+
+	@contextmanager
+	def stage(self, name):
+		if not self.enabled:
+			yield
+			return
+		start = time.perf_counter()
+		try:
+			yield
+		finally:
+			self.samples.setdefault(name, []).append(time.perf_counter() - start)
+
+	@contextmanager
+	def paused(self):
+		"""Do not record anything inside the block (e.g. module hooks during evaluation)."""
+		enabled, self.enabled = self.enabled, False
+		try:
+			yield
+		finally:
+			self.enabled = enabled
+
+	def iterate(self, iterable, name="data_wait"):
+		"""Yield from `iterable`, timing how long each item takes to arrive."""
+		iterator = iter(iterable)
+		while True:
+			start = time.perf_counter()
+			try:
+				item = next(iterator)
+			except StopIteration:
+				return
+			self.add(name, time.perf_counter() - start)
+			yield item
+
+	def record_batch(self, batch):
+		"""Move the worker-side timings carried by `batch` into the timer."""
+		if "stage_times" not in batch:
+			return
+		if self.enabled:
+			for name, values in batch.stage_times.items():
+				values = values.tolist() if torch.is_tensor(values) else values
+				self.samples.setdefault(name, []).extend(values if isinstance(values, list) else [values])
+		del batch.stage_times
+
+	def summary(self):
+		"""count / total / mean / p50 / p95 / max (seconds) of each stage."""
+		summary = {}
+		for name, values in self.samples.items():
+			values = np.asarray(values)
+			summary[name] = {
+				"count": int(values.size),
+				"total": float(values.sum()),
+				"mean": float(values.mean()),
+				"p50": float(np.percentile(values, 50)),
+				"p95": float(np.percentile(values, 95)),
+				"max": float(values.max()),
+			}
+		return summary
+
+	def reset(self):
+		self.samples = {}
+
+class TimedCollater:
+	"""Wrap a DataLoader's `collate_fn`, adding the collate time to the batch's `stage_times`."""
+	def __init__(self, collate_fn):
+		self.collate_fn = collate_fn
+
+	def __call__(self, data_list):
+		start = time.perf_counter()
+		batch = self.collate_fn(data_list)
+		if "stage_times" in batch:
+			batch.stage_times["collate"] = [time.perf_counter() - start]
+		return batch
+
+def time_loader(loader):
+	"""Time the collation of `loader`'s batches (set on the loader, so it also applies in worker processes)."""
+	if not isinstance(loader.collate_fn, TimedCollater):
+		loader.collate_fn = TimedCollater(loader.collate_fn)
+	return loader
+
+def attach_module_timers(model, timer, class_names=("BertClassifier", "SimpleGAT_BERT", "TTransformerModel")):
+	"""
+	Time the forward pass of every submodule whose class is in `class_names`,
+	under the class name. Timings of nested modules are included in their parent's.
+	"""
+	handles = []
+	for module in model.modules():
+		name = type(module).__name__
+		if name not in class_names:
+			continue
+		starts = []
+		def pre_hook(module, inputs, starts=starts):
+			starts.append(time.perf_counter())
+		def hook(module, inputs, output, starts=starts, name=name):
+			if starts:
+				timer.add(name, time.perf_counter() - starts.pop())
+		handles.append(module.register_forward_pre_hook(pre_hook))
+		handles.append(module.register_forward_hook(hook))
+	return handles
+
+def write_timing(history, path):
+	"""Write per-epoch stage summaries to `path`.json and `path`.csv (one row per epoch & stage)."""
+	os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+	with open(path + ".json", "w") as fw:
+		json.dump(history, fw, indent=2)
+	with open(path + ".csv", "w", newline="") as fw:
+		writer = csv.writer(fw)
+		writer.writerow(["epoch", "stage", "count", "total", "mean", "p50", "p95", "max"])
+		for entry in history:
+			for name, stats in entry["stages"].items():
+				writer.writerow([entry["epoch"], name] + ["{:.6f}".format(stats[key]) if key != "count" else stats[key] for key in ("count", "total", "mean", "p50", "p95", "max")])
@@ -1,5 +1,10 @@
+if __name__ == "__main__":
+	## Check the command line (and answer --help) before the heavy imports below
+	from options import get_parser
+	get_parser().parse_args()
+
 import copy
-import ipdb
+import time
 import sys,os
 import pickle
 import random
@@ -18,6 +23,7 @@ from torch.utils.data import Dataset
 from torch_geometric.data import Data
 #from torch_geometric.data import DataLoader
 from torch_geometric.loader import DataLoader
+from torch.nn.parallel import DistributedDataParallel
 from torch_geometric.nn import global_mean_pool, global_max_pool
 from torch_geometric.nn import GCNConv,GraphConv,GINConv,GATConv
 from torch_scatter import scatter_mean, scatter_max, scatter_add
@@ -30,6 +36,16 @@ from model.gat import SimpleGATNet
 from model.gcn import SimpleGCNNet, TripleGCNNet
 from model.bert_gat import SimpleGATBERTNet, TripleGATBERTNet
 from dataset import CommentTreeDataset, UserTreeDataset, DuckDataset
+from distributed import launch, init_distributed, cleanup, is_main_process, ResumableSampler
+from checkpoint import AsyncCheckpointer, rng_state, set_rng_state
+from evaluate import Evaluator, build_eval_loader, format_metrics
+from timing import StageTimer, attach_module_timers, time_loader, write_timing
+from profiler import StepProfiler
+from memory import MemoryTracker
+from compiler import compile_model
+from snapshot import extract_assets, build_from_snapshot
+from cpu_utils import configure_threads, worker_init_fn
+from options import get_parser
 
 # Seed
 seed = 123
@@ -43,6 +59,9 @@ torch.backends.cudnn.deterministic = True
 
 logger = get_logger('train')
 
+## Arguments that must match to resume a training state
+RESUME_KEYS = ["datasetName", "foldnum", "modelName", "bertVersion", "n_classes", "learningRate", "learningRateGraph", "dropout_gat", "batchsize", "max_tree_len"]
+
 class DUCK:
 	def __init__(self,args):
 		self.parse_args(args)
@@ -62,6 +81,10 @@ class DUCK:
 		self.n_epochs = args.n_epochs
 		self.batchsize = args.batchsize
 		self.multi_gpu = args.multi_gpu
+		if getattr(args, "snapshot", None):
+			args.bertVersion = extract_assets(args.snapshot) ## config & tokenizer files of the snapshot
+		self.bert_version = args.bertVersion
+		self.hidden_size = get_bert_hidden_size(args.bertVersion)
 
 
 	def loadfolddatawithKnownFold(self):
@@ -84,25 +107,40 @@ class DUCK:
 		test = df.iloc[result[1]]
 		return train, test
 
-	def init_model(self):
+	def init_model(self, pretrained=True):
+		"""Build the `--modelName` model; with `pretrained=False` the encoders are not loaded from `--bertVersion` (weights restored from a checkpoint next)."""
 		print("\nBuilding model {}...".format(self.modelName))
+		## Factories, only the requested model is built (and its encoders loaded)
 		MODEL_CLASS = {
-			#"Simple_GCN": SimpleGCNNet(),
-			#"Triple_GCN": TripleGCNNet(),
-			#"Simple_GAT": SimpleGATNet(),
-			"Simple_GAT_BERT": SimpleGATBERTNet(
-				D_in=768, 
-				hid_feats=768, 
-				out_feats=768, 
+			#"Simple_GCN": SimpleGCNNet,
+			#"Triple_GCN": TripleGCNNet,
+			#"Simple_GAT": SimpleGATNet,
+			"Simple_GAT_BERT": lambda: SimpleGATBERTNet(
+				D_in=self.hidden_size, 
+				hid_feats=self.hidden_size, 
+				out_feats=self.hidden_size, 
 				H=32, 
 				D_out=self.args.n_classes, 
-				gat_dropout=self.args.dropout_gat
+				gat_dropout=self.args.dropout_gat, 
+				bert_version=self.bert_version,
+				pretrained=pretrained
 			),
-			"CCCTNet": CCCTNet(in_feats=768, hid_feats=768, out_feats=768, D_in=768, D_H=64, D_out=self.args.n_classes), 
-			#"Triple_GAT_BERT": TripleGATBERTNet(),
-			#"DUCK": ComboNet(),
+			"CCCTNet": lambda: CCCTNet(
+				in_feats=self.hidden_size, 
+				hid_feats=self.hidden_size, 
+				out_feats=self.hidden_size, 
+				D_in=self.hidden_size, 
+				D_H=64, 
+				D_out=self.args.n_classes, 
+				bert_version=self.bert_version,
+				pretrained=pretrained
+			), 
+			#"Triple_GAT_BERT": TripleGATBERTNet,
+			#"DUCK": ComboNet,
 		}
-		model = MODEL_CLASS[self.modelName]
+		if self.modelName not in MODEL_CLASS:
+			raise ValueError("Unknown model {}, pick from {}".format(self.modelName, ", ".join(MODEL_CLASS)))
+		model = MODEL_CLASS[self.modelName]()
 		return model
 
 	def loadData(self):
@@ -120,22 +158,30 @@ class DUCK:
 		print("length of testing  list" , len(testdata_list))
 		return traindata_list, testdata_list
 
-	def train(self, load=False):
-		if load:
-			model = self.load_model(self.config.pretrained_model_path)
-		device = torch.device('cuda:0' if torch.cuda.is_available() else 'cpu')
-		test_accs = []
-		NR_F1 = []
-		FR_F1 = []
-		TR_F1 = []
-		UR_F1 = []
+	def setup(self):
+		"""Build the model, optimizer, data loaders and early stopping used by `train_epoch` and `evaluate`."""
+		self.rank, self.world_size = init_distributed(self.args.dist_backend)
+		if self.world_size > 1 and self.args.dist_backend == "nccl":
+			device = torch.device("cuda:{}".format(os.environ.get("LOCAL_RANK", 0)))
+		elif self.world_size > 1:
+			device = torch.device("cpu")
+		else:
+			device = torch.device('cuda:0' if torch.cuda.is_available() else 'cpu')
+		self.device = device
+		self.is_main = is_main_process()
+		layout = configure_threads(self.args)
+		if self.is_main:
+			print("CPU layout: {} intra-op / {} inter-op threads, {} loader workers{}".format(
+				layout["intra_op_threads"], layout["inter_op_threads"], layout["num_workers"],
+				", pinned to cores {}".format(layout["main_cores"]) if layout["pin"] else ""
+			))
 
 		x_train, x_test = self.loadfolddatawithKnownFold()
 		self.x_train, self.x_test = x_train, x_test
 		#model = TripleGCNNet(16,256,64,pooling='scatter_mean').to(device)
 		#print(model)
 		#should based on the modelName to init the model dynamically
-		model = self.init_model()
+		model = self.init_model() if self.args.snapshot is None else build_from_snapshot(self, self.args.snapshot)
 		model.to(device)
 		
 		GNN_params =  list(map(id, model.gnn.conv1.parameters()))
@@ -158,237 +204,363 @@ class DUCK:
 				{"params": model.gnn.conv3.parameters(), "lr": self.glr},
 			], lr=self.lr, weight_decay=self.weight_decay)
 
+		## Compiled in place: parameters & state dict keys are unchanged
+		if self.args.compile:
+			cache_dir = self.args.compile_cache or "{}/compile_cache".format(self.args.result_path)
+			compile_model(model, mode=self.args.compile_mode, cache_dir=cache_dir)
+
+		## Data parallel across processes, each rank trains on its own shard with `batchsize` trees per step
+		if self.world_size > 1:
+			model = DistributedDataParallel(model, find_unused_parameters=True)
+		self.model, self.optimizer = model, optimizer
+
 		## Load dataset for training
 		traindata_list, testdata_list = self.loadData()
-		train_loader = DataLoader(traindata_list, batch_size=self.batchsize, shuffle=True, num_workers=0)#5)
-		test_loader  = DataLoader(testdata_list , batch_size=self.batchsize, shuffle=True, num_workers=0)#5)
+		loader_kwargs = {"num_workers": layout["num_workers"], "worker_init_fn": worker_init_fn(layout), "pin_memory": device.type == "cuda"}
+		## Training order depends on (seed, epoch) only, so a resumed run replays the same batches
+		self.train_sampler = ResumableSampler(traindata_list, num_replicas=self.world_size, rank=self.rank, seed=self.seed)
+		self.train_loader = DataLoader(traindata_list, batch_size=self.batchsize, sampler=self.train_sampler, **loader_kwargs)
+		if self.args.timing:
+			time_loader(self.train_loader)
+		self.test_loader  = build_eval_loader(testdata_list, self.batchsize, self.args.eval_batch_tokens, self.rank, self.world_size, **loader_kwargs)
+		self.evaluator = Evaluator(self.test_loader, device, self.world_size, show_progress=self.is_main)
+
+		## Checkpoints: `last.pt` (full training state) & `best.pt` (model only), written by rank 0 in the background
+		self.ckpt_dir = self.args.ckpt_dir
+		if self.ckpt_dir is None and (self.args.resume or self.args.ckpt_every_min > 0 or self.args.ckpt_every_steps > 0):
+			self.ckpt_dir = "{}/ckpt/{}_fold{}_{}".format(self.args.result_path, self.datasetName, self.foldnum, self.modelName)
+		self.checkpointer = None
+		best_path = None
+		if self.ckpt_dir is not None and self.is_main:
+			os.makedirs(self.ckpt_dir, exist_ok=True)
+			self.checkpointer = AsyncCheckpointer()
+			best_path = os.path.join(self.ckpt_dir, "best.pt")
+		self.last_ckpt_time = time.time()
 		
-		train_losses = []
-		val_losses = []
-		train_accs = []
-		val_accs = []
-		early_stopping = EarlyStopping(args=self.args, patience=self.patience, verbose=True)
-
-		## Open file for saving metrics
-		best_metrics = None
-		os.makedirs(self.args.result_path, exist_ok=True)
-		result_file = "{}/{}.txt".format(self.args.result_path, self.args.datasetName)
-		if os.path.isfile(result_file):
-			fw = open(result_file, "a")
-		else:
-			fw = open(result_file, "w")
-			fw.write("{:4s}\t{:6s}\t{:6s}\t{:6s}\t{:6s}\t{:6s}\t{:6s}\t{:6s}\t{:6s}\t{:6s}\t{:6s}\t{:6s}\t{:6s}\t{:6s}\t{:6s}\t{:6s}\t{:6s}\t{:6s}\t{:6s}\t{:6s}\t{:6s}\t{:6s}\n".format(
-				"Fold", "lr", "glr", "dropout", 
-				"Acc.", "macroF", 
-				"Acc1", "Prec1", "Recll1", "F1",
-				"Acc2", "Prec2", "Recll2", "F2",
-				"Acc3", "Prec3", "Recll3", "F3",
-				"Acc4", "Prec4", "Recll4", "F4"
-			))
+		self.train_losses = []
+		self.val_losses = []
+		self.train_accs = []
+		self.early_stopping = EarlyStopping(args=self.args, patience=self.patience, verbose=True, checkpointer=self.checkpointer, best_path=best_path)
+		self.start_epoch = 0
+		self.start_batch = 0
+		self.epoch_stats = None
+
+		## Metrics are appended to the result file once training ends (rank 0 only)
+		self.best_metrics = None
+		self.result_file = "{}/{}.txt".format(self.args.result_path, self.args.datasetName)
+
+		## Name of the per-run report files: runs of a sweep that differ only by their hyper-parameters must not share them
+		self.run_name = "{}_fold{}_{}_lr{:.0E}_glr{:.0E}_do{}".format(
+			self.datasetName, self.foldnum, self.modelName, self.args.learningRate, self.args.learningRateGraph, self.args.dropout_gat
+		)
+
+		## Per-stage timings, summarised every epoch to {result_path}/{run_name}_timing.json/.csv
+		self.timer = StageTimer(enabled=self.args.timing)
+		self.timing_history = []
+		self.timing_path = "{}/{}_timing".format(self.args.result_path, self.run_name)
+		if self.args.timing:
+			attach_module_timers(self.model, self.timer)
+
+		## Peak memory per batch, to {result_path}/{run_name}_memory.csv/.json
+		self.memory = MemoryTracker(device, enabled=self.args.track_memory)
+		self.memory_path = "{}/{}_memory".format(self.args.result_path, self.run_name)
+
+		## Operator-level profile of the `--profile_steps` window (rank 0 only)
+		self.profiler = None
+		if self.args.profile_steps is not None and self.is_main:
+			self.profiler = StepProfiler(
+				self.args.profile_steps, 
+				"{}/profile/{}".format(self.args.result_path, self.run_name), 
+				topk=self.args.profile_topk
+			)
 
-		print("\nStart training...")
-		for epoch in range(self.args.n_epochs):
-
-			## Training
-			model.train()
-			avg_loss = []
-			avg_acc = []
-			batch_idx = 0
-			tqdm_train_loader = tqdm(train_loader, desc="Epoch: {}, Train".format(epoch))
-			for Batch_data in tqdm_train_loader:
-				Batch_data.to(device)
-				dataList = Batch_data.to_data_list()
-				#emb, out_labels = model(Batch_data)
-				out_labels = model(Batch_data)
-				finalloss = F.nll_loss(out_labels,Batch_data.y)
+		if self.args.resume and self.ckpt_dir is not None:
+			last_path = os.path.join(self.ckpt_dir, "last.pt")
+			if os.path.isfile(last_path):
+				self.load_state(last_path)
+				print("Resuming from {}: epoch {}, batch {}".format(last_path, self.start_epoch, self.start_batch))
+			else:
+				print("No checkpoint at {}, training from scratch".format(last_path))
+
+	def train_epoch(self, epoch):
+		model, optimizer, device = self.model, self.optimizer, self.device
+
+		model.train()
+		## Skip the batches of a resumed epoch that were trained on before the checkpoint
+		start_batch = self.start_batch if epoch == self.start_epoch else 0
+		self.train_sampler.set_epoch(epoch)
+		self.train_sampler.set_start_index(start_batch * self.batchsize)
+		## Sums of the per-batch loss & accuracy, kept on device: no host sync per step
+		if start_batch > 0 and self.epoch_stats is not None:
+			loss_sum, acc_sum = (stat.to(device) for stat in self.epoch_stats)
+		else:
+			loss_sum, acc_sum = torch.zeros((), device=device), torch.zeros((), device=device)
+		batch_idx = start_batch
+		tqdm_train_loader = tqdm(
+			self.train_loader, desc="Epoch: {}, Train".format(epoch), disable=not self.is_main, 
+			initial=start_batch, total=start_batch + len(self.train_loader)
+		)
+		timer = self.timer
+		for Batch_data in timer.iterate(tqdm_train_loader):
+			timer.record_batch(Batch_data)
+			with timer.stage("h2d"):
+				Batch_data = Batch_data.to(device, non_blocking=True)
+			optimizer.zero_grad(set_to_none=True)
+			with self.memory.track(Batch_data, epoch, batch_idx):
+				with timer.stage("forward"):
+					#emb, out_labels = model(Batch_data)
+					out_labels = model(Batch_data)
+					finalloss = F.nll_loss(out_labels,Batch_data.y)
 				
-				optimizer.zero_grad()
 				loss = finalloss
-				loss.backward()
-				avg_loss.append(loss.item())
+				with timer.stage("backward"):
+					loss.backward()
+			with timer.stage("optimizer_step"):
 				optimizer.step()
+			if self.profiler is not None:
+				self.profiler.step()
+
+			loss_sum += loss.detach()
+			acc_sum += out_labels.detach().argmax(dim=-1).eq(Batch_data.y).float().mean()
+			batch_idx = batch_idx + 1
+
+			## Read the running means back only every `--log_every` batches
+			if self.is_main and self.args.log_every > 0 and batch_idx % self.args.log_every == 0:
+				tqdm_train_loader.set_postfix(
+					loss="{:.4f}".format(loss_sum.item() / batch_idx), 
+					acc="{:.4f}".format(acc_sum.item() / batch_idx), 
+					refresh=False
+				)
+			self.maybe_checkpoint(epoch, batch_idx, (loss_sum, acc_sum))
+
+		self.train_sampler.set_start_index(0)
+		self.start_batch = 0
+		self.epoch_stats = None
+		train_loss = loss_sum.item() / batch_idx if batch_idx > 0 else float("nan")
+		train_acc  = acc_sum.item()  / batch_idx if batch_idx > 0 else float("nan")
+		self.train_losses.append(train_loss)
+		self.train_accs.append(train_acc)
+		self.report_timing(epoch)
+		self.report_memory(epoch)
+		return train_loss, train_acc
+
+	def report_timing(self, epoch):
+		"""Print this epoch's stage timings and add them to the timing files (rank 0 only)."""
+		if not self.timer.enabled:
+			return
+		stages = self.timer.summary()
+		self.timer.reset()
+		if not self.is_main or not stages:
+			return
+		print("Epoch {:05d} | stage timings (ms) p50 / p95 / max".format(epoch))
+		for name, stats in stages.items():
+			print("  {:16s} {:9.2f} {:9.2f} {:9.2f}  ({} calls, {:.1f}s)".format(
+				name, stats["p50"] * 1000, stats["p95"] * 1000, stats["max"] * 1000, stats["count"], stats["total"]
+			))
+		self.timing_history.append({"epoch": epoch, "stages": stages})
+		write_timing(self.timing_history, self.timing_path)
+
+	def report_memory(self, epoch):
+		"""Print the batches with the highest peak memory so far and rewrite the memory files."""
+		if not self.memory.enabled or not self.memory.records:
+			return
+		summary = self.memory.write(self.memory_path if self.world_size == 1 else "{}_rank{}".format(self.memory_path, self.rank))
+		if not self.is_main:
+			return
+		key = summary["peak_key"]
+		print("Epoch {:05d} | batches with the highest {}".format(epoch, key))
+		for record in summary["worst"][:5]:
+			print("  epoch {} batch {:5d}: {} nodes (max tree {}), {} tokens, {} MB peak, {:.1f} MB saved tensors | {}".format(
+				record["epoch"], record["batch"], record["nodes"], record["max_tree_nodes"], record["tokens"], 
+				"{:.1f}".format(record[key]) if record[key] is not None else "n/a", record["saved_tensors_mb"], record["event_ids"]
+			))
+		fit = summary["fit_vs_nodes"]["saved_tensors_mb"]
+		if fit is not None:
+			print("  saved tensors (MB) ~ polynomial of nodes {} (R^2 {:.3f})".format(["{:.4g}".format(c) for c in fit["coeffs"]], fit["r2"]))
+
+	def evaluate(self, epoch):
+		"""Evaluate on the test split, returns the mean loss and the metrics of `evaluationRumour4`."""
+		with self.timer.paused():
+			val_loss, metrics = self.evaluator(self.model, desc="Epoch: {}, Eval".format(epoch))
+		self.val_losses.append(val_loss)
+		print("Epoch {:05d} | Val_Loss {:.4f}".format(epoch, val_loss))
+		return val_loss, metrics
+
+	def should_evaluate(self, epoch):
+		"""Evaluate every `--eval_every` epochs and after the last one."""
+		return (epoch + 1) % max(self.args.eval_every, 1) == 0 or epoch + 1 == self.args.n_epochs
+
+	def update_best(self, epoch, val_loss, metrics):
+		"""Feed one evaluation to early stopping and keep the best metrics, returns True to stop training."""
+		early_stopping = self.early_stopping
+		Acc_all, \
+		Acc1, Prec1, Recll1, F1, \
+		Acc2, Prec2, Recll2, F2, \
+		Acc3, Prec3, Recll3, F3, \
+		Acc4, Prec4, Recll4, F4 = metrics
+
+		res = format_metrics(metrics, self.args.n_classes)
+		for res_ in res:
+			print(res_)
+		logger.info(f"results: {res}")
+
+		is_best = early_stopping(
+			val_loss, Acc_all, F1, F2, F3, F4, 
+			self.model, self.args.modelName, "{}{}".format(self.datasetName, self.foldnum)
+		)
+		accs = Acc_all
+
+		if early_stopping.early_stop:
+			print("Early stopping")
+			logger.info(f"Early stopping")
+			return True
+		torch.cuda.empty_cache()
+
+		logger.info(f"acc {accs}, F1 {F1} | F2 {F2} | F3 {F3} | F4 {F4} ")
+
+		if is_best:
+			self.best_metrics = {
+				"Acc.": accs, "macroF": (F1 + F2 + F3 + F4) / self.args.n_classes, 
+				"Acc1": Acc1, "Prec1": Prec1, "Recll1": Recll1, "F1": F1, 
+				"Acc2": Acc2, "Prec2": Prec2, "Recll2": Recll2, "F2": F2, 
+				"Acc3": Acc3, "Prec3": Prec3, "Recll3": Recll3, "F3": F3, 
+				"Acc4": Acc4, "Prec4": Prec4, "Recll4": Recll4, "F4": F4, 
+			}
+		return False
 
-				_, pred = out_labels.max(dim=-1)
-				correct = pred.eq(Batch_data.y).sum().item()
-				train_acc = correct / len(Batch_data.y)
-				avg_acc.append(train_acc)
-
-				#print("Epoch {:05d} | Batch{:02d} | Train_Loss {:.4f}| Train_Accuracy {:.4f}".format(epoch, batch_idx, loss.item(), train_acc))
-				#logger.info("Epoch {:05d} | Batch{:02d} | Train_Loss {:.4f}| Train_Accuracy {:.4f}".format(epoch, batch_idx, loss.item(), train_acc))
-
-				batch_idx = batch_idx + 1
-
-			train_losses.append(np.mean(avg_loss))
-			train_accs.append(np.mean(avg_acc))
-
-			## Evaluation
-			model.eval()
-			pred_all, y_all = [], []
-			temp_val_losses = []
-			temp_val_accs = []
-			temp_val_Acc_all, \
-			temp_val_Acc1, temp_val_Prec1, temp_val_Recll1, temp_val_F1, \
-			temp_val_Acc2, temp_val_Prec2, temp_val_Recll2, temp_val_F2, \
-			temp_val_Acc3, temp_val_Prec3, temp_val_Recll3, temp_val_F3, \
-			temp_val_Acc4, temp_val_Prec4, temp_val_Recll4, temp_val_F4 = [], [], [], [], [], [], [], [], [], [], [], [], [], [], [], [], []
-			tqdm_test_loader = tqdm(test_loader, desc="Epoch: {}, Eval".format(epoch))
-			with torch.no_grad():
-				for Batch_data in tqdm_test_loader:
-					optimizer.zero_grad()
-					Batch_data.to(device)
-					#val_emb, val_out = model(Batch_data)
-					val_out = model(Batch_data)
-					val_loss = F.nll_loss(val_out, Batch_data.y)
-					temp_val_losses.append(val_loss.item())
-					
-					_, val_pred = val_out.max(dim=1)
-					correct = val_pred.eq(Batch_data.y).sum().item()
-					val_acc = correct / len(Batch_data.y)
-
-					#Acc_all, \
-					#Acc1, Prec1, Recll1, F1, \
-					#Acc2, Prec2, Recll2, F2, \
-					#Acc3, Prec3, Recll3, F3, \
-					#Acc4, Prec4, Recll4, F4 = evaluationRumour4(val_pred, Batch_data.y)
-					#
-					#temp_val_Acc_all.append(Acc_all)
-					#temp_val_Acc1.append(Acc1), temp_val_Prec1.append(Prec1), temp_val_Recll1.append(Recll1), temp_val_F1.append(F1), \
-					#temp_val_Acc2.append(Acc2), temp_val_Prec2.append(Prec2), temp_val_Recll2.append(Recll2), temp_val_F2.append(F2), \
-					#temp_val_Acc3.append(Acc3), temp_val_Prec3.append(Prec3), temp_val_Recll3.append(Recll3), temp_val_F3.append(F3), \
-					#temp_val_Acc4.append(Acc4), temp_val_Prec4.append(Prec4), temp_val_Recll4.append(Recll4), temp_val_F4.append(F4)
-					#temp_val_accs.append(val_acc)
-
-					## Save predictions & labels
-					pred_all.append(val_pred)
-					y_all.append(Batch_data.y)
-
-			## Evaluate all predictions
-			pred_all, y_all = torch.cat(pred_all), torch.cat(y_all)
-			
-			Acc_all, \
-			Acc1, Prec1, Recll1, F1, \
-			Acc2, Prec2, Recll2, F2, \
-			Acc3, Prec3, Recll3, F3, \
-			Acc4, Prec4, Recll4, F4 = evaluationRumour4(pred_all, y_all)
-			#ipdb.set_trace()
-
-			val_losses.append(np.mean(temp_val_losses))
-			#val_accs.append(np.mean(temp_val_accs))
-			#print("Epoch {:05d} | Val_Loss {:.4f} | Val_Accuracy {:.4f}".format(epoch, np.mean(temp_val_losses),np.mean(temp_val_accs)))
-			print("Epoch {:05d} | Val_Loss {:.4f}".format(epoch, np.mean(temp_val_losses)))
-			temp_mean_val_losses = np.mean(temp_val_losses)
-			#temp_mean_val_accs = np.mean(temp_val_accs)
-			#logger.info(f"epoch {epoch}, {temp_mean_val_losses},{temp_mean_val_accs}")
-
-			#res = ["acc:{:.4f},macroF:{:.4f}".format(np.mean(temp_val_Acc_all), (np.mean(temp_val_F1) + np.mean(temp_val_F2) + np.mean(temp_val_F3) + np.mean(temp_val_F4)) / self.args.n_classes), 
-			#	   "C1:{:.4f},{:.4f},{:.4f},{:.4f}".format(np.mean(temp_val_Acc1), np.mean(temp_val_Prec1), np.mean(temp_val_Recll1), np.mean(temp_val_F1)),
-			#	   "C2:{:.4f},{:.4f},{:.4f},{:.4f}".format(np.mean(temp_val_Acc2), np.mean(temp_val_Prec2), np.mean(temp_val_Recll2), np.mean(temp_val_F2)),
-			#	   "C3:{:.4f},{:.4f},{:.4f},{:.4f}".format(np.mean(temp_val_Acc3), np.mean(temp_val_Prec3), np.mean(temp_val_Recll3), np.mean(temp_val_F3)),
-			#	   "C4:{:.4f},{:.4f},{:.4f},{:.4f}".format(np.mean(temp_val_Acc4), np.mean(temp_val_Prec4), np.mean(temp_val_Recll4), np.mean(temp_val_F4))]
-			#print('results:', res)
-			#logger.info(f"results: {res}")
-
-			#is_best = early_stopping(
-			#	np.mean(temp_val_losses), np.mean(temp_val_accs), np.mean(temp_val_F1), np.mean(temp_val_F2),
-			#	np.mean(temp_val_F3), np.mean(temp_val_F4), model, self.args.modelName, "{}{}".format(self.args.datasetName, self.args.foldnum)
-			#)
-			
-			#accs = np.mean(temp_val_accs)
-			#F1 = np.mean(temp_val_F1)
-			#F2 = np.mean(temp_val_F2)
-			#F3 = np.mean(temp_val_F3)
-			#F4 = np.mean(temp_val_F4)
-
-			res = ["acc: {:.4f}, macroF: {:.4f}".format(Acc_all, (F1 + F2 + F3 + F4) / self.args.n_classes), 
-				   "C1 : {:.4f}, {:.4f}, {:.4f}, {:.4f}".format(Acc1, Prec1, Recll1, F1),
-				   "C2 : {:.4f}, {:.4f}, {:.4f}, {:.4f}".format(Acc2, Prec2, Recll2, F2),
-				   "C3 : {:.4f}, {:.4f}, {:.4f}, {:.4f}".format(Acc3, Prec3, Recll3, F3),
-				   "C4 : {:.4f}, {:.4f}, {:.4f}, {:.4f}".format(Acc4, Prec4, Recll4, F4)]
-			for res_ in res:
-				print(res_)
-			logger.info(f"results: {res}")
-
-			is_best = early_stopping(
-				temp_mean_val_losses, Acc_all, F1, F2, F3, F4, 
-				model, self.args.modelName, "{}{}".format(self.datasetName, self.foldnum)
-			)
-			accs = Acc_all
-
-			if early_stopping.early_stop:
-				print("Early stopping")
-				logger.info(f"Early stopping")
-				accs = early_stopping.accs
-				F1 = early_stopping.F1
-				F2 = early_stopping.F2
-				F3 = early_stopping.F3
-				F4 = early_stopping.F4
-				break
-			torch.cuda.empty_cache()
-
-			logger.info(f"acc {accs}, F1 {F1} | F2 {F2} | F3 {F3} | F4 {F4} ")
-
-			## TODO: add recording best scores!
-			if is_best:
-				#best_metrics = {
-				#	"Acc.": accs, "macroF": (F1 + F2 + F3 + F4) / self.args.n_classes, 
-				#	"Acc1": np.mean(temp_val_Acc1), "Prec1": np.mean(temp_val_Prec1), "Recll1": np.mean(temp_val_Recll1), "F1": F1, 
-				#	"Acc2": np.mean(temp_val_Acc2), "Prec2": np.mean(temp_val_Prec2), "Recll2": np.mean(temp_val_Recll2), "F2": F2, 
-				#	"Acc3": np.mean(temp_val_Acc3), "Prec3": np.mean(temp_val_Prec3), "Recll3": np.mean(temp_val_Recll3), "F3": F3, 
-				#	"Acc4": np.mean(temp_val_Acc4), "Prec4": np.mean(temp_val_Prec4), "Recll4": np.mean(temp_val_Recll4), "F4": F4, 
-				#}
-				best_metrics = {
-					"Acc.": accs, "macroF": (F1 + F2 + F3 + F4) / self.args.n_classes, 
-					"Acc1": Acc1, "Prec1": Prec1, "Recll1": Recll1, "F1": F1, 
-					"Acc2": Acc2, "Prec2": Prec2, "Recll2": Recll2, "F2": F2, 
-					"Acc3": Acc3, "Prec3": Prec3, "Recll3": Recll3, "F3": F3, 
-					"Acc4": Acc4, "Prec4": Prec4, "Recll4": Recll4, "F4": F4, 
-				}
-
-		fw.write("{:4d}\t{:.0E}\t{:.0E}\t{:.4f}\t{:.4f}\t{:.4f}\t{:.4f}\t{:.4f}\t{:.4f}\t{:.4f}\t{:.4f}\t{:.4f}\t{:.4f}\t{:.4f}\t{:.4f}\t{:.4f}\t{:.4f}\t{:.4f}\t{:.4f}\t{:.4f}\t{:.4f}\t{:.4f}\n".format(
+	def train(self, load=False):
+		if load:
+			model = self.load_model(self.config.pretrained_model_path)
+		self.setup()
+
+		print("\nStart training...")
+		try:
+			if not self.early_stopping.early_stop:
+				for epoch in range(self.start_epoch, self.args.n_epochs):
+					self.train_epoch(epoch)
+					stop = False
+					if self.should_evaluate(epoch):
+						val_loss, metrics = self.evaluate(epoch)
+						stop = self.update_best(epoch, val_loss, metrics)
+					self.save_checkpoint(epoch + 1)
+					if stop:
+						break
+		finally:
+			if self.profiler is not None:
+				self.profiler.finish()
+			if self.checkpointer is not None:
+				self.checkpointer.close()
+
+		self.write_result()
+
+	def maybe_checkpoint(self, epoch, next_batch, epoch_stats):
+		"""Save `last.pt` mid-epoch every `--ckpt_every_steps` batches or `--ckpt_every_min` minutes."""
+		if self.checkpointer is None:
+			return
+		every_steps, every_min = self.args.ckpt_every_steps, self.args.ckpt_every_min
+		if (every_steps > 0 and next_batch % every_steps == 0) or \
+		   (every_min > 0 and time.time() - self.last_ckpt_time >= every_min * 60):
+			self.save_checkpoint(epoch, next_batch, epoch_stats)
+
+	def save_checkpoint(self, next_epoch, next_batch=0, epoch_stats=None):
+		if self.checkpointer is None:
+			return
+		self.checkpointer.save(self.state_dict(next_epoch, next_batch, epoch_stats), os.path.join(self.ckpt_dir, "last.pt"))
+		self.last_ckpt_time = time.time()
+
+	def write_result(self):
+		if not self.is_main or self.best_metrics is None:
+			return
+		os.makedirs(self.args.result_path, exist_ok=True)
+		append_result(self.result_file, self.format_result(self.best_metrics), header=self.result_header())
+
+	def state_dict(self, next_epoch, next_batch=0, epoch_stats=None):
+		"""
+		Training state before batch `next_batch` of `next_epoch`, enough to continue 
+		with `load_state_dict` in a new process. `epoch_stats` are the summed losses 
+		and accuracies of the batches of `next_epoch` already trained on.
+		"""
+		model = self.model.module if isinstance(self.model, DistributedDataParallel) else self.model
+		return {
+			"next_epoch": next_epoch,
+			"next_batch": next_batch,
+			"epoch_stats": epoch_stats,
+			"rng": rng_state(),
+			"args": vars(self.args),
+			"model": model.state_dict(),
+			"optimizer": self.optimizer.state_dict(),
+			"early_stopping": self.early_stopping.state_dict(),
+			"best_metrics": self.best_metrics,
+			"train_losses": self.train_losses,
+			"val_losses": self.val_losses,
+			"train_accs": self.train_accs,
+		}
+
+	def load_state_dict(self, state):
+		model = self.model.module if isinstance(self.model, DistributedDataParallel) else self.model
+		model.load_state_dict(state["model"])
+		self.optimizer.load_state_dict(state["optimizer"])
+		self.early_stopping.load_state_dict(state["early_stopping"])
+		self.best_metrics = state["best_metrics"]
+		self.train_losses = state["train_losses"]
+		self.val_losses = state["val_losses"]
+		self.train_accs = state["train_accs"]
+		self.start_epoch = state["next_epoch"]
+		self.start_batch = state["next_batch"]
+		self.epoch_stats = state["epoch_stats"]
+		set_rng_state(state["rng"])
+
+	def save_state(self, path, next_epoch):
+		os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+		torch.save(self.state_dict(next_epoch), path + ".tmp")
+		os.replace(path + ".tmp", path)
+
+	def load_state(self, path):
+		state = torch.load(path, map_location=self.device)
+		## A state of another run (e.g. another sweep configuration sharing `ckpt_dir`) must not be continued
+		saved = state.get("args", {})
+		mismatch = ["{}={} (current {})".format(key, saved[key], getattr(self.args, key)) for key in RESUME_KEYS if key in saved and saved[key] != getattr(self.args, key)]
+		if mismatch:
+			raise ValueError("{} was written by another run: {}".format(path, ", ".join(mismatch)))
+		self.load_state_dict(state)
+
+	def result_header(self):
+		return "{:4s}\t{:6s}\t{:6s}\t{:6s}\t{:6s}\t{:6s}\t{:6s}\t{:6s}\t{:6s}\t{:6s}\t{:6s}\t{:6s}\t{:6s}\t{:6s}\t{:6s}\t{:6s}\t{:6s}\t{:6s}\t{:6s}\t{:6s}\t{:6s}\t{:6s}\n".format(
+			"Fold", "lr", "glr", "dropout", 
+			"Acc.", "macroF", 
+			"Acc1", "Prec1", "Recll1", "F1",
+			"Acc2", "Prec2", "Recll2", "F2",
+			"Acc3", "Prec3", "Recll3", "F3",
+			"Acc4", "Prec4", "Recll4", "F4"
+		)
+
+	def format_result(self, best_metrics):
+		return "{:4d}\t{:.0E}\t{:.0E}\t{:.4f}\t{:.4f}\t{:.4f}\t{:.4f}\t{:.4f}\t{:.4f}\t{:.4f}\t{:.4f}\t{:.4f}\t{:.4f}\t{:.4f}\t{:.4f}\t{:.4f}\t{:.4f}\t{:.4f}\t{:.4f}\t{:.4f}\t{:.4f}\t{:.4f}\n".format(
 			self.args.foldnum, self.args.learningRate, self.args.learningRateGraph, self.args.dropout_gat, best_metrics["Acc."] , best_metrics["macroF"], 
 			best_metrics["Acc1"], best_metrics["Prec1"], best_metrics["Recll1"], best_metrics["F1"],
 			best_metrics["Acc2"], best_metrics["Prec2"], best_metrics["Recll2"], best_metrics["F2"],
 			best_metrics["Acc3"], best_metrics["Prec3"], best_metrics["Recll3"], best_metrics["F3"],
 			best_metrics["Acc4"], best_metrics["Prec4"], best_metrics["Recll4"], best_metrics["F4"]
-		))
+		)
 
 	def run(self):
-		self.train()
+		try:
+			self.train()
+		finally:
+			cleanup()
 
 def main():
-	parser = argparse.ArgumentParser()
-
-	#Required parameters
-	parser.add_argument("--seed", type=int, default=42, help="random seed number for initialization")
-	parser.add_argument("--mode", default="DUCK", type=str, help="pick from CommentTree, UserTree or DUCK")
-	parser.add_argument("--baseDirectory", type=str, default=".", help="the data directory")
-	parser.add_argument("--foldnum", default=0, type=int, help="The fold number to test out")
-	parser.add_argument("--datasetName", default=None, type=str, required=True, help="The name of the dataset to play with")
-	parser.add_argument("--n_classes", default=4, type=int, help="4 for Twitter15/Twitter16, 3 for semeval2019")
-	parser.add_argument("--result_path", type=str, default="./result")
-
-	#Hyper-parameters
-	parser.add_argument("--bertVersion", default="bert-base-uncased", type=str, help="set up the bert version")
-	parser.add_argument("--weight_decay", default=0.0, type=float, help="the weight decay")
-	parser.add_argument("--learningRate", default=5e-5, type=float, help="the initial learning rate")
-	parser.add_argument("--learningRateGraph", default=1e-5, type=float, help="the inital learning rate for GNN")
-	parser.add_argument("--patience"    , default= 10, type=int, help="early stop patience")
-	parser.add_argument("--n_epochs"    , default= 10, type=int, help="fine tuning epoches")
-	parser.add_argument("--batchsize"   , default=256, type=int, help="batch size")
-	parser.add_argument("--multi_gpu"   , default=  0, type=int, help="number of GPUs")
-	parser.add_argument("--dropout_gat" , default=0.5, type=float)
-	parser.add_argument("--max_tree_len", default=1000, type=int, help="maximum tree length, for less GPU memory during training")
-
-	#pick up the model to play with
-	parser.add_argument("--modelName", default=None, required=True, type=str, help="pick up the model to play with")
-
-	args = parser.parse_args()
+	args = get_parser().parse_args()
 
 	print("\n*** Hyperparameters ***")
 	print("lr_bert: {:.0E}".format(args.learningRate))
 	print("lr_gnn : {:.0E}".format(args.learningRateGraph))
 	print("dropout: {:.4f}".format(args.dropout_gat))
+	print("bert   : {}".format(args.bertVersion))
+
+	launch(run, args)
 
+def run(args):
 	duck = DUCK(args)
 	duck.run()
 
@@ -1,5 +1,5 @@
+import os
 import re
-import ipdb
 import pickle
 import numpy as np
 import networkx as nx
@@ -7,12 +7,35 @@ import matplotlib.pyplot as plt
 from sklearn.metrics import roc_auc_score, average_precision_score, accuracy_score
 
 import torch
-from transformers import BertTokenizer
+from transformers import BertTokenizer, BertConfig
 
-# Load the BERT tokenizer
-tokenizer = BertTokenizer.from_pretrained('bert-base-uncased', do_lower_case=True)
+try:
+	import fcntl
+except ImportError: ## Windows
+	fcntl = None
+
+# The BERT tokenizer is loaded on first use, see `get_tokenizer`
 MAX_LEN = 40
 
+## Tokenizers & configs keyed by `--bertVersion` (hub name or local path)
+_TOKENIZERS = {}
+_BERT_CONFIGS = {}
+
+def get_tokenizer(bert_version="bert-base-uncased"):
+	"""Load the tokenizer of `bert_version` once and reuse it afterwards."""
+	if bert_version not in _TOKENIZERS:
+		_TOKENIZERS[bert_version] = BertTokenizer.from_pretrained(bert_version, do_lower_case=True)
+	return _TOKENIZERS[bert_version]
+
+def get_bert_config(bert_version="bert-base-uncased"):
+	if bert_version not in _BERT_CONFIGS:
+		_BERT_CONFIGS[bert_version] = BertConfig.from_pretrained(bert_version)
+	return _BERT_CONFIGS[bert_version]
+
+def get_bert_hidden_size(bert_version="bert-base-uncased"):
+	"""Hidden size of the encoder, e.g. 768 for bert-base, 256/512 for small local checkpoints."""
+	return get_bert_config(bert_version).hidden_size
+
 # Create a function to tokenize a set of texts
 def preprocessing_for_bert(data):
 	"""Perform required preprocessing steps for pretrained BERT.
@@ -21,6 +44,7 @@ def preprocessing_for_bert(data):
 	@return   attention_masks (torch.Tensor): Tensor of indices specifying which
 				  tokens should be attended to by the model.
 	"""
+	tokenizer = get_tokenizer()
 	# Create empty lists to store outputs
 	input_ids = []
 	attention_masks = []
@@ -76,6 +100,7 @@ def text_preprocessing(text):
 
 
 def preprocessing_for_bert_single(tweet_id):
+	tokenizer = get_tokenizer()
 	# Create empty lists to store outputs
 	input_ids = []
 	attention_masks = []
@@ -102,6 +127,7 @@ def preprocessing_for_bert_single(tweet_id):
 	return input_ids, attention_masks
 
 def preprocessing_for_bert_combo(tweet_id):
+	tokenizer = get_tokenizer()
 	# Create empty lists to store outputs
 	#import pandas as pd
 	input_file = '/content/drive/MyDrive/Twitter_tree_2021/pair_dataframe_twitter15/twitter15_source_replies_pair.pkl'
@@ -135,6 +161,7 @@ def preprocessing_for_bert_combo(tweet_id):
 
 
 def preprocessing_for_bert_latest(root_node, node_content):
+	tokenizer = get_tokenizer()
 	# Create empty lists to store outputs
 	input_ids = []
 	attention_masks = []
@@ -176,6 +203,7 @@ def preprocessing_for_bert_latest(root_node, node_content):
 
 
 def preprocessing_for_bert_seq(root_node,node_content):
+	tokenizer = get_tokenizer()
 	input_ids = []
 	attention_masks = []
 	
@@ -204,9 +232,9 @@ def preprocessing_for_bert_seq(root_node,node_content):
 
 
 
-# Load the BERT tokenizer
-tokenizer = BertTokenizer.from_pretrained('bert-base-uncased', do_lower_case=True)
+# The BERT tokenizer is loaded on first use, see `get_tokenizer`
 MAX_LEN = 40
+MAX_LEN_SEQ = 384
 
 # Create a function to tokenize a set of texts
 def preprocessing_for_bert(data):
@@ -216,6 +244,7 @@ def preprocessing_for_bert(data):
 	@return   attention_masks (torch.Tensor): Tensor of indices specifying which
 				  tokens should be attended to by the model.
 	"""
+	tokenizer = get_tokenizer()
 	# Create empty lists to store outputs
 	input_ids = []
 	attention_masks = []
@@ -271,6 +300,7 @@ def text_preprocessing(text):
 
 
 def preprocessing_for_bert_single(tweet_id):
+	tokenizer = get_tokenizer()
 	# Create empty lists to store outputs
 	input_ids = []
 	attention_masks = []
@@ -297,6 +327,7 @@ def preprocessing_for_bert_single(tweet_id):
 	return input_ids, attention_masks
 
 def preprocessing_for_bert_combo(tweet_id):
+	tokenizer = get_tokenizer()
 	# Create empty lists to store outputs
 	#import pandas as pd
 	input_file = '/content/drive/MyDrive/Twitter_tree_2021/pair_dataframe_twitter15/twitter15_source_replies_pair.pkl'
@@ -329,7 +360,9 @@ def preprocessing_for_bert_combo(tweet_id):
 	return input_ids, attention_masks
 
 
-def preprocessing_for_bert_latest(root_node, node_content):
+def preprocessing_for_bert_latest(root_node, node_content, bert_version="bert-base-uncased"):
+	tokenizer = get_tokenizer(bert_version)
+
 	# Create empty lists to store outputs
 	input_ids = []
 	attention_masks = []
@@ -373,7 +406,9 @@ def preprocessing_for_bert_latest(root_node, node_content):
 	return input_ids, attention_masks
 
 
-def preprocessing_for_bert_seq(root_node,node_content):
+def preprocessing_for_bert_seq(root_node, node_content, bert_version="bert-base-uncased"):
+	tokenizer = get_tokenizer(bert_version)
+
 	input_ids = []
 	attention_masks = []
 	
@@ -386,7 +421,6 @@ def preprocessing_for_bert_seq(root_node,node_content):
 	#print("len root_node:", len(root_node))
 	#print("rootnode[0]:", root_node[0])
 	
-	MAX_LEN_SEQ = 384
 	encoded_sent = tokenizer.encode_plus(
 		text=root_node[0],
 		text_pair=root_node.tolist() + node_lst,
@@ -403,15 +437,38 @@ def preprocessing_for_bert_seq(root_node,node_content):
 	return input_ids, attention_masks
 
 
+def append_result(result_file, line, header=None):
+	"""
+	Append one result line to `result_file`, writing `header` first if the file is new.
+	The file is locked while writing so that concurrent runs (e.g. `sweep.py`) do not interleave.
+	"""
+	with open(result_file, "a") as fw:
+		if fcntl is not None:
+			fcntl.flock(fw, fcntl.LOCK_EX)
+		try:
+			fw.seek(0, os.SEEK_END) ## Another run may have written since `open`
+			if header is not None and fw.tell() == 0:
+				fw.write(header)
+			fw.write(line)
+			fw.flush()
+		finally:
+			if fcntl is not None:
+				fcntl.flock(fw, fcntl.LOCK_UN)
+
+
 class EarlyStopping:
 	"""Early stops the training if validation loss doesn't improve after a given patience."""
-	def __init__(self, args, patience=10, verbose=False):
+	def __init__(self, args, patience=10, verbose=False, checkpointer=None, best_path=None):
 		"""
 		Args:
 			patience (int): How long to wait after last time validation loss improved.
 							Default:
 			verbose (bool): If True, prints a message for each validation loss improvement.
 							Default: False
+			checkpointer (AsyncCheckpointer): Writes `best_path` in the background when given.
+							Default: None
+			best_path (str): Where the best model is saved, nothing is saved when None.
+							Default: None
 		"""
 		self.patience = patience
 		self.verbose = verbose
@@ -427,6 +484,8 @@ class EarlyStopping:
 
 		self.args = args
 		self.best_metrics = None
+		self.checkpointer = checkpointer
+		self.best_path = best_path
 
 	def __call__(self, val_loss, acc, F1, F2, F3, F4, model, modelname, str):
 		#score = -val_loss
@@ -443,6 +502,8 @@ class EarlyStopping:
 			self.F3 = F3
 			self.F4 = F4
 			#self.save_checkpoint(val_loss, model, modelname, str)
+			if self.best_path is not None:
+				self.save_checkpoint(val_loss, model, modelname, str)
 
 			return is_best
 		elif score < self.best_score:
@@ -460,13 +521,29 @@ class EarlyStopping:
 			self.F3 = F3
 			self.F4 = F4
 			#self.save_checkpoint(val_loss, model,modelname,str)
+			if self.best_path is not None:
+				self.save_checkpoint(val_loss, model, modelname, str)
 			self.counter = 0
 
 			return is_best
 
+	def state_dict(self):
+		return {key: value for key, value in self.__dict__.items() if key not in ("args", "checkpointer", "best_path")}
+
+	def load_state_dict(self, state):
+		self.__dict__.update(state)
+
 	def save_checkpoint(self, val_loss, model,modelname,str):
 		'''Saves model when validation loss decrease.'''
-		torch.save(model.state_dict(),modelname+str+'.m')
+		if self.best_path is None:
+			torch.save(model.state_dict(),modelname+str+'.m')
+		else:
+			model = model.module if hasattr(model, "module") else model ## unwrap DistributedDataParallel
+			state = {"model": model.state_dict(), "args": vars(self.args), "val_loss": val_loss, "score": self.best_score}
+			if self.checkpointer is not None:
+				self.checkpointer.save(state, self.best_path)
+			else:
+				torch.save(state, self.best_path)
 		self.val_loss_min = val_loss
 
 